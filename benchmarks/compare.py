@@ -0,0 +1,53 @@
+"""Compares two result files of benchmarks/sync_phases.py, e.g. from the main branch and from a change.
+
+    python benchmarks/compare.py baseline.json results.json --threshold 1.2
+
+Prints the time of every phase in both runs and their ratio. Exits with status 1 if any phase became slower than
+threshold times the baseline, ignoring phases that take less than --min-seconds in both runs.
+"""
+
+import sys
+import json
+import argparse
+
+
+def compare(baseline: dict, current: dict, threshold: float, min_seconds: float) -> list:
+    """Returns (scenario, phase, baseline seconds, current seconds, regressed) for every phase in both results"""
+    rows = []
+    for scenario, phases in baseline["results"].items():
+        for phase, before in phases.items():
+            after = current["results"].get(scenario, {}).get(phase)
+            if phase == "requests" or after is None:
+                continue
+            regressed = max(before, after) >= min_seconds and after > threshold * before
+            rows.append((scenario, phase, before, after, regressed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=1.2)
+    parser.add_argument("--min-seconds", type=float, default=0.01)
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    if baseline["meta"].get("shape") != current["meta"].get("shape"):
+        print("Warning: the results were measured on packages with a different shape")
+
+    print(f"Baseline {baseline['meta'].get('commit')}, current {current['meta'].get('commit')}")
+    rows = compare(baseline, current, args.threshold, args.min_seconds)
+    for scenario, phase, before, after, regressed in rows:
+        ratio = after / before if before else float("inf")
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{scenario:>10} {phase:>10}  {before:8.3f}s -> {after:8.3f}s  x{ratio:5.2f}{flag}")
+    if any(row[-1] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Measures the peak memory allocated while hashing files of increasing size.
+
+Run from the repository root:
+
+    python benchmarks/hash_memory.py --sizes-mb 1 16 128 512 --buffer-size 1048576
+
+With streaming hashing the peak stays at roughly the buffer size, whatever the size of the file.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dbfsps.syncer.file import calculate_file_hash, HASH_BUFFER_SIZE  # noqa: E402
+
+
+def write_file(path: str, size: int, chunk_size: int = 1024 * 1024):
+    chunk = os.urandom(min(chunk_size, size))
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            f.write(chunk[:remaining])
+            remaining -= len(chunk)
+
+
+def measure(path: str, buffer_size: int) -> dict:
+    tracemalloc.start()
+    start = time.perf_counter()
+    calculate_file_hash(path, buffer_size=buffer_size)
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": round(duration, 4), "peak_bytes": peak}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-mb", type=int, nargs="+", default=[1, 16, 128])
+    parser.add_argument("--buffer-size", type=int, default=HASH_BUFFER_SIZE)
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size_mb in args.sizes_mb:
+            path = os.path.join(tmp, f"{size_mb}mb.bin")
+            write_file(path, size_mb * 1024 * 1024)
+            result = {"size_mb": size_mb, "buffer_size": args.buffer_size, **measure(path, args.buffer_size)}
+            os.remove(path)
+            results.append(result)
+            print(f"{size_mb:>6} MB  {result['seconds']:>8.3f} s  peak {result['peak_bytes'] / 1024:>10.1f} KiB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
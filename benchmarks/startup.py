@@ -0,0 +1,81 @@
+"""Measures the startup time of the CLI on the dry-run path, where no request is sent to Databricks, and enforces a
+budget for it.
+
+Every run starts a new interpreter that runs `dbfsps <package> --dry-run` on a small synthetic package. The fastest of
+the runs, minus the startup time of a bare interpreter, is compared with the budget. The run also fails if a dry run
+imports one of the client libraries that are only needed to connect to Databricks.
+
+Run from the repository root:
+
+    python benchmarks/startup.py --budget 0.5
+
+Exits with status 1 if the budget is exceeded or a client library was imported.
+"""
+
+import os
+import sys
+import time
+import json
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import generate_package  # noqa: E402
+
+PACKAGE = "bench"
+# Only needed once the Dbfs client is built
+HEAVY_MODULES = ["databricks_cli", "requests", "urllib3", "pkg_resources"]
+
+DRY_RUN = """
+import sys, json
+from dbfsps.cli.databricks_sync import databricks_sync_api
+try:
+    databricks_sync_api(["{package}", "--profile", "bench", "--dry-run"], standalone_mode=False)
+finally:
+    print(json.dumps([name for name in {heavy} if name in sys.modules]), file=sys.stderr)
+"""
+
+
+def run(code: str, cwd: str) -> float:
+    """Runs code in a new interpreter and returns the wall time in seconds"""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=cwd, check=True, capture_output=True)
+    return time.perf_counter() - start
+
+
+def get_imported_heavy_modules(cwd: str) -> list:
+    code = DRY_RUN.format(package=PACKAGE, heavy=HEAVY_MODULES)
+    result = subprocess.run([sys.executable, "-c", code], cwd=cwd, check=True, capture_output=True, text=True)
+    return json.loads(result.stderr.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=0.5, help="Seconds on top of a bare interpreter")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        generate_package(tmp, PACKAGE, files=20, depth=1, fanout=2)
+        code = DRY_RUN.format(package=PACKAGE, heavy=[])
+        baseline = min(run("pass", tmp) for _ in range(args.repeat))
+        dry_run = min(run(code, tmp) for _ in range(args.repeat))
+        heavy = get_imported_heavy_modules(tmp)
+
+    startup = dry_run - baseline
+    print(f"Interpreter {baseline:.3f}s, dry run {dry_run:.3f}s, startup {startup:.3f}s (budget {args.budget:.3f}s)")
+    failed = False
+    if startup > args.budget:
+        print("Startup time exceeds the budget")
+        failed = True
+    if heavy:
+        print(f"A dry run imports {', '.join(heavy)}")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
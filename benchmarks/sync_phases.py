@@ -0,0 +1,187 @@
+"""Times the phases of a sync on a synthetic package: loading the State, scanning the package (Plan._get_local_files),
+planning (Plan._plan) and applying the plan (Plan.apply_plan) against a local stand-in for DBFS.
+
+Three scenarios are run in order: a first sync without a statefile, a sync without any changes, and a sync after
+modifying a fraction of the files. Every scenario is repeated on a fresh copy and the fastest run is reported.
+
+Run from the repository root:
+
+    python benchmarks/sync_phases.py --shape many-small --repeat 3 --output results.json
+
+Compare the results of two commits with benchmarks/compare.py.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import add_shape_arguments, generate_package, get_shape, modify_files  # noqa: E402
+from dbfsps.syncer.plan import Plan  # noqa: E402
+from dbfsps.syncer.state import State  # noqa: E402
+
+PACKAGE = "bench"
+REMOTE_PATH = "dbfs:/FileStore/packages/bench"
+SCENARIOS = ["initial", "unchanged", "modified"]
+
+
+class LocalDbfs:
+    """Stand-in for the Dbfs client that copies uploads to a local directory
+
+    :param remote_root:
+        Local directory that stands in for the root of DBFS
+    :param latency:
+        Seconds to sleep for every request, to simulate the network
+    """
+
+    def __init__(self, remote_root: str, latency: float = 0.0):
+        self.remote_root = remote_root
+        self.latency = latency
+        self.requests = 0
+
+    def _local(self, dbfs_path: str) -> str:
+        return os.path.join(self.remote_root, dbfs_path.replace("dbfs:/", ""))
+
+    def _request(self):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def cp(self, source, destination, overwrite=False):
+        self._request()
+        os.makedirs(os.path.dirname(self._local(destination)), exist_ok=True)
+        shutil.copyfile(source, self._local(destination))
+
+    def rm(self, dbfs_path, recursive=False):
+        self._request()
+        if recursive:
+            shutil.rmtree(self._local(dbfs_path))
+        else:
+            os.remove(self._local(dbfs_path))
+
+    def mkdirs(self, dbfs_path):
+        self._request()
+        os.makedirs(self._local(dbfs_path), exist_ok=True)
+
+
+class TimedPlan(Plan):
+    """Plan that records how long scanning and planning take"""
+
+    def __init__(self, *args, **kwargs):
+        self.timings = {}
+        super().__init__(*args, **kwargs)
+
+    def _get_local_files(self, *args, **kwargs):
+        start = time.perf_counter()
+        super()._get_local_files(*args, **kwargs)
+        self.timings["scan"] = time.perf_counter() - start
+
+    def _plan(self):
+        start = time.perf_counter()
+        super()._plan()
+        self.timings["plan"] = time.perf_counter() - start
+
+
+def sync(root: str, dbfs: LocalDbfs, state_backend: str, jobs: int) -> dict:
+    """Runs one sync and returns the duration of every phase in seconds"""
+    start = time.perf_counter()
+    state = State(root, PACKAGE, backend=state_backend)
+    timings = {"load_state": time.perf_counter() - start}
+
+    plan = TimedPlan(state, REMOTE_PATH)
+    timings.update(plan.timings)
+
+    requests_before = dbfs.requests
+    start = time.perf_counter()
+    plan.apply_plan(dbfs, jobs=jobs)
+    timings["apply"] = time.perf_counter() - start
+    timings["total"] = sum(timings.values())
+    timings["requests"] = dbfs.requests - requests_before
+    return timings
+
+
+def run_scenarios(template: str, args: argparse.Namespace) -> dict:
+    """Runs all scenarios on a fresh copy of the template project"""
+    with tempfile.TemporaryDirectory() as tmp:
+        root = os.path.join(tmp, "project")
+        shutil.copytree(template, root)
+        dbfs = LocalDbfs(os.path.join(tmp, "dbfs"), latency=args.latency)
+        results = {"initial": sync(root, dbfs, args.state_backend, args.jobs)}
+        results["unchanged"] = sync(root, dbfs, args.state_backend, args.jobs)
+        modify_files(os.path.join(root, PACKAGE), args.modify_fraction, seed=args.seed)
+        results["modified"] = sync(root, dbfs, args.state_backend, args.jobs)
+    return results
+
+
+def best_of(runs: list) -> dict:
+    """The fastest time of every phase over all runs, per scenario"""
+    return {
+        scenario: {phase: min(run[scenario][phase] for run in runs) for phase in runs[0][scenario]}
+        for scenario in SCENARIOS
+    }
+
+
+def get_commit() -> str:
+    try:
+        return (
+            subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_shape_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--jobs", type=int, default=8)
+    parser.add_argument("--state-backend", choices=["text", "sqlite"], default="text")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds per simulated DBFS request")
+    parser.add_argument("--modify-fraction", type=float, default=0.05)
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    shape = get_shape(args)
+    with tempfile.TemporaryDirectory() as tmp:
+        template = os.path.join(tmp, "template")
+        total_size = generate_package(template, PACKAGE, **shape)
+        runs = [run_scenarios(template, args) for _ in range(args.repeat)]
+
+    results = best_of(runs)
+    for scenario, timings in results.items():
+        phases = "  ".join(f"{phase} {seconds:8.3f}s" for phase, seconds in timings.items() if phase != "requests")
+        print(f"{scenario:>10}  {phases}  requests {timings['requests']}")
+
+    if args.output:
+        report = {
+            "meta": {
+                "commit": get_commit(),
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "shape": shape,
+                "total_size": total_size,
+                "repeat": args.repeat,
+                "jobs": args.jobs,
+                "state_backend": args.state_backend,
+                "latency": args.latency,
+                "modify_fraction": args.modify_fraction,
+            },
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""Generates synthetic packages to benchmark against.
+
+A package has a number of files spread over a tree of directories with a given depth and fan-out. File sizes are
+drawn from a log-uniform distribution between a minimum and maximum size, so most files are small and a few are large.
+Generation is deterministic for a given seed.
+
+Run from the repository root to create a package without benchmarking it:
+
+    python benchmarks/synthetic.py /tmp/bench --shape many-small
+"""
+
+import os
+import math
+import random
+import argparse
+
+SHAPES = {
+    # Typical source package: thousands of small .py files in a nested tree
+    "many-small": {"files": 10000, "depth": 4, "fanout": 6, "min_size": 200, "max_size": 16 * 1024},
+    # A few large artifacts such as models or wheels
+    "few-huge": {"files": 4, "depth": 1, "fanout": 1, "min_size": 64 * 1024 * 1024, "max_size": 256 * 1024 * 1024},
+    # Mixed source files and data files
+    "mixed": {"files": 2000, "depth": 3, "fanout": 5, "min_size": 100, "max_size": 8 * 1024 * 1024},
+    # Small enough for a quick check
+    "tiny": {"files": 100, "depth": 2, "fanout": 3, "min_size": 100, "max_size": 4 * 1024},
+}
+
+PYPROJECT = """[tool.poetry]
+name = "bench"
+version = "0.1.0"
+description = ""
+authors = []
+
+[tool.poetry.dependencies]
+python = "^3.8"
+"""
+
+POETRY_LOCK = """package = []
+
+[metadata]
+lock-version = "1.1"
+python-versions = "^3.8"
+content-hash = "0"
+"""
+
+
+def generate_package(
+    root: str,
+    package: str = "bench",
+    files: int = 100,
+    depth: int = 2,
+    fanout: int = 3,
+    min_size: int = 100,
+    max_size: int = 4096,
+    seed: int = 0,
+) -> int:
+    """Writes a package with synthetic files to root/package, plus the pyproject.toml and poetry.lock that a
+    plan needs in root
+
+    :param root:
+        Directory to create the project in
+    :param package:
+        Name of the package directory
+    :param files:
+        Number of files
+    :param depth:
+        Number of directory levels below the package directory
+    :param fanout:
+        Number of subdirectories per directory
+    :param min_size:
+        Size of the smallest files in bytes
+    :param max_size:
+        Size of the largest files in bytes
+    :param seed:
+    :returns:
+        The total size of the files in bytes
+    """
+    rng = random.Random(seed)
+    dirs = [""]
+    level = [""]
+    for _ in range(depth):
+        level = [os.path.join(parent, f"sub{i}") for parent in level for i in range(fanout)]
+        dirs.extend(level)
+
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, "pyproject.toml"), "w") as f:
+        f.write(PYPROJECT)
+    with open(os.path.join(root, "poetry.lock"), "w") as f:
+        f.write(POETRY_LOCK)
+
+    block = rng.getrandbits(8 * 1024 * 1024).to_bytes(1024 * 1024, "little")
+    total = 0
+    for i in range(files):
+        rel_dir = dirs[i % len(dirs)]
+        size = int(math.exp(rng.uniform(math.log(max(1, min_size)), math.log(max(1, max_size)))))
+        path = os.path.join(root, package, rel_dir, f"module_{i}.py")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_file(path, size, block, offset=i)
+        total += size
+    return total
+
+
+def write_file(path: str, size: int, block: bytes, offset: int = 0):
+    """Writes size bytes taken from block, starting at offset so files of equal size have different contents"""
+    offset = offset % len(block)
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            chunk = block[offset : offset + remaining]
+            f.write(chunk)
+            remaining -= len(chunk)
+            offset = 0
+
+
+def modify_files(package_path: str, fraction: float, seed: int = 0) -> int:
+    """Appends to a fraction of the files in the package, to benchmark an incremental sync
+
+    :returns:
+        The number of modified files
+    """
+    paths = sorted(os.path.join(root, name) for root, _, names in os.walk(package_path) for name in names)
+    rng = random.Random(seed)
+    modified = rng.sample(paths, int(len(paths) * fraction))
+    for path in modified:
+        with open(path, "ab") as f:
+            f.write(b"# modified\n")
+    return len(modified)
+
+
+def add_shape_arguments(parser: argparse.ArgumentParser):
+    """Adds the options that describe the shape of the package. Explicit options override the shape preset"""
+    parser.add_argument("--shape", choices=sorted(SHAPES), default="tiny")
+    parser.add_argument("--files", type=int, default=None)
+    parser.add_argument("--depth", type=int, default=None)
+    parser.add_argument("--fanout", type=int, default=None)
+    parser.add_argument("--min-size", type=int, default=None, help="Bytes")
+    parser.add_argument("--max-size", type=int, default=None, help="Bytes")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def get_shape(args: argparse.Namespace) -> dict:
+    """The package shape from the parsed arguments"""
+    shape = dict(SHAPES[args.shape])
+    for key in shape:
+        value = getattr(args, key)
+        if value is not None:
+            shape[key] = value
+    shape["seed"] = args.seed
+    return shape
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root", help="Directory to create the project in")
+    parser.add_argument("--package", default="bench")
+    add_shape_arguments(parser)
+    args = parser.parse_args()
+
+    shape = get_shape(args)
+    total = generate_package(args.root, args.package, **shape)
+    print(f"Wrote {shape['files']} files ({total / 1024 / 1024:.1f} MiB) to {os.path.join(args.root, args.package)}")
+
+
+if __name__ == "__main__":
+    main()
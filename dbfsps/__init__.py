@@ -1,3 +1,3 @@
-import pkg_resources
+from importlib.metadata import version
 
-__version__ = pkg_resources.get_distribution("dbfs-package-sync").version
+__version__ = version("dbfs-package-sync")
@@ -1,17 +1,38 @@
 import os
+import json
 import logging
 import click
-from dbfsps.cli.utils import CONTEXT_SETTINGS, get_remote_path
+from typing import Tuple
+from dbfsps import stats
+from dbfsps.cli.utils import CONTEXT_SETTINGS, get_project_config
+from dbfsps.cli.targets import Target, apply_targets, get_targets
 from dbfsps.setupnotebook import SetupNotebook
 from dbfsps.syncer.state import State
-from dbfsps.syncer.plan import Plan
+from dbfsps.syncer.plan import Plan, scan_local_files
+from dbfsps.syncer.bundle import BundlePlan, LayeredBundlePlan, LAYERS_DIR, get_archive_name, get_layer_index_path
+from dbfsps.syncer.manifest import RemoteManifest
+from dbfsps.syncer.scanner import ScanRules
+from dbfsps.syncer.watch import Watcher
 from dbfsps.sdk.config import get_host_and_token
-from dbfsps.sdk.dbfs import Dbfs
 
 
 @click.command(context_settings=CONTEXT_SETTINGS)
 @click.argument("package_name")
-@click.option("--profile", "-p", default=None, help="Databricks CLI profile to use to make the connection.")
+@click.option(
+    "--profile",
+    "-p",
+    multiple=True,
+    help="Databricks CLI profile to use to make the connection. "
+    "Repeat to sync to several workspaces at once, each with its own status file (<status-file>.<profile>)",
+)
+@click.option(
+    "--targets-file",
+    "-t",
+    default=None,
+    type=click.Path(exists=True, dir_okay=False),
+    help="TOML file with a [[target]] table per workspace to sync to, "
+    "with a profile and optionally a remote-path and status-file",
+)
 @click.option(
     "--package-location",
     "-l",
@@ -32,6 +53,13 @@ from dbfsps.sdk.dbfs import Dbfs
     "If not provided, will first check PACKAGE_REMOTE_DIR variable, "
     "then use dbfs:/FileStore/packages/<package_name>",
 )
+@click.option(
+    "--state-backend",
+    type=click.Choice(["text", "sqlite"]),
+    default="text",
+    show_default=True,
+    help="How the status file is stored. A text status file is migrated automatically when switching to sqlite",
+)
 @click.option(
     "--delete-status-file", "-x", is_flag=True, default=False, help="Delete status file if exists to start over"
 )
@@ -48,16 +76,87 @@ from dbfsps.sdk.dbfs import Dbfs
     default=os.path.abspath(os.curdir),
     help="Absolute path to the root dir of the repository where you can find pyproject.toml",
 )
+@click.option(
+    "--jobs",
+    "-j",
+    type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+    help="Maximum number of concurrent uploads/deletions when applying the plan. "
+    "Lowered automatically while Databricks throttles requests",
+)
+@click.option(
+    "--watch",
+    "-w",
+    is_flag=True,
+    default=False,
+    help="Keep running and sync every change to the package as it happens. Stop with Ctrl+C",
+)
+@click.option(
+    "--debounce",
+    type=float,
+    default=0.3,
+    show_default=True,
+    help="In watch mode, seconds without file changes before a burst of changes is synced",
+)
+@click.option(
+    "--bundle",
+    type=click.Choice(["zip", "layered"]),
+    default=None,
+    help="Ship the package as a single archive instead of file by file. "
+    'With "layered", only an archive with the changes is uploaded on top of earlier archives. '
+    "The generated notebook imports the package from the archive(s)",
+)
+@click.option(
+    "--reconcile",
+    is_flag=True,
+    default=False,
+    help="List the remote path first and compare it with the status file. Files that are missing on DBFS or differ "
+    "in size are uploaded again, files already on DBFS are added to the status file. Also works with --dry-run",
+)
+@click.option(
+    "--shared-manifest",
+    is_flag=True,
+    default=False,
+    help="Plan against a manifest of the synced files stored on DBFS next to the package "
+    "(<remote-path>/.dbfsps_manifest.json) instead of the status file, and update it after syncing. "
+    "Machines without a status file, such as CI runners, then only upload what differs. Also works with --dry-run",
+)
+@click.option(
+    "--stats",
+    "print_stats",
+    is_flag=True,
+    default=False,
+    help="Print a JSON report with the time spent per phase, bytes hashed and uploaded and DBFS API calls",
+)
+@click.option("--stats-file", default=None, type=click.Path(dir_okay=False), help="Write the JSON report to this file")
+@click.option(
+    "--stats-hook",
+    multiple=True,
+    help="StatsHook to send the statistics to as they are recorded, as module:attribute. "
+    "The attribute is a StatsHook instance or a callable that returns one",
+)
 @click.option("-v", "--verbose", count=True)
 def databricks_sync_api(
     package_name: str,
     package_location: str,
     status_file: str,
     remote_path: str,
+    state_backend: str,
     delete_status_file: bool,
     dry_run: bool,
-    profile: str,
+    profile: Tuple[str, ...],
+    targets_file: str,
     root_path: str,
+    jobs: int,
+    watch: bool,
+    debounce: float,
+    bundle: str,
+    reconcile: bool,
+    shared_manifest: bool,
+    print_stats: bool,
+    stats_file: str,
+    stats_hook: Tuple[str, ...],
     verbose: int,
 ):
     """
@@ -75,32 +174,108 @@ def databricks_sync_api(
     if not os.path.isfile("pyproject.toml"):
         raise RuntimeError("Must be run from source root directory (where pyproject.toml is located)")
 
-    if delete_status_file:
-        try:
-            os.remove(status_file)
-        except FileNotFoundError:
-            pass
-
-    if not profile:
-        raise ValueError("Must specify a databricks-cli profile to use")
+    if reconcile and bundle:
+        raise click.BadOptionUsage("reconcile", "--reconcile can not be combined with --bundle")
+    if shared_manifest and bundle:
+        raise click.BadOptionUsage("shared_manifest", "--shared-manifest can not be combined with --bundle")
 
     package_name = package_name.replace("-", "_").lower()
 
-    remote_path = get_remote_path(remote_path, package_name)
+    if print_stats or stats_file or stats_hook:
+        collector = stats.StatsCollector(hooks=[stats.load_hook(spec) for spec in stats_hook])
+        stats.set_collector(collector)
+        # Also reports the statistics of a run that fails or is interrupted
+        click.get_current_context().call_on_close(lambda: write_stats_report(collector, print_stats, stats_file))
+
+    targets = get_targets(profile, targets_file, remote_path, status_file, package_name)
+    if watch and len(targets) > 1:
+        raise click.BadOptionUsage("watch", "--watch can only be used with a single target")
 
     if not package_location:
         package_location = package_name
 
+    remote_path = targets[0].remote_path
+    if any(target.remote_path != remote_path for target in targets):
+        logger.warning(f"The targets use different remote paths, the setup notebook is generated for {remote_path}")
     nb_path = f"init_{package_name}.py"
-    nb = SetupNotebook(remote_path.replace("dbfs:", "/dbfs"), nb_path)
-    if not os.path.isfile(nb.notebook_path):
+    archive_name = get_archive_name(package_location) if bundle == "zip" else None
+    layers_dir = LAYERS_DIR if bundle == "layered" else None
+    nb = SetupNotebook(remote_path.replace("dbfs:", "/dbfs"), nb_path, archive_name=archive_name, layers_dir=layers_dir)
+    if not nb.is_up_to_date():
+        # E.g. after switching --bundle modes, the old notebook would import a package that is no longer updated
+        if os.path.isfile(nb.notebook_path):
+            logger.warning(f"Regenerating {nb_path}, it does not match the current options")
         nb.generate_notebook_file()
 
-    st = State(root_path, package_location, statefilename=status_file)
-    plan = Plan(st, remote_path=remote_path)
-    plan.print_plan()
+    config = get_project_config(root_path)
+    rules = ScanRules.from_config(config)
+    local_files = None
+    for target in targets:
+        target.state = State(root_path, package_location, statefilename=target.status_file, backend=state_backend)
+        if delete_status_file:
+            target.state.reset()
+            try:
+                os.remove(get_layer_index_path(target.state.statefilepath))
+            except FileNotFoundError:
+                pass
+        if local_files is None:
+            # The package is scanned once, all targets share the files and their hashes
+            local_files = scan_local_files(target.state, rules)
+        target.plan = create_plan(target, bundle, rules, config, local_files)
+
+    for target in targets:
+        if reconcile or shared_manifest or not dry_run:
+            # Imported here, so a dry run does not have to load the Databricks and HTTP client libraries
+            from dbfsps.sdk.dbfs import Dbfs
+
+            with stats.phase("auth"):
+                host, token = get_host_and_token(profile=target.profile)
+            target.dbfs = Dbfs(host, token, max_concurrency=jobs)
+        if shared_manifest:
+            target.plan.use_manifest(RemoteManifest(target.dbfs, target.remote_path))
+        if reconcile:
+            target.plan.reconcile(target.dbfs, workers=jobs)
+        if len(targets) > 1:
+            print(f"Profile {target.profile}:")
+        target.plan.print_plan()
 
     if not dry_run:
-        host, token = get_host_and_token(profile=profile)
-        dbfs = Dbfs(host, token)
-        plan.apply_plan(dbfs)
+        if len(targets) == 1:
+            targets[0].plan.apply_plan(targets[0].dbfs, jobs=jobs)
+        else:
+            apply_targets(targets, jobs=jobs)
+        for target in targets:
+            connection_stats = target.dbfs.connection_stats()
+            logger.info(
+                f"Sent {connection_stats.requests} requests to {target.profile} over "
+                f"{connection_stats.connections} connections ({connection_stats.reused} reused)"
+            )
+
+    if watch:
+        Watcher(targets[0].plan, None if dry_run else targets[0].dbfs, jobs=jobs, debounce=debounce).run()
+
+
+def create_plan(target: Target, bundle: str, rules: ScanRules, config: dict, local_files: dict) -> Plan:
+    """Creates the plan for a target, for the given --bundle mode"""
+    kwargs = dict(remote_path=target.remote_path, rules=rules, local_files=local_files)
+    if bundle == "zip":
+        return BundlePlan(target.state, **kwargs)
+    if bundle == "layered":
+        return LayeredBundlePlan(
+            target.state,
+            max_deltas=config.get("bundle-max-deltas", 10),
+            max_delta_ratio=config.get("bundle-max-delta-ratio", 0.5),
+            **kwargs,
+        )
+    return Plan(target.state, **kwargs)
+
+
+def write_stats_report(collector: stats.StatsCollector, print_report: bool, path: str = None):
+    """Stops collecting statistics, and prints the report of --stats and/or writes it to path"""
+    stats.set_collector(None)
+    report = collector.report()
+    if print_report:
+        print(json.dumps(report, indent=2))
+    if path:
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,189 @@
+import os
+import re
+import logging
+from collections import deque
+from typing import Dict, List, Optional, Set
+
+try:
+    import tomllib
+except ModuleNotFoundError:  # Python < 3.11
+    import tomli as tomllib
+
+
+class RequirementsExportError(Exception):
+    pass
+
+
+_EXTRA_MARKER = re.compile(r"""\s*(?:\band\s+)?\(?\s*extra\s*==\s*["'][^"']*["']\s*\)?(?:\s+and\b)?\s*""")
+
+
+def export_requirements(root_dir: str) -> str:
+    """Creates the contents of a requirements.txt for the main dependencies of a poetry project,
+    by reading pyproject.toml and poetry.lock directly instead of running `poetry export`.
+
+    Each package pinned in the lockfile that is (transitively) required by the main dependencies is written as
+    `name==version`, with the environment markers of the dependency declarations that require it and the hashes of
+    its distribution files. Markers are not propagated from a package to its own dependencies, so a dependency of a
+    package that is only needed on some platforms may be installed everywhere.
+
+    :param root_dir:
+        Directory containing pyproject.toml and poetry.lock
+    :raises RequirementsExportError:
+        If the lockfile cannot be exported, e.g. because it is out of date or uses unsupported sources
+    """
+    logger = logging.getLogger(__name__)
+    with open(os.path.join(root_dir, "pyproject.toml"), "rb") as f:
+        pyproject = tomllib.load(f)
+    with open(os.path.join(root_dir, "poetry.lock"), "rb") as f:
+        lock = tomllib.load(f)
+
+    locked = {normalize_name(package["name"]): package for package in lock.get("package", [])}
+    legacy_hashes = lock.get("metadata", {}).get("files", {})
+
+    # Maps each required package to the set of markers under which it is required, None meaning always
+    markers: Dict[str, Optional[Set[str]]] = {}
+    extras: Dict[str, Set[str]] = {}
+    queue = deque()
+
+    def require(name: str, spec, via_extra: bool = False):
+        name = normalize_name(name)
+        for constraint in spec if isinstance(spec, list) else [spec]:
+            if isinstance(constraint, dict):
+                if constraint.get("optional") and not via_extra:
+                    continue
+                marker = _constraint_marker(constraint)
+                requested_extras = set(constraint.get("extras", []))
+            else:
+                marker, requested_extras = None, set()
+            if name not in locked:
+                raise RequirementsExportError(f"{name} is not in poetry.lock, the lockfile may be outdated")
+            known = markers.get(name, set())
+            changed = name not in markers or requested_extras - extras.get(name, set())
+            if marker is None:
+                changed = changed or known is not None
+                markers[name] = None
+            elif known is not None and marker not in known:
+                known.add(marker)
+                markers[name] = known
+                changed = True
+            extras.setdefault(name, set()).update(requested_extras)
+            if changed:
+                queue.append(name)
+
+    for name, spec in pyproject["tool"]["poetry"].get("dependencies", {}).items():
+        if name.lower() != "python":
+            require(name, spec)
+
+    while queue:
+        package = locked[queue.popleft()]
+        optional_names = set()
+        for extra in extras.get(normalize_name(package["name"]), set()):
+            for requirement in package.get("extras", {}).get(extra, []):
+                optional_names.add(normalize_name(re.split(r"[\s(\[;<>=!~]", requirement, maxsplit=1)[0]))
+        for name, spec in package.get("dependencies", {}).items():
+            require(name, spec, via_extra=normalize_name(name) in optional_names)
+
+    packages = [locked[name] for name in sorted(markers)]
+    hashes = {normalize_name(p["name"]): _package_hashes(p, legacy_hashes) for p in packages}
+    use_hashes = all(hashes.values())
+    if not use_hashes:
+        logger.warning("Not all packages in poetry.lock have file hashes, exporting requirements without hashes")
+
+    lines = []
+    for package in packages:
+        name = normalize_name(package["name"])
+        requirement = _requirement(package)
+        package_extras = sorted(extras.get(name, set()))
+        if package_extras:
+            requirement = requirement.replace(package["name"], f"{package['name']}[{','.join(package_extras)}]", 1)
+        if markers[name]:
+            alternatives = sorted(markers[name])
+            if len(alternatives) == 1:
+                requirement += f" ; {alternatives[0]}"
+            else:
+                requirement += " ; " + " or ".join(f"({m})" for m in alternatives)
+        if use_hashes:
+            requirement += "".join(f" \\\n    --hash={h}" for h in hashes[name])
+        lines.append(requirement)
+    return "\n".join(lines) + "\n"
+
+
+def normalize_name(name: str) -> str:
+    """Normalizes a package name as in PEP 503"""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def _requirement(package: dict) -> str:
+    source = package.get("source", {})
+    source_type = source.get("type")
+    if source_type in (None, "legacy"):
+        return f"{package['name']}=={package['version']}"
+    if source_type == "git":
+        reference = source.get("resolved_reference") or source.get("reference")
+        return f"{package['name']} @ git+{source['url']}@{reference}"
+    if source_type == "url":
+        return f"{package['name']} @ {source['url']}"
+    raise RequirementsExportError(f"Unable to export {package['name']}, {source_type} dependencies are not supported")
+
+
+def _package_hashes(package: dict, legacy_hashes: dict) -> List[str]:
+    files = package.get("files") or legacy_hashes.get(package["name"], [])
+    return sorted(file["hash"] for file in files if "hash" in file)
+
+
+def _constraint_marker(constraint: dict) -> Optional[str]:
+    parts = []
+    marker = _EXTRA_MARKER.sub(" ", constraint.get("markers", "")).strip()
+    if marker:
+        parts.append(marker)
+    if "python" in constraint:
+        python_marker = python_constraint_to_marker(constraint["python"])
+        if python_marker:
+            parts.append(python_marker)
+    if not parts:
+        return None
+    if len(parts) == 1:
+        return parts[0]
+    return " and ".join(f"({part})" for part in parts)
+
+
+def python_constraint_to_marker(constraint: str) -> Optional[str]:
+    """Converts a poetry python version constraint, such as "^3.8" or ">=3.7,<3.11", to an environment marker"""
+    alternatives = []
+    for alternative in constraint.split("||"):
+        clauses = []
+        for clause in alternative.replace(",", " ").split():
+            match = re.fullmatch(r"(\^|~=|~|>=|<=|==|!=|>|<)?([0-9][0-9.*]*)", clause)
+            if clause == "*":
+                continue
+            if not match:
+                raise RequirementsExportError(f'Unsupported python constraint "{constraint}"')
+            op, version = match.group(1) or "==", match.group(2)
+            clauses.extend(_python_clauses(op, version))
+        if not clauses:
+            return None
+        alternatives.append(" and ".join(clauses))
+    if len(alternatives) == 1:
+        return alternatives[0]
+    return " or ".join(f"({a})" for a in alternatives)
+
+
+def _python_clauses(op: str, version: str) -> List[str]:
+    parts = version.split(".")
+    if op == "^":
+        upper = [str(int(parts[0]) + 1)] if parts[0] != "0" or len(parts) == 1 else ["0", str(int(parts[1]) + 1)]
+        return [_python_marker(">=", version), _python_marker("<", ".".join(upper))]
+    if op in ("~", "~="):
+        if len(parts) == 1 or (op == "~=" and len(parts) == 2):
+            upper = [str(int(parts[0]) + 1)]
+        else:
+            upper = [parts[0], str(int(parts[1]) + 1)]
+        return [_python_marker(">=", version), _python_marker("<", ".".join(upper))]
+    if version.endswith(".*"):
+        version = version[:-2]
+    return [_python_marker(op, version)]
+
+
+def _python_marker(op: str, version: str) -> str:
+    variable = "python_full_version" if version.count(".") >= 2 else "python_version"
+    return f'{variable} {op} "{version}"'
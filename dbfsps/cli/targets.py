@@ -0,0 +1,103 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence
+from dbfsps.cli.export import tomllib
+from dbfsps.cli.utils import get_remote_path
+
+
+class Target:
+    """A workspace to sync the package to, with its own statefile and, once created, its own state, plan and client
+
+    :param profile:
+        Databricks CLI profile of the workspace
+    :param remote_path:
+        Path, including dbfs: prefix to the directory to which the package should be uploaded
+    :param status_file:
+        Name of the statefile. If None, a name is derived from the default status file and the profile
+    """
+
+    def __init__(self, profile: str, remote_path: str, status_file: Optional[str] = None):
+        self.profile = profile
+        self.remote_path = remote_path
+        self.status_file = status_file
+        self.state = None
+        self.plan = None
+        self.dbfs = None
+
+
+def get_targets(
+    profiles: Sequence[str], targets_file: Optional[str], remote_path: str, status_file: str, package_name: str
+) -> List[Target]:
+    """Creates the targets from the --profile options and the targets file.
+
+    With a single target, its statefile is status_file. With several targets, every target without a status file
+    in the targets file gets status_file with its profile appended, e.g. .dbfsps_file_status.dev
+
+    :param profiles:
+    :param targets_file:
+        Path of a TOML file with a [[target]] table per workspace, with keys profile and optionally remote-path
+        and status-file
+    :param remote_path:
+        Remote path for targets that do not set one. See get_remote_path
+    :param status_file:
+    :param package_name:
+    """
+    targets = [Target(profile, get_remote_path(remote_path, package_name)) for profile in profiles]
+    if targets_file:
+        targets += load_targets_file(targets_file, remote_path, package_name)
+    if not targets:
+        raise ValueError("Must specify a databricks-cli profile to use")
+
+    for target in targets:
+        if target.status_file is None:
+            target.status_file = status_file if len(targets) == 1 else f"{status_file}.{target.profile}"
+    status_files = [target.status_file for target in targets]
+    if len(set(status_files)) != len(status_files):
+        raise ValueError(f"Every target must have its own status file, got {status_files}")
+    return targets
+
+
+def load_targets_file(path: str, remote_path: str, package_name: str) -> List[Target]:
+    """Reads the targets from a TOML file with a [[target]] table per workspace"""
+    with open(path, "rb") as f:
+        entries = tomllib.load(f).get("target", [])
+    targets = []
+    for entry in entries:
+        if "profile" not in entry:
+            raise ValueError(f"Every target in {path} must have a profile")
+        targets.append(
+            Target(
+                entry["profile"],
+                get_remote_path(entry.get("remote-path", remote_path), package_name),
+                entry.get("status-file"),
+            )
+        )
+    return targets
+
+
+def apply_targets(targets: List[Target], jobs: int):
+    """Applies the plans of all targets at the same time, each through the Dbfs client of its target.
+    Files that are uploaded to several targets are hashed once, before any plan is applied
+
+    :param targets:
+    :param jobs:
+        Maximum number of concurrent DBFS operations per target
+    :raises RuntimeError:
+        If applying the plan failed for any of the targets. The other targets are still applied
+    """
+    logger = logging.getLogger(__name__)
+    files_to_upload = {
+        id(file): file for target in targets for file in target.plan.files_new + target.plan.files_updated
+    }
+    targets[0].plan.prefetch_hashes(files_to_upload.values())
+
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        futures = [executor.submit(target.plan.apply_plan, target.dbfs, jobs=jobs) for target in targets]
+    failed = []
+    for target, future in zip(targets, futures):
+        exc = future.exception()
+        if exc is not None:
+            logger.error(f"Failed to sync to {target.profile}: {exc}")
+            failed.append(target.profile)
+    if failed:
+        raise RuntimeError(f"Failed to sync to {', '.join(failed)}")
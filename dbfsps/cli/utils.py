@@ -1,9 +1,11 @@
 import logging
 import os
 import click
-from dbfsps import __version__
+from dbfsps import __version__, stats
 import subprocess
+from dbfsps.cli.export import RequirementsExportError, export_requirements, tomllib
 
+REQUIREMENTS_HASH_PREFIX = "# dbfsps-lock-hash: "
 
 CONTEXT_SETTINGS = {"help_option_names": ["-h", "--help"]}
 
@@ -28,11 +30,49 @@ def print_version_callback(ctx, param, value):  # NOQA
     ctx.exit()
 
 
-def create_requirements_file():
-    """Uses the shell and poetry to generate a requirements.txt"""
+def create_requirements_file(root_dir: str = ".", lock_hash: str = None):
+    """Generates requirements.txt from poetry.lock, without running poetry.
+
+    If lock_hash is given, it is written to the first line of the file and the file is only generated again
+    when the hash changes. If the lockfile cannot be exported natively, this falls back to `poetry export`.
+
+    :param root_dir:
+        Directory containing pyproject.toml and poetry.lock, where requirements.txt is written
+    :param lock_hash:
+        Hash of poetry.lock
+    """
     logger = logging.getLogger(__name__)
+    requirements_path = os.path.join(root_dir, "requirements.txt")
+    if lock_hash and get_requirements_lock_hash(requirements_path) == lock_hash:
+        logger.debug("requirements.txt is up to date with poetry.lock")
+        return
+
     logger.info("(re-)Creating requirements.txt")
-    process_cmd_command("poetry export -f requirements.txt --output requirements.txt")
+    with stats.phase("export_requirements"):
+        try:
+            requirements = export_requirements(root_dir)
+        except RequirementsExportError as exc:
+            logger.warning(f"Unable to export poetry.lock, falling back to poetry export: {exc}")
+            process_cmd_command(f"poetry export -f requirements.txt --output {requirements_path}")
+            with open(requirements_path, "r") as f:
+                requirements = f.read()
+
+    with open(requirements_path, "w") as f:
+        if lock_hash:
+            f.write(f"{REQUIREMENTS_HASH_PREFIX}{lock_hash}\n")
+        f.write(requirements)
+
+
+def get_requirements_lock_hash(requirements_path: str) -> str:
+    """Returns the lockfile hash that requirements.txt was generated from, or None if it is not known"""
+    try:
+        with open(requirements_path, "r") as f:
+            first_line = f.readline().strip()
+    except FileNotFoundError:
+        return None
+    if first_line.startswith(REQUIREMENTS_HASH_PREFIX):
+        return first_line[len(REQUIREMENTS_HASH_PREFIX) :]
+    return None
 
 
 def verify_dbfs_path(dbfs_path: str) -> str:
@@ -71,3 +111,19 @@ def get_remote_path(remote_path: str, package_name: str) -> str:
     remote_path = verify_dbfs_path(remote_path)
 
     return remote_path
+
+
+def get_project_config(root_dir: str) -> dict:
+    """Reads the [tool.dbfsps] section from pyproject.toml in the root dir
+
+    :param root_dir:
+        Absolute path to the root dir of the repository where you can find pyproject.toml
+    :return:
+        The contents of the section, or an empty dictionary if pyproject.toml or the section does not exist
+    """
+    pyproject_path = os.path.join(root_dir, "pyproject.toml")
+    if not os.path.isfile(pyproject_path):
+        return {}
+    with open(pyproject_path, "rb") as f:
+        pyproject = tomllib.load(f)
+    return pyproject.get("tool", {}).get("dbfsps", {})
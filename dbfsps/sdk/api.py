@@ -0,0 +1,224 @@
+import os
+import base64
+from typing import Iterator, List, NamedTuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import HTTPError
+from urllib3.util.retry import Retry
+
+from dbfsps import __version__, stats
+
+__all__ = ["DbfsApi", "DbfsPath", "FileInfo", "MAX_BLOCK_SIZE"]
+
+# Largest block that add-block accepts and that read returns
+MAX_BLOCK_SIZE = 1024 * 1024
+
+
+class DbfsPath:
+    """Absolute path on DBFS, starting with "dbfs:/"
+
+    :param absolute_path:
+        E.g. dbfs:/FileStore/packages/mypackage
+    :param validate:
+        Raise a ValueError if absolute_path does not start with "dbfs:/", or starts with "dbfs://"
+    """
+
+    __slots__ = ("absolute_path",)
+
+    def __init__(self, absolute_path: str, validate: bool = True):
+        if validate:
+            if absolute_path.startswith("dbfs://"):
+                raise ValueError(f"The path {absolute_path} cannot start with dbfs://. It must start with dbfs:/")
+            if not absolute_path.startswith("dbfs:/"):
+                raise ValueError(f'The path {absolute_path} must start with "dbfs:/"')
+        self.absolute_path = absolute_path
+
+    @classmethod
+    def from_api_path(cls, path: str) -> "DbfsPath":
+        """Paths in API responses have no dbfs: prefix"""
+        return cls(f"dbfs:{path}", validate=False)
+
+    @property
+    def api_path(self) -> str:
+        """The path as the API expects it, without dbfs: prefix"""
+        return self.absolute_path[len("dbfs:") :].rstrip("/") or "/"
+
+    @property
+    def basename(self) -> str:
+        return self.api_path.rsplit("/", 1)[-1]
+
+    def join(self, name: str) -> "DbfsPath":
+        return DbfsPath(f"{self.absolute_path.rstrip('/')}/{name}", validate=False)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, DbfsPath) and self.api_path == other.api_path
+
+    def __hash__(self) -> int:
+        return hash(self.api_path)
+
+    def __repr__(self) -> str:
+        return self.absolute_path
+
+    __str__ = __repr__
+
+
+class FileInfo(NamedTuple):
+    """A file or directory in a listing"""
+
+    dbfs_path: DbfsPath
+    is_dir: bool
+    file_size: int
+    modification_time: int
+
+    @classmethod
+    def from_json(cls, info: dict) -> "FileInfo":
+        return cls(
+            dbfs_path=DbfsPath.from_api_path(info["path"]),
+            is_dir=info.get("is_dir", False),
+            file_size=info.get("file_size", 0),
+            modification_time=info.get("modification_time", 0),
+        )
+
+
+class DbfsApi:
+    """Client for the DBFS 2.0 REST API, made for transferring many files from several threads at once.
+
+    Every method sends one request, except put_file and get_file for large files and delete for large directories.
+    Errors are raised as requests.exceptions.HTTPError, and are not retried. All threads share one session and a
+    pool of up to max_connections keep-alive connections.
+
+    :param host:
+        Workspace URL including the scheme, e.g. https://adb-8302248809552723.3.azuredatabricks.net
+    :param token:
+        Personal access token
+    :param max_connections:
+        Size of the connection pool. Requests beyond this number in flight wait for a connection
+    :param block_size:
+        Bytes per request when streaming files larger than put_limit to DBFS, and when reading files from DBFS.
+        At most MAX_BLOCK_SIZE
+    :param put_limit:
+        Files up to this size in bytes are uploaded with a single request, larger files are streamed in blocks
+    :param timeout:
+        Seconds to wait for the server to respond to a request
+    :param verify:
+        Verify the TLS certificate of the host
+    """
+
+    def __init__(
+        self,
+        host: str,
+        token: str,
+        max_connections: int = 8,
+        block_size: int = MAX_BLOCK_SIZE,
+        put_limit: int = 16 * MAX_BLOCK_SIZE,
+        timeout: float = 60,
+        verify: bool = True,
+    ):
+        if not 0 < block_size <= MAX_BLOCK_SIZE:
+            raise ValueError(f"block_size must be between 1 and {MAX_BLOCK_SIZE} bytes")
+        self.url = f"{host.rstrip('/')}/api/2.0/dbfs/"
+        self.block_size = block_size
+        self.put_limit = put_limit
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.verify = verify
+        self.session.headers.update(
+            {
+                "Authorization": f"Bearer {token}",
+                "User-Agent": f"dbfsps/{__version__}",
+                "Connection": "keep-alive",
+            }
+        )
+        # Failed requests are retried by the caller, see dbfsps.sdk.retry
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections, max_retries=Retry(0, read=False))
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.session.hooks["response"].append(_record_api_call)
+
+    def _request(self, method: str, endpoint: str, **kwargs) -> dict:
+        response = self.session.request(method, self.url + endpoint, timeout=self.timeout, **kwargs)
+        response.raise_for_status()
+        return response.json() if response.content else {}
+
+    def get_status(self, dbfs_path: DbfsPath) -> FileInfo:
+        return FileInfo.from_json(self._request("GET", "get-status", params={"path": dbfs_path.api_path}))
+
+    def list_files(self, dbfs_path: DbfsPath) -> List[FileInfo]:
+        """The direct children of a directory, or the file itself if dbfs_path is a file"""
+        response = self._request("GET", "list", params={"path": dbfs_path.api_path})
+        return [FileInfo.from_json(info) for info in response.get("files", [])]
+
+    def mkdirs(self, dbfs_path: DbfsPath):
+        self._request("POST", "mkdirs", json={"path": dbfs_path.api_path})
+
+    def delete(self, dbfs_path: DbfsPath, recursive: bool = False):
+        """Deletes a file or directory. A large directory is deleted in parts: the API deletes a limited number of
+        files per request and answers with a PARTIAL_DELETE error until everything is removed"""
+        while True:
+            try:
+                self._request("POST", "delete", json={"path": dbfs_path.api_path, "recursive": recursive})
+                return
+            except HTTPError as exc:
+                if get_error_code(exc) != "PARTIAL_DELETE":
+                    raise
+
+    def move(self, source: DbfsPath, destination: DbfsPath):
+        self._request("POST", "move", json={"source_path": source.api_path, "destination_path": destination.api_path})
+
+    def put_file(self, local_path: str, dbfs_path: DbfsPath, overwrite: bool = False):
+        """Uploads a local file, with a single request if it is at most put_limit bytes, otherwise in blocks"""
+        if os.path.getsize(local_path) <= self.put_limit:
+            with open(local_path, "rb") as f:
+                self._request(
+                    "POST",
+                    "put",
+                    data={"path": dbfs_path.api_path, "overwrite": str(overwrite).lower()},
+                    files={"contents": (os.path.basename(local_path), f)},
+                )
+            return
+
+        handle = self._request("POST", "create", json={"path": dbfs_path.api_path, "overwrite": overwrite})["handle"]
+        with open(local_path, "rb") as f:
+            for block in iter(lambda: f.read(self.block_size), b""):
+                self._request("POST", "add-block", json={"handle": handle, "data": base64.b64encode(block).decode()})
+        self._request("POST", "close", json={"handle": handle})
+
+    def read_blocks(self, dbfs_path: DbfsPath) -> Iterator[bytes]:
+        """The contents of a file on DBFS, in blocks of up to block_size bytes. A block shorter than block_size
+        is the end of the file, so a small file is read with a single request"""
+        offset = 0
+        while True:
+            params = {"path": dbfs_path.api_path, "offset": offset, "length": self.block_size}
+            response = self._request("GET", "read", params=params)
+            bytes_read = response.get("bytes_read", 0)
+            if bytes_read:
+                yield base64.b64decode(response["data"])
+            if bytes_read < self.block_size:
+                return
+            offset += bytes_read
+
+    def get_file(self, dbfs_path: DbfsPath, local_path: str, overwrite: bool = False):
+        """Downloads a file from DBFS"""
+        if os.path.exists(local_path) and not overwrite:
+            raise FileExistsError(f"{local_path} already exists")
+        with open(local_path, "wb") as f:
+            for block in self.read_blocks(dbfs_path):
+                f.write(block)
+
+
+def get_error_code(exc: HTTPError) -> str:
+    """The error_code in the JSON body of an API error response, if any"""
+    try:
+        return exc.response.json().get("error_code")
+    except (AttributeError, ValueError):
+        return None
+
+
+def _record_api_call(response, *args, **kwargs):
+    """Response hook of the session that records every request in the statistics, see dbfsps.stats"""
+    path = urlparse(response.url).path
+    endpoint = path.split("/api/2.0/", 1)[-1]
+    stats.record_api_call(endpoint, response.elapsed.total_seconds(), response.status_code)
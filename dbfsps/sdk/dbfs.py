@@ -1,32 +1,28 @@
-from requests.exceptions import HTTPError
+import os
+import posixpath
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import NamedTuple
 
-from databricks_cli.dbfs.api import DbfsApi
-from databricks_cli.dbfs.api import TempDir
-from databricks_cli.dbfs.dbfs_path import DbfsPath
-from databricks_cli.sdk import ApiClient
+from requests.exceptions import HTTPError
 
+from dbfsps.sdk.api import MAX_BLOCK_SIZE, DbfsApi, DbfsPath
 from dbfsps.sdk.errors import DatabricksApiError
+from dbfsps.sdk.retry import AdaptiveLimiter, RetryPolicy
 
-__all__ = ["Dbfs"]
+__all__ = ["Dbfs", "ConnectionStats"]
 
 
-class DbfsPathNoClicks(DbfsPath):
-    def __init__(self, absolute_path, validate=True):
-        super().__init__(absolute_path, validate=validate)
+class ConnectionStats(NamedTuple):
+    """Number of HTTP connections opened (each with its own TLS handshake) and requests sent over them"""
 
-    # Some Databricks CLI methods have a clicks function, which causes trouble for us
-    def validate(self):
-        """
-        Checks that the path is a proper DbfsPath. it must have a prefix of
-        "dbfs:" and must be an absolute path.
-        """
-        if self.absolute_path.startswith("dbfs://"):
-            raise ValueError(f"The path {repr(self)} cannot start with dbfs://. " "It must start with dbfs:/")
-        if not self.is_absolute_path:
-            raise ValueError(f'The path {repr(self)} must start with "dbfs:/"')
+    connections: int
+    requests: int
 
-    def __repr__(self):
-        return str(self.absolute_path)
+    @property
+    def reused(self) -> int:
+        """Requests that were sent over an already open connection"""
+        return max(0, self.requests - self.connections)
 
 
 class Dbfs:
@@ -35,7 +31,7 @@ class Dbfs:
         cp
             Copy files to and from DBFS.
         ls
-            List files in DBFS.
+            List files in DBFS, optionally recursively.
         rm
             Remove files from DBFS.
         mkdirs
@@ -45,34 +41,101 @@ class Dbfs:
         cat
             Show the contents of a file.
 
+    Failed requests are retried according to retry_policy. The number of requests in flight is limited by an
+    AdaptiveLimiter, which lowers the limit when the API throttles requests and raises it again as requests succeed.
+    All requests share one session, with a pool of up to max_concurrency keep-alive connections, so connections
+    and their TLS sessions are reused instead of set up for every request. See connection_stats. An instance can be
+    used from several threads at once.
+
     :param host:
         example: https://adb-8302248809552723.3.azuredatabricks.net or adb-8302248809552723.3.azuredatabricks.net
     :param token:
+    :param max_concurrency:
+        Maximum number of requests in flight, from all threads using this instance together
+    :param retry_policy:
+        Defaults to RetryPolicy()
+    :param block_size:
+        Bytes per request when streaming large files to and from DBFS, see DbfsApi
     :param kwargs:
-        Any arguments aside from host and token that ApiClient accepts
+        Other arguments of DbfsApi: put_limit, timeout and verify
     """
 
-    def __init__(self, host: str, token: str, **kwargs):
-        if not host.startswith("https://"):
+    def __init__(
+        self,
+        host: str,
+        token: str,
+        max_concurrency: int = 8,
+        retry_policy: RetryPolicy = None,
+        block_size: int = MAX_BLOCK_SIZE,
+        **kwargs,
+    ):
+        if not host.startswith(("https://", "http://")):
             host = "https://" + host
 
-        self._client = ApiClient(host=host, token=token, **kwargs)
-        self._api = DbfsApi(self._client)
+        # One pool of keep-alive connections to the workspace, with a connection for every request in flight
+        self._api = DbfsApi(host, token, max_connections=max_concurrency, block_size=block_size, **kwargs)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.limiter = AdaptiveLimiter(max_concurrency)
+        # Remote directories that are known to exist, so they are only created once per session
+        self._known_dirs = set()
+        self._known_dirs_lock = threading.Lock()
+
+    def connection_stats(self) -> ConnectionStats:
+        """Connections opened and requests sent by this instance so far"""
+        pools = self._api.adapter.poolmanager.pools
+        pools = [pools[key] for key in pools.keys()]
+        return ConnectionStats(
+            connections=sum(pool.num_connections for pool in pools),
+            requests=sum(pool.num_requests for pool in pools),
+        )
+
+    def _call(self, func, *args, **kwargs):
+        """Calls a DbfsApi method with retries, within the concurrency limit. A file that is streamed in blocks is
+        retried as a whole"""
+        return self.retry_policy.call(func, *args, limiter=self.limiter, **kwargs)
 
     def cp(self, source: str, destination: str, recursive: bool = False, overwrite: bool = False):
-        """Copy files to and from DBFS
+        """Copy files to and from DBFS. One of source and destination is a path on DBFS starting with "dbfs:",
+        the other a local path. destination is the path of the copy, not the directory to copy into
 
         :param source:
         :param destination:
         :param recursive:
+            Copy a directory with everything in it
         :param overwrite:
         """
+        if source.startswith("dbfs:") == destination.startswith("dbfs:"):
+            raise ValueError(f"Either {source} or {destination} must be a DBFS path, but not both")
         try:
-            self._api.cp(recursive, overwrite, source, destination)
+            if destination.startswith("dbfs:"):
+                self._upload(source, DbfsPath(destination), recursive, overwrite)
+            else:
+                self._download(DbfsPath(source), destination, recursive, overwrite)
         except HTTPError as exc:
             raise DatabricksApiError(exc, message_prefix=f"Failed to copy {source} to {destination}")
 
-    def ls(self, dbfs_path: str, strings_only: bool = False) -> list:
+    def _upload(self, source: str, destination: DbfsPath, recursive: bool, overwrite: bool):
+        if not recursive:
+            self._call(self._api.put_file, source, destination, overwrite)
+            return
+        for root, _, names in os.walk(source):
+            rel_root = os.path.relpath(root, source)
+            for name in names:
+                rel_path = name if rel_root == os.curdir else posixpath.join(rel_root.replace(os.sep, "/"), name)
+                self._call(self._api.put_file, os.path.join(root, name), destination.join(rel_path), overwrite)
+
+    def _download(self, source: DbfsPath, destination: str, recursive: bool, overwrite: bool):
+        if not recursive:
+            self._call(self._api.get_file, source, destination, overwrite)
+            return
+        prefix = source.absolute_path.rstrip("/") + "/"
+        for file_info in self._ls_recursive(source.absolute_path, workers=1):
+            rel_path = file_info.dbfs_path.absolute_path[len(prefix) :]
+            local_path = os.path.join(destination, *rel_path.split("/"))
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            self._call(self._api.get_file, file_info.dbfs_path, local_path, overwrite)
+
+    def ls(self, dbfs_path: str, strings_only: bool = False, recursive: bool = False, workers: int = 8) -> list:
         """List files in DBFS
 
         :param dbfs_path:
@@ -80,20 +143,46 @@ class Dbfs:
         :param strings_only:
             If True, will return a list of paths as strings only.
             Default, False, will return list of databricks file objects (which have more information)
+        :param recursive:
+            If True, lists all files below dbfs_path instead of only its direct children. Directories themselves are
+            not included. The tree is listed breadth-first, with up to workers directories listed at the same time
+        :param workers:
+            Maximum number of directories listed concurrently when recursive is True
         """
-        try:
-            paths = self._api.list_files(DbfsPathNoClicks(dbfs_path))
-        except HTTPError as exc:
-            raise DatabricksApiError(exc, message_prefix=f"Failed to list {dbfs_path}")
+        if recursive:
+            paths = self._ls_recursive(dbfs_path, workers)
+        else:
+            paths = self._list_files(dbfs_path)
 
         if strings_only:
             paths_strings = []
             for path_obj in paths:
-                paths_strings.append(path_obj.dbfs_path)
+                paths_strings.append(path_obj.dbfs_path.absolute_path)
             paths = paths_strings
 
         return paths
 
+    def _list_files(self, dbfs_path: str) -> list:
+        try:
+            return self._call(self._api.list_files, DbfsPath(dbfs_path))
+        except HTTPError as exc:
+            raise DatabricksApiError(exc, message_prefix=f"Failed to list {dbfs_path}")
+
+    def _ls_recursive(self, dbfs_path: str, workers: int) -> list:
+        files = []
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            pending = {executor.submit(self._list_files, dbfs_path)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for path_obj in future.result():
+                        if path_obj.is_dir:
+                            self._remember_dirs(path_obj.dbfs_path.absolute_path)
+                            pending.add(executor.submit(self._list_files, path_obj.dbfs_path.absolute_path))
+                        else:
+                            files.append(path_obj)
+        return files
+
     def rm(self, dbfs_path: str, recursive: bool = False):
         """Remove files from DBFS
 
@@ -102,21 +191,45 @@ class Dbfs:
         :param recursive:
             Set recursive to True, for removing non-empty directories
         """
+        if recursive:
+            self._forget_dirs(dbfs_path)
         try:
-            self._api.delete(DbfsPathNoClicks(dbfs_path), recursive=recursive)
+            self._call(self._api.delete, DbfsPath(dbfs_path), recursive=recursive)
         except HTTPError as exc:
             raise DatabricksApiError(exc, message_prefix=f"Failed to remove {dbfs_path}")
 
     def mkdirs(self, dbfs_path: str):
-        """Make directories in DBFS
+        """Make directories in DBFS, including any missing parents.
+        Directories that were already created or listed by this instance are skipped
 
         :param dbfs_path:
             Path on databricks file system starting with "dbfs:"
         """
+        dbfs_path = dbfs_path.rstrip("/")
+        with self._known_dirs_lock:
+            if dbfs_path in self._known_dirs:
+                return
         try:
-            self._api.mkdirs(DbfsPathNoClicks(dbfs_path))
+            self._call(self._api.mkdirs, DbfsPath(dbfs_path))
         except HTTPError as exc:
             raise DatabricksApiError(exc, message_prefix=f"Failed to create {dbfs_path}")
+        self._remember_dirs(dbfs_path)
+
+    def _remember_dirs(self, dbfs_path: str):
+        """Adds dbfs_path and its parents to the known directories"""
+        dbfs_path = dbfs_path.rstrip("/")
+        with self._known_dirs_lock:
+            while dbfs_path not in self._known_dirs and dbfs_path.count("/") > 0:
+                self._known_dirs.add(dbfs_path)
+                dbfs_path = posixpath.dirname(dbfs_path)
+
+    def _forget_dirs(self, dbfs_path: str):
+        """Removes dbfs_path and everything below it from the known directories"""
+        dbfs_path = dbfs_path.rstrip("/")
+        with self._known_dirs_lock:
+            self._known_dirs = {
+                path for path in self._known_dirs if path != dbfs_path and not path.startswith(dbfs_path + "/")
+            }
 
     def mv(self, source: str, destination: str):
         """Moves a file between two DBFS paths
@@ -124,8 +237,9 @@ class Dbfs:
         :param source:
         :param destination:
         """
+        self._forget_dirs(source)
         try:
-            self._api.move(DbfsPathNoClicks(source), DbfsPathNoClicks(destination))
+            self._call(self._api.move, DbfsPath(source), DbfsPath(destination))
         except HTTPError as exc:
             raise DatabricksApiError(exc, message_prefix=f"Failed to move {source} to {destination}")
 
@@ -135,10 +249,8 @@ class Dbfs:
         :param dbfs_path:
             Path on databricks file system starting with "dbfs:"
         """
-        with TempDir() as temp_dir:
-            temp_path = temp_dir.path("temp")
-            self.cp(dbfs_path, temp_path, recursive=False, overwrite=True)
-            with open(temp_path) as f:
-                contents = f.read()
-
-        return contents
+        try:
+            contents = self._call(lambda: b"".join(self._api.read_blocks(DbfsPath(dbfs_path))))
+        except HTTPError as exc:
+            raise DatabricksApiError(exc, message_prefix=f"Failed to read {dbfs_path}")
+        return contents.decode()
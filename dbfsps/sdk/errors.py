@@ -1,4 +1,7 @@
-from requests.exceptions import HTTPError
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from requests.exceptions import HTTPError
 
 
 class DatabricksApiError(Exception):
@@ -18,20 +21,23 @@ class DatabricksApiError(Exception):
     """
 
     def __init__(
-        self, http_error: HTTPError, message_prefix: str = "Databricks API raised an HTTPError", include: list = None
+        self, http_error: "HTTPError", message_prefix: str = "Databricks API raised an HTTPError", include: list = None
     ):
         self.http_error = http_error
         self.message_prefix = message_prefix
         self.message = None
         self._allowed = {"error_code", "message", "url", "reason", "status_code"}
 
-        if not include:
-            self.include = ["error_code", "message"]
+        self.include = include or ["error_code", "message"]
 
         if not set(self.include).issubset(self._allowed):
             raise ValueError(f"Invalid include item. Allowed: {self._allowed}")
 
-        self.api_response_json = self.http_error.response.json()
+        try:
+            self.api_response_json = self.http_error.response.json()
+        except ValueError:
+            # E.g. an HTML error page from a proxy or gateway in front of the API
+            self.api_response_json = {}
 
         self._create_message()
 
@@ -41,7 +47,7 @@ class DatabricksApiError(Exception):
         message = f"{self.message_prefix}:\n"
         for key in self.include:
             if key in ("error_code", "message"):
-                val = self.api_response_json[key]
+                val = self.api_response_json.get(key, getattr(self.http_error.response, "reason", None))
             else:
                 val = getattr(self.http_error.response, key)
             message += f"    {key}: {val}\n"
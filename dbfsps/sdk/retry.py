@@ -0,0 +1,204 @@
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional, TypeVar
+
+from requests.exceptions import ConnectionError as RequestsConnectionError, HTTPError, Timeout
+from dbfsps import stats
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+THROTTLE_STATUSES = (429, 503)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class AdaptiveLimiter:
+    """Limits the number of requests in flight, and adapts that limit with additive increase, multiplicative
+    decrease (AIMD): every successful request raises the limit by increase / limit, so by about increase per
+    round of requests, and being throttled multiplies the limit by decrease.
+
+    Requests that were already in flight when the limit was decreased do not decrease it again, so one burst of
+    throttled responses only counts once.
+
+    :param max_limit:
+        Highest number of requests in flight
+    :param min_limit:
+        Lowest number of requests in flight
+    :param initial_limit:
+        Number of requests in flight to start with. Defaults to max_limit
+    :param increase:
+    :param decrease:
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        min_limit: int = 1,
+        initial_limit: Optional[int] = None,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+    ):
+        if max_limit < 1 or not 1 <= min_limit <= max_limit:
+            raise ValueError("Limits must satisfy 1 <= min_limit <= max_limit")
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.increase = increase
+        self.decrease = decrease
+        self._limit = float(initial_limit or max_limit)
+        self._in_flight = 0
+        self._epoch = 0
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        """Current maximum number of requests in flight"""
+        return max(self.min_limit, int(self._limit))
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def acquire(self) -> int:
+        """Blocks until a request may be sent
+
+        :returns:
+            A token that must be passed to on_throttle if this request gets throttled
+        """
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+            return self._epoch
+
+    def release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+
+    def on_success(self):
+        with self._condition:
+            before = self.limit
+            self._limit = min(float(self.max_limit), self._limit + self.increase / self._limit)
+            if self.limit > before:
+                self._condition.notify(self.limit - before)
+
+    def on_throttle(self, token: int):
+        """Decreases the limit, unless it was already decreased after the throttled request was sent"""
+        with self._condition:
+            if token != self._epoch:
+                return
+            self._epoch += 1
+            self._limit = max(float(self.min_limit), self._limit * self.decrease)
+            logger.info(f"Throttled by the API, lowering concurrency to {self.limit}")
+
+
+class RetryPolicy:
+    """Decides which failed requests are retried and how long to wait before the next attempt.
+
+    Requests are retried on connection errors, timeouts and the HTTP statuses in retry_statuses. The delay is taken
+    from the Retry-After header when the API sends one, otherwise it is exponential backoff with full jitter:
+    a random delay between 0 and base_delay * 2 ** (attempt - 1), capped at max_delay.
+
+    :param max_attempts:
+        Total number of attempts, including the first one
+    :param base_delay:
+        Seconds
+    :param max_delay:
+        Seconds, also caps the delay requested with Retry-After
+    :param retry_statuses:
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 6,
+        base_delay: float = 0.5,
+        max_delay: float = 60.0,
+        retry_statuses: tuple = RETRY_STATUSES,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = retry_statuses
+
+    def is_retryable(self, exc: Exception) -> bool:
+        if isinstance(exc, HTTPError):
+            return get_status_code(exc) in self.retry_statuses
+        return isinstance(exc, (RequestsConnectionError, Timeout))
+
+    def delay(self, attempt: int, exc: Exception) -> float:
+        """Seconds to wait after the given (1-based) failed attempt"""
+        retry_after = get_retry_after(exc)
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def call(
+        self, func: Callable[..., T], *args, limiter: AdaptiveLimiter = None, description: str = None, **kwargs
+    ) -> T:
+        """Calls func until it succeeds, it raises an error that should not be retried or max_attempts is reached.
+        The last error is raised as is
+
+        :param func:
+        :param args:
+            Passed to func
+        :param limiter:
+            If given, each attempt waits for a slot from the limiter, and reports successes and throttling to it
+        :param description:
+            Description of the call for log messages
+        :param kwargs:
+            Passed to func
+        """
+        description = description or getattr(func, "__name__", "request")
+        attempt = 0
+        while True:
+            attempt += 1
+            token = limiter.acquire() if limiter else None
+            try:
+                result = func(*args, **kwargs)
+            except Exception as exc:
+                throttled = get_status_code(exc) in THROTTLE_STATUSES
+                if throttled:
+                    stats.count("throttled")
+                if limiter:
+                    limiter.release()
+                    if throttled:
+                        limiter.on_throttle(token)
+                if attempt >= self.max_attempts or not self.is_retryable(exc):
+                    raise
+                stats.count("retries")
+                delay = self.delay(attempt, exc)
+                logger.warning(
+                    f"{description} failed ({exc}), retrying in {delay:.1f}s (attempt {attempt} of {self.max_attempts})"
+                )
+                time.sleep(delay)
+            else:
+                if limiter:
+                    limiter.release()
+                    limiter.on_success()
+                return result
+
+
+def get_status_code(exc: Exception) -> Optional[int]:
+    """HTTP status code of the response that caused the error, if any"""
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def get_retry_after(exc: Exception) -> Optional[float]:
+    """Seconds to wait according to the Retry-After header of the response that caused the error, if any"""
+    response = getattr(exc, "response", None)
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -1,3 +1,6 @@
+import os
+from dbfsps.syncer.bundle import TOMBSTONES_NAME
+
 _source = """
 # Databricks notebook source
 # COMMAND ----------
@@ -8,8 +11,50 @@ _source = """
 
 import sys
 
-print("Inserting {package_path} into system PATH")
-sys.path.insert(0, "{package_path}")
+print("Inserting {import_path} into system PATH")
+sys.path.insert(0, "{import_path}")
+print("Enabling autoreload")
+
+# COMMAND ----------
+
+# MAGIC %load_ext autoreload
+# MAGIC %autoreload 2
+"""
+
+_source_layered = """
+# Databricks notebook source
+# COMMAND ----------
+
+# MAGIC %pip install -r {package_path}/requirements.txt
+
+# COMMAND ----------
+
+import os
+import sys
+import shutil
+import tempfile
+import zipfile
+
+# Extract the latest base layer and every delta uploaded after it, in order
+layers_dir = "{package_path}/{layers_dir}"
+layers = sorted(os.listdir(layers_dir))
+base_index = max(i for i, name in enumerate(layers) if name.endswith("-base.zip"))
+import_path = os.path.join(tempfile.gettempdir(), "dbfsps", "{package_name}")
+shutil.rmtree(import_path, ignore_errors=True)
+for name in layers[base_index:]:
+    print(f"Applying layer {{name}}")
+    with zipfile.ZipFile(os.path.join(layers_dir, name)) as archive:
+        members = archive.namelist()
+        if "{tombstones}" in members:
+            for path in archive.read("{tombstones}").decode().splitlines():
+                path_abs = os.path.join(import_path, path)
+                if os.path.isfile(path_abs):
+                    os.remove(path_abs)
+        archive.extractall(import_path, [member for member in members if member != "{tombstones}"])
+
+print(f"Inserting {{import_path}} into system PATH")
+if import_path not in sys.path:
+    sys.path.insert(0, import_path)
 print("Enabling autoreload")
 
 # COMMAND ----------
@@ -20,10 +65,43 @@ print("Enabling autoreload")
 
 
 class SetupNotebook:
-    def __init__(self, dbfs_package_path: str, notebook_path: str):
+    """Generates the notebook that installs the requirements and makes the package importable on a cluster
+
+    :param dbfs_package_path:
+        Path to the remote package directory, as seen from the cluster (/dbfs/...)
+    :param notebook_path:
+        Local path of the notebook to generate
+    :param archive_name:
+        If the package is shipped as a zip archive, the name of the archive in dbfs_package_path.
+        The archive is then put on sys.path and imported through zipimport.
+    :param layers_dir:
+        If the package is shipped as layered archives, the directory in dbfs_package_path that contains the layers.
+        The layers are then extracted in order to a local directory, which is put on sys.path.
+    """
+
+    def __init__(self, dbfs_package_path: str, notebook_path: str, archive_name: str = None, layers_dir: str = None):
         self.notebook_path = notebook_path
         self.dbfs_path = dbfs_package_path
-        self.source = _source.format(package_path=self.dbfs_path)
+        if layers_dir:
+            self.source = _source_layered.format(
+                package_path=self.dbfs_path,
+                package_name=os.path.basename(self.dbfs_path.rstrip("/")),
+                layers_dir=layers_dir,
+                tombstones=TOMBSTONES_NAME,
+            )
+        else:
+            import_path = self.dbfs_path
+            if archive_name:
+                import_path = f"{self.dbfs_path}/{archive_name}"
+            self.source = _source.format(package_path=self.dbfs_path, import_path=import_path)
+
+    def is_up_to_date(self) -> bool:
+        """True if the notebook file exists and has the source for the current settings, e.g. the bundle mode"""
+        try:
+            with open(self.notebook_path, "r") as f:
+                return f.read() == self.source
+        except FileNotFoundError:
+            return False
 
     def generate_notebook_file(self):
         with open(self.notebook_path, "w") as f:
@@ -0,0 +1,176 @@
+"""Statistics of a sync: wall time per phase, I/O counters and DBFS API calls.
+
+Instrumented code calls the module functions phase, count and record_api_call. These do nothing until a
+StatsCollector is activated with set_collector, so collecting statistics costs nothing when it is not requested:
+
+    collector = StatsCollector(hooks=[MyHook()])
+    set_collector(collector)
+    ...
+    report = collector.report()
+
+Hooks receive every phase and API call as it is recorded, and the final report, e.g. to forward them to a
+metrics system. See StatsHook.
+"""
+
+import time
+import threading
+import importlib
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+
+class StatsHook:
+    """Receives statistics as they are recorded. Subclass and override the methods of interest"""
+
+    def on_phase(self, name: str, seconds: float):
+        """Called when a phase ends"""
+
+    def on_count(self, name: str, value: int):
+        """Called when a counter is increased"""
+
+    def on_api_call(self, endpoint: str, seconds: float, status: Optional[int]):
+        """Called for every HTTP request to the Databricks API. status is None if no response was received"""
+
+    def on_report(self, report: dict):
+        """Called with the final report, see StatsCollector.report"""
+
+
+class StatsCollector:
+    """Collects the statistics of a sync. All methods are thread safe.
+
+    :param hooks:
+        StatsHook instances that receive the statistics as they are recorded
+    """
+
+    def __init__(self, hooks: List[StatsHook] = None):
+        self.hooks = list(hooks or [])
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.phases: Dict[str, float] = defaultdict(float)
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.api_latencies: Dict[str, List[float]] = defaultdict(list)
+        self.api_statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Measures the wall time of the code inside it. Time of phases with the same name is added up"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self.phases[name] += seconds
+            for hook in self.hooks:
+                hook.on_phase(name, seconds)
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] += value
+        for hook in self.hooks:
+            hook.on_count(name, value)
+
+    def record_api_call(self, endpoint: str, seconds: float, status: Optional[int]):
+        with self._lock:
+            self.api_latencies[endpoint].append(seconds)
+            self.api_statuses[endpoint][str(status)] += 1
+        for hook in self.hooks:
+            hook.on_api_call(endpoint, seconds, status)
+
+    def report(self) -> dict:
+        """The statistics as a dictionary that can be serialized to JSON:
+
+        - started: Unix time at which the collector was created
+        - total: seconds since started
+        - phases: seconds per phase. Phases can be nested, e.g. upload is part of apply
+        - counters: e.g. bytes_hashed, bytes_uploaded, files_uploaded and retries
+        - api_calls: per endpoint the number of calls, the number of calls per status and latency percentiles
+        """
+        with self._lock:
+            api_calls = {
+                endpoint: {
+                    "count": len(latencies),
+                    "statuses": dict(self.api_statuses[endpoint]),
+                    "latency": latency_percentiles(latencies),
+                }
+                for endpoint, latencies in sorted(self.api_latencies.items())
+            }
+            report = {
+                "started": self.started,
+                "total": round(time.perf_counter() - self._start, 6),
+                "phases": {name: round(seconds, 6) for name, seconds in self.phases.items()},
+                "counters": dict(self.counters),
+                "api_calls": api_calls,
+            }
+        for hook in self.hooks:
+            hook.on_report(report)
+        return report
+
+
+def latency_percentiles(latencies: List[float]) -> dict:
+    """p50, p90, p99 and max of the latencies in seconds, using the nearest rank method"""
+    if not latencies:
+        return {}
+    ordered = sorted(latencies)
+    result = {}
+    for percentile in (50, 90, 99):
+        rank = max(1, -(-percentile * len(ordered) // 100))
+        result[f"p{percentile}"] = round(ordered[rank - 1], 6)
+    result["max"] = round(ordered[-1], 6)
+    return result
+
+
+def load_hook(spec: str) -> StatsHook:
+    """Loads a hook from a module:attribute specification. If the attribute is a class or another callable,
+    it is called without arguments to create the hook
+
+    :param spec:
+        E.g. "mypackage.metrics:PrometheusHook"
+    """
+    module_name, sep, attribute = spec.partition(":")
+    if not sep or not module_name or not attribute:
+        raise ValueError(f"Invalid stats hook {spec}, expected module:attribute")
+    hook = getattr(importlib.import_module(module_name), attribute)
+    if callable(hook) and not isinstance(hook, StatsHook):
+        hook = hook()
+    return hook
+
+
+_collector: Optional[StatsCollector] = None
+
+
+def set_collector(collector: Optional[StatsCollector]):
+    """Activates a collector for all instrumented code, or deactivates collecting statistics with None"""
+    global _collector
+    _collector = collector
+
+
+def get_collector() -> Optional[StatsCollector]:
+    return _collector
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Measures the wall time of the code inside it, if a collector is active"""
+    collector = _collector
+    if collector is None:
+        yield
+    else:
+        with collector.phase(name):
+            yield
+
+
+def count(name: str, value: int = 1):
+    """Increases a counter, if a collector is active"""
+    collector = _collector
+    if collector is not None:
+        collector.count(name, value)
+
+
+def record_api_call(endpoint: str, seconds: float, status: Optional[int]):
+    """Records an HTTP request to the Databricks API, if a collector is active"""
+    collector = _collector
+    if collector is not None:
+        collector.record_api_call(endpoint, seconds, status)
@@ -0,0 +1,242 @@
+import os
+import sqlite3
+import logging
+import threading
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+from dbfsps.syncer.file import File, FileStats
+
+StateRecord = Tuple[str, str, Optional[FileStats]]
+
+
+class StateBackend:
+    """Storage for the state: the path, hash and stats of every file that should currently be on DBFS
+
+    :param statefilepath:
+        Absolute path to the statefile
+    """
+
+    # True if update stores every change durably, so no journal is needed. State then writes only the files that
+    # changed with update, instead of replacing the stored state with store
+    incremental = False
+    # True if single files can be read with lookup, so State does not need to load every stored file up front
+    indexed = False
+
+    def __init__(self, statefilepath: str):
+        self.logger = logging.getLogger(__name__)
+        self.statefilepath = statefilepath
+
+    def exists(self) -> bool:
+        """True if a state has been stored before"""
+        raise NotImplementedError
+
+    def load(self) -> Iterator[StateRecord]:
+        """Yields (path, hash, stats) for every stored file"""
+        raise NotImplementedError
+
+    def lookup(self, path: str) -> Optional[StateRecord]:
+        """Reads a single stored file. None if it is not stored. Only available if indexed is True"""
+        raise NotImplementedError
+
+    def paths(self) -> Iterator[str]:
+        """Yields the path of every stored file. Only available if indexed is True"""
+        raise NotImplementedError
+
+    def store(self, files: Dict[str, File]):
+        """Replaces the stored state with files"""
+        raise NotImplementedError
+
+    def update(self, files_changed: Iterable[File], paths_removed: Iterable[str]):
+        """Stores changes to individual files. Backends that can only write the full state do this in store"""
+
+    def remove(self):
+        """Deletes the stored state"""
+        raise NotImplementedError
+
+
+class TextStateBackend(StateBackend):
+    """Stores the state as comma-separated lines of path, hash and (optionally) size, mtime_ns and inode"""
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.statefilepath)
+
+    def load(self) -> Iterator[StateRecord]:
+        yield from read_text_state(self.statefilepath)
+
+    def store(self, files: Dict[str, File]):
+        # Write to a temporary file first, so an interrupted write never leaves a truncated statefile behind
+        temp_path = f"{self.statefilepath}.tmp"
+        with open(temp_path, "w") as f:
+            for file in files.values():
+                line = f"{file.path},{file.hash}"
+                if file.stats:
+                    line += f",{file.stats.size},{file.stats.mtime_ns},{file.stats.inode}"
+                f.write(f"{line}\n")
+        os.replace(temp_path, self.statefilepath)
+
+    def remove(self):
+        try:
+            os.remove(self.statefilepath)
+        except FileNotFoundError:
+            pass
+
+
+class SqliteStateBackend(StateBackend):
+    """Stores the state in an SQLite database next to the statefile (<statefile>.sqlite), in WAL mode.
+
+    Changes to individual files are written as single rows, and every write is a transaction that holds the database
+    write lock. State only writes the rows of files it changed, so several processes can share one state without
+    overwriting each other's rows. Single files are read with lookups on the primary key on path, so planning does
+    not need to read every row. A statefile in the text format is migrated into the database automatically and
+    renamed to <statefile>.bak.
+    """
+
+    incremental = True
+    indexed = True
+
+    def __init__(self, statefilepath: str, timeout: float = 30.0):
+        super().__init__(statefilepath)
+        self.dbpath = f"{statefilepath}.sqlite"
+        self.timeout = timeout
+        self._connection = None
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(
+                self.dbpath, timeout=self.timeout, isolation_level=None, check_same_thread=False
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS files "
+                "(path TEXT PRIMARY KEY, hash TEXT NOT NULL, size INTEGER, mtime_ns INTEGER, inode INTEGER)"
+            )
+            self._migrate_text_state()
+        return self._connection
+
+    def _migrate_text_state(self):
+        if not os.path.isfile(self.statefilepath):
+            return
+        with self._transaction() as connection:
+            # Another process that started at the same time may have migrated the statefile while this one waited for
+            # the write lock. The statefile is renamed before the write lock is released, so it is then gone
+            try:
+                records = list(read_text_state(self.statefilepath))
+            except FileNotFoundError:
+                self.logger.debug(f"Statefile {self.statefilepath} was already migrated")
+                return
+            self.logger.info(f"Migrating statefile {self.statefilepath} to {self.dbpath}")
+            connection.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)", [_to_row(*record) for record in records]
+            )
+            try:
+                os.replace(self.statefilepath, f"{self.statefilepath}.bak")
+            except FileNotFoundError:
+                self.logger.debug(f"Statefile {self.statefilepath} was already migrated")
+
+    def _transaction(self) -> "_Transaction":
+        return _Transaction(self._connection, self._lock)
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.dbpath) or os.path.isfile(self.statefilepath)
+
+    def load(self) -> Iterator[StateRecord]:
+        rows = self.connection.execute("SELECT path, hash, size, mtime_ns, inode FROM files").fetchall()
+        for path, hashstr, size, mtime_ns, inode in rows:
+            stats = FileStats(size, mtime_ns, inode) if size is not None else None
+            yield path, hashstr, stats
+
+    def lookup(self, path: str) -> Optional[StateRecord]:
+        row = self.connection.execute(
+            "SELECT path, hash, size, mtime_ns, inode FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        if row is None:
+            return None
+        stats = FileStats(*row[2:]) if row[2] is not None else None
+        return row[0], row[1], stats
+
+    def paths(self) -> Iterator[str]:
+        for (path,) in self.connection.execute("SELECT path FROM files").fetchall():
+            yield path
+
+    def store(self, files: Dict[str, File]):
+        connection = self.connection
+        with self._transaction():
+            stored = {row[0] for row in connection.execute("SELECT path FROM files")}
+            connection.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in stored - files.keys()])
+            connection.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                [_to_row(file.path, file.hash, file.stats) for file in files.values()],
+            )
+
+    def update(self, files_changed: Iterable[File], paths_removed: Iterable[str]):
+        connection = self.connection
+        with self._transaction():
+            connection.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in paths_removed])
+            connection.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                [_to_row(file.path, file.hash, file.stats) for file in files_changed],
+            )
+
+    def remove(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        for path in (self.dbpath, f"{self.dbpath}-wal", f"{self.dbpath}-shm", self.statefilepath):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class _Transaction:
+    """Runs the statements inside it as one transaction that takes the database write lock up front"""
+
+    def __init__(self, connection: sqlite3.Connection, lock: threading.Lock):
+        self.connection = connection
+        self.lock = lock
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.lock.acquire()
+        try:
+            self.connection.execute("BEGIN IMMEDIATE")
+        except Exception:
+            self.lock.release()
+            raise
+        return self.connection
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.lock.release()
+
+
+BACKENDS = {"text": TextStateBackend, "sqlite": SqliteStateBackend}
+
+
+def create_backend(name: str, statefilepath: str) -> StateBackend:
+    """Creates the state backend with the given name, one of BACKENDS"""
+    try:
+        backend_cls = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f'Unknown state backend "{name}". Choose from {sorted(BACKENDS)}')
+    return backend_cls(statefilepath)
+
+
+def read_text_state(statefilepath: str) -> Iterator[StateRecord]:
+    """Reads the records from a statefile in the text format"""
+    with open(statefilepath, "r") as f:
+        for line in f.readlines():
+            vals = line.strip().split(",")
+            stats = None
+            if len(vals) == 5:
+                stats = FileStats(int(vals[2]), int(vals[3]), int(vals[4]))
+            yield vals[0], vals[1], stats
+
+
+def _to_row(path: str, hashstr: str, stats: Optional[FileStats]) -> tuple:
+    if stats is None:
+        return path, hashstr, None, None, None
+    return path, hashstr, stats.size, stats.mtime_ns, stats.inode
@@ -0,0 +1,426 @@
+import os
+import re
+import json
+import zipfile
+import tempfile
+from functools import partial
+from hashlib import sha256
+from typing import TYPE_CHECKING, Dict, Iterable, List
+from dbfsps import stats
+from dbfsps.syncer.state import State
+from dbfsps.syncer.file import File
+from dbfsps.syncer.plan import Plan, get_root_relative_path
+from dbfsps.syncer.scanner import ScanRules
+from dbfsps.syncer.tree import FileTree
+from dbfsps.sdk.errors import DatabricksApiError
+
+if TYPE_CHECKING:
+    from dbfsps.sdk.dbfs import Dbfs
+
+# Fixed timestamp for all archive members, so the same files always produce the same archive
+_ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+LAYERS_DIR = "layers"
+TOMBSTONES_NAME = ".dbfsps_tombstones"
+_LAYER_NAME = re.compile(r"^(\d+)-(base|delta)\.zip$")
+
+
+class BundlePlan(Plan):
+    """
+    Creates an execution plan that ships the package as a single zip archive instead of file by file.
+
+    The files of the package are replaced in the plan by one entry for the archive. Its hash is calculated from the
+    paths and hashes of the files in the package, so the archive is only built and uploaded when something changed.
+    The requirements file is still uploaded separately.
+
+    The state keeps the hash and stats of every file in the archive, not the archive itself, so the hashes of unchanged
+    files are reused like they are without bundling. The archive entry on the remote side is derived from them.
+
+    :param state:
+    :param remote_path:
+        Path, including dbfs: prefix to the directory to which the package should be uploaded
+    :param hash_jobs:
+        Number of workers used to calculate file hashes. Defaults to the number of CPUs
+    :param rules:
+        Rules that decide which files in the package are synced
+    :param local_files:
+        Files in the package from scan_local_files, to share one scan of the package between several plans
+    """
+
+    def __init__(
+        self,
+        state: State,
+        remote_path: str,
+        hash_jobs: int = None,
+        rules: ScanRules = None,
+        local_files: Dict[str, File] = None,
+    ):
+        self.archive_name = get_archive_name(state.package)
+        self.archive_path = get_root_relative_path(state.package, f".dbfsps_{self.archive_name}")
+        self.bundled_files = {}
+        # Local path of the archive while the plan is applied, see apply_plan
+        self._archive_build_path = None
+        super().__init__(state, remote_path, hash_jobs=hash_jobs, rules=rules, local_files=local_files)
+
+    def _plan(self):
+        self._bundle_local_files()
+        super()._plan()
+
+    def _bundle_local_files(self):
+        """Moves the package files from local_files into bundled_files and adds the archive to local_files"""
+        self.local_files.pop(self.archive_path, None)
+        for path in [path for path, file in self.local_files.items() if path == file.path_remote]:
+            self.bundled_files[path] = self.local_files.pop(path)
+        self.prefetch_hashes(self.bundled_files.values())
+        file_archive = File(
+            self.archive_path,
+            self.state.package,
+            self.state.root,
+            hashstr=calculate_bundle_hash(self.bundled_files.values()),
+            relpath_remote=self.archive_name,
+        )
+        self.local_files[file_archive.path] = file_archive
+
+    def _get_remote_files(self) -> FileTree:
+        """The files in the state, with the package files replaced by the archive they were uploaded in"""
+        remote_files = FileTree({path: file for path, file in self.state.files.items() if not is_package_file(file)})
+        package_files = [file for file in self.state.files.values() if is_package_file(file)]
+        if package_files:
+            remote_files[self.archive_path] = File(
+                self.archive_path,
+                self.state.package,
+                self.state.root,
+                hashstr=calculate_bundle_hash(package_files),
+                relpath_remote=self.archive_name,
+            )
+        return remote_files
+
+    def _record_upload(self, file: File):
+        """Records the files in the archive in the state, instead of the archive itself"""
+        if file.path != self.archive_path:
+            super()._record_upload(file)
+            return
+        self.state.update_files(self.bundled_files.values(), self._get_stale_files())
+
+    def _get_stale_files(self) -> List[File]:
+        """Files in the state that are not in the archive, including the archive entry stored by older versions"""
+        return [
+            file
+            for path, file in self.state.files.items()
+            if path == self.archive_path or (is_package_file(file) and path not in self.bundled_files)
+        ]
+
+    def _refresh_state_stats(self):
+        """Also stores the current stats of the files in the archive, while the archive on DBFS is up to date"""
+        super()._refresh_state_stats()
+        file_remote = self._get_remote_files().get(self.archive_path)
+        if file_remote is None or file_remote != self.local_files[self.archive_path]:
+            return
+        for file in self._get_stale_files():
+            del self.state.files[file.path]
+        for path, file in self.bundled_files.items():
+            file_state = self.state.files.get(path)
+            if file_state is None or file_state.stats != file.stats:
+                self.state.files[path] = file
+
+    def refresh(self, rel_paths: Iterable[str]):
+        self.local_files.update(self.bundled_files)
+        self.bundled_files = {}
+        super().refresh(rel_paths)
+
+    def apply_plan(self, dbfs: "Dbfs", jobs: int = 1):
+        """Builds the archive if it changed, uploads it together with any other changes and updates the statefile.
+        The archive is built in a temporary directory of its own, so several plans for the same package (one per
+        target) can be applied at the same time
+
+        :param dbfs:
+            An instance of the dbfs client to connect to Databricks
+        :param jobs:
+            Maximum number of concurrent DBFS operations
+        """
+        build_archive = any(file.path == self.archive_path for file in self.files_new + self.files_updated)
+        if not build_archive:
+            super().apply_plan(dbfs, jobs=jobs)
+            return
+        with tempfile.TemporaryDirectory() as tmp:
+            self._archive_build_path = os.path.join(tmp, self.archive_name)
+            self.logger.info(f"Building {self._archive_build_path} from {len(self.bundled_files)} files")
+            build_zip_bundle(list(self.bundled_files.values()), self._archive_build_path)
+            try:
+                super().apply_plan(dbfs, jobs=jobs)
+            finally:
+                self._archive_build_path = None
+
+    def _get_source_path(self, file: File) -> str:
+        if file.path == self.archive_path:
+            return self._archive_build_path
+        return super()._get_source_path(file)
+
+
+class LayerIndex:
+    """Local record of the archive layers that make up the package on DBFS, stored as JSON next to the statefile.
+
+    The first layer is always a base archive with the full package, followed by delta archives in the order they
+    were uploaded. Layer names sort in that same order.
+
+    :param path:
+        Path of the JSON file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.sequence = 0
+        self.layers = []
+
+        if os.path.isfile(self.path):
+            with open(self.path, "r") as f:
+                index = json.load(f)
+            self.sequence = index["sequence"]
+            self.layers = index["layers"]
+
+    def store(self):
+        with open(self.path, "w") as f:
+            json.dump({"sequence": self.sequence, "layers": self.layers}, f, indent=2)
+
+    def next_name(self, kind: str) -> str:
+        """Remote path, relative to the package, of the next layer. kind is either "base" or "delta" """
+        return f"{LAYERS_DIR}/{self.sequence + 1:06d}-{kind}.zip"
+
+    def names(self) -> List[str]:
+        return [layer["name"] for layer in self.layers]
+
+    def add(self, name: str, size: int):
+        """Adds an uploaded layer. A base layer replaces all existing layers"""
+        self.sequence += 1
+        if name.endswith("-base.zip"):
+            self.layers = []
+        self.layers.append({"name": name, "size": size})
+
+    def needs_compaction(self, delta_size: int, max_deltas: int, max_delta_ratio: float) -> bool:
+        """True if adding a delta of delta_size bytes would exceed the maximum number of deltas, or make
+        the deltas together larger than max_delta_ratio times the size of the base"""
+        if not self.layers:
+            return True
+        deltas = self.layers[1:]
+        if len(deltas) + 1 > max_deltas:
+            return True
+        return sum(layer["size"] for layer in deltas) + delta_size > max_delta_ratio * self.layers[0]["size"]
+
+
+class LayeredBundlePlan(Plan):
+    """
+    Creates an execution plan that ships changes to the package as layered zip archives.
+
+    The first sync uploads a base archive with the full package. After that, every sync uploads one small delta archive
+    with the new and updated files, plus a list of the deleted files (tombstones). Once the deltas grow beyond
+    max_deltas archives or max_delta_ratio times the size of the base, they are compacted into a new base and the old
+    layers are removed. The state keeps tracking the individual files, the layers are recorded in a LayerIndex.
+
+    The layers directory on DBFS is listed before every apply. Layer numbers continue after the highest layer on DBFS,
+    and if the layers there differ from the LayerIndex, e.g. because it was deleted or this is a fresh clone, a new
+    base is uploaded and every other layer is removed. The notebook always applies the highest base, so stale layers
+    are never picked up.
+
+    :param state:
+    :param remote_path:
+        Path, including dbfs: prefix to the directory to which the package should be uploaded
+    :param hash_jobs:
+        Number of workers used to calculate file hashes. Defaults to the number of CPUs
+    :param rules:
+        Rules that decide which files in the package are synced
+    :param max_deltas:
+        Maximum number of delta archives on top of the base
+    :param max_delta_ratio:
+        Maximum size of all deltas together, relative to the size of the base
+    :param local_files:
+        Files in the package from scan_local_files, to share one scan of the package between several plans
+    """
+
+    def __init__(
+        self,
+        state: State,
+        remote_path: str,
+        hash_jobs: int = None,
+        rules: ScanRules = None,
+        max_deltas: int = 10,
+        max_delta_ratio: float = 0.5,
+        local_files: Dict[str, File] = None,
+    ):
+        self.layer_index = LayerIndex(get_layer_index_path(state.statefilepath))
+        self.max_deltas = max_deltas
+        self.max_delta_ratio = max_delta_ratio
+        super().__init__(state, remote_path, hash_jobs=hash_jobs, rules=rules, local_files=local_files)
+
+    def apply_plan(self, dbfs: "Dbfs", jobs: int = 1):
+        """Uploads the changes to the package as one layer, applies the other operations and updates the statefile
+
+        :param dbfs:
+            An instance of the dbfs client to connect to Databricks
+        :param jobs:
+            Maximum number of concurrent DBFS operations
+        """
+        files_to_upload = self.files_updated + self.files_new
+        package_upload = [file for file in files_to_upload if is_package_file(file)]
+        package_deleted = [file for file in self.files_deleted if is_package_file(file)]
+        other_upload = [file for file in files_to_upload if not is_package_file(file)]
+        other_deleted = [file for file in self.files_deleted if not is_package_file(file)]
+
+        if files_to_upload or self.files_deleted:
+            self.logger.info("Applying plan...")
+
+        self.prefetch_hashes(files_to_upload)
+        layers_replaced = []
+        with stats.phase("apply"):
+            remote_layers = self._list_remote_layers(dbfs)
+            self.layer_index.sequence = max(
+                [self.layer_index.sequence] + [get_layer_sequence(name) for name in remote_layers]
+            )
+            in_sync = sorted(remote_layers) == sorted(self.layer_index.names())
+            if not in_sync:
+                self.logger.warning(f"The layers on DBFS differ from {self.layer_index.path}, uploading a new base")
+            if package_upload or package_deleted or not in_sync or not self.layer_index.layers:
+                sequence = self.layer_index.sequence
+                with stats.phase("upload"):
+                    layers_replaced = self._ship_layer(dbfs, package_upload, package_deleted, force_base=not in_sync)
+                if self.layer_index.sequence > sequence:
+                    # Layers on DBFS that the index did not know about are replaced by the new base as well
+                    layers_replaced = sorted(
+                        set(layers_replaced).union(remote_layers).difference(self.layer_index.names())
+                    )
+            self._apply_operations(dbfs, other_upload, other_deleted, jobs)
+        self._refresh_state_stats()
+
+        self.state.store_state()
+        self.layer_index.store()
+
+        self._run_operations(partial(self._remove_layer, dbfs), layers_replaced, jobs)
+
+    def _list_remote_layers(self, dbfs: "Dbfs") -> List[str]:
+        """Names of the layers on DBFS, relative to the remote path like the names in the LayerIndex"""
+        try:
+            paths = dbfs.ls(os.path.join(self.remote_path, LAYERS_DIR), strings_only=True)
+        except DatabricksApiError as exc:
+            if exc.api_response_json.get("error_code") == "RESOURCE_DOES_NOT_EXIST":
+                return []
+            raise
+        names = [path.rstrip("/").rsplit("/", 1)[-1] for path in paths]
+        return [f"{LAYERS_DIR}/{name}" for name in names if _LAYER_NAME.match(name)]
+
+    def _ship_layer(
+        self, dbfs: "Dbfs", package_upload: List[File], package_deleted: List[File], force_base: bool = False
+    ) -> List[str]:
+        """Builds and uploads a delta, or a new base if the layers need to be compacted or force_base is set, and
+        updates the state
+
+        :returns:
+            The names of the layers that were replaced by a new base and can be removed
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            archive_path = os.path.join(tmp, "layer.zip")
+            kind = "delta"
+            if self.layer_index.layers and not force_base:
+                build_zip_bundle(package_upload, archive_path, tombstones=[file.path for file in package_deleted])
+                delta_size = os.path.getsize(archive_path)
+                if self.layer_index.needs_compaction(delta_size, self.max_deltas, self.max_delta_ratio):
+                    self.logger.info("Compacting layers into a new base")
+                    kind = "base"
+            else:
+                kind = "base"
+            if kind == "base":
+                build_zip_bundle([file for file in self.local_files.values() if is_package_file(file)], archive_path)
+
+            name = self.layer_index.next_name(kind)
+            dbfs_path = os.path.join(self.remote_path, name)
+            self._create_remote_dirs(dbfs, [name], jobs=1)
+            self.logger.info(f"Copying {kind} layer to {dbfs_path}")
+            try:
+                dbfs.cp(archive_path, dbfs_path, overwrite=True)
+            except Exception as exc:
+                self.logger.error(f"Exception encountered while copying {name}: {exc}")
+                return []
+            size = os.path.getsize(archive_path)
+            stats.count("files_uploaded")
+            stats.count("bytes_uploaded", size)
+
+        layers_replaced = []
+        if kind == "base":
+            layers_replaced = self.layer_index.names()
+            for path in [path for path, file in self.state.files.items() if is_package_file(file)]:
+                del self.state.files[path]
+            package_upload = [file for file in self.local_files.values() if is_package_file(file)]
+            package_deleted = []
+            self.prefetch_hashes(package_upload)
+        self.layer_index.add(name, size)
+        for file in package_upload:
+            self.state.files[file.path] = file
+        for file in package_deleted:
+            del self.state.files[file.path]
+        return layers_replaced
+
+    def _remove_layer(self, dbfs: "Dbfs", name: str) -> bool:
+        dbfs_path = os.path.join(self.remote_path, name)
+        self.logger.info(f"Removing {dbfs_path}")
+        try:
+            dbfs.rm(dbfs_path)
+        except Exception as exc:
+            self.logger.error(f"Exception encountered while removing {name}: {exc}")
+            return False
+        return True
+
+
+def get_archive_name(rel_package_path: str) -> str:
+    """Name of the archive on DBFS, based on the name of the package directory"""
+    return f"{os.path.basename(os.path.normpath(rel_package_path))}.zip"
+
+
+def get_layer_index_path(statefilepath: str) -> str:
+    """Path of the LayerIndex file that belongs to a statefile"""
+    return f"{statefilepath}.layers"
+
+
+def get_layer_sequence(name: str) -> int:
+    """The number of a layer, e.g. 3 for layers/000003-delta.zip"""
+    return int(_LAYER_NAME.match(name.rsplit("/", 1)[-1]).group(1))
+
+
+def is_package_file(file: File) -> bool:
+    """False for files outside of the package, such as the requirements file"""
+    return not file.path.startswith(os.pardir + os.sep)
+
+
+def calculate_bundle_hash(files: Iterable[File]) -> str:
+    """Calculates a hash over the paths and hashes of all files, which changes whenever the archive contents would"""
+    bundle_hash = sha256()
+    for file in sorted(files, key=lambda f: f.path):
+        bundle_hash.update(f"{file.path}\0{file.hash}\n".encode())
+    return bundle_hash.hexdigest()
+
+
+def build_zip_bundle(files: List[File], archive_path: str, tombstones: List[str] = None):
+    """Writes the files to a zip archive, at the same paths relative to the package as on disk.
+    The archive only depends on the file paths and contents, not on timestamps or the order of files.
+
+    :param files:
+    :param archive_path:
+        Absolute path of the archive to create
+    :param tombstones:
+        Paths of deleted files. If given, these are listed in a TOMBSTONES_NAME file in the archive
+    """
+    with zipfile.ZipFile(archive_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for file in sorted(files, key=lambda f: f.path):
+            info = _zip_info(file.path.replace(os.sep, "/"))
+            with open(file.path_abs, "rb") as source, archive.open(info, "w") as target:
+                while True:
+                    chunk = source.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+        if tombstones:
+            lines = "".join(f"{path.replace(os.sep, '/')}\n" for path in sorted(tombstones))
+            archive.writestr(_zip_info(TOMBSTONES_NAME), lines)
+
+
+def _zip_info(name: str) -> zipfile.ZipInfo:
+    info = zipfile.ZipInfo(name, date_time=_ZIP_DATE_TIME)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    info.external_attr = 0o644 << 16
+    return info
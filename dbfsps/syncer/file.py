@@ -1,11 +1,32 @@
 import os
+import sys
 import logging
-from typing import List
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Tuple
 from hashlib import sha256
+from dbfsps import stats
+
+HASH_BUFFER_SIZE = 1024 * 1024
+PROCESS_HASH_MIN_SIZE = 32 * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+class FileStats(NamedTuple):
+    """File system metadata used to detect whether a file may have changed since its hash was calculated"""
+
+    size: int
+    mtime_ns: int
+    inode: int
 
 
 class File:
     """
+    A file in the package, or a file as recorded in the state.
+
+    The hash is calculated lazily, the first time it is needed, and then kept. Instances use __slots__ and
+    share the package and root strings, since there is one for every file in the package and the state.
+
     :param relpath:
         Path to the file relative to the package
     :param relpackagepath:
@@ -17,30 +38,52 @@ class File:
     :param relpath_remote:
         Optional different remote relative path, needed for the requirements.txt file for example.
         By default, self.relpath_remote is simply self.path.
+    :param stats:
+        Optional size, modification time and inode of the file at the moment the hash was calculated
     """
 
+    __slots__ = ("path", "package", "root", "path_remote", "stats", "_hash")
+
     def __init__(
-        self, relpath: str, relpackagepath: str, root_dir: str, hashstr: str = None, relpath_remote: str = None
+        self,
+        relpath: str,
+        relpackagepath: str,
+        root_dir: str,
+        hashstr: str = None,
+        relpath_remote: str = None,
+        stats: FileStats = None,
     ):
-        self.logger = logging.getLogger(__name__)
         self.path = relpath
-        self.package = relpackagepath
-        self.root = root_dir
-        self.path_abs = os.path.join(self.root, self.package, self.path)
-
-        if not hashstr:
-            self.hash = self._generate_hash()
-        else:
-            self.hash = hashstr
-
-        if not relpath_remote:
-            self.path_remote = self.path
-        else:
-            self.path_remote = relpath_remote
+        self.package = sys.intern(os.fspath(relpackagepath))
+        self.root = sys.intern(os.fspath(root_dir))
+        self.path_remote = relpath_remote or relpath
+        self.stats = stats
+        self._hash = hashstr or None
+
+    @property
+    def path_abs(self) -> str:
+        return os.path.join(self.root, self.package, self.path)
+
+    @property
+    def hash(self) -> str:
+        if self._hash is None:
+            self._hash = self._generate_hash()
+        return self._hash
+
+    @hash.setter
+    def hash(self, hashstr: str):
+        self._hash = hashstr
+
+    def is_hashed(self) -> bool:
+        """True if the hash is known, so accessing it does not read the file"""
+        return self._hash is not None
 
     def _generate_hash(self) -> str:
-        hashstr = calculate_file_hash(self.path_abs)
-        self.logger.debug(f"Generated hash for {self.path}")
+        with stats.phase("hash"):
+            hashstr = calculate_file_hash(self.path_abs)
+        stats.count("files_hashed")
+        stats.count("bytes_hashed", self.stats.size if self.stats else 0)
+        logger.debug(f"Generated hash for {self.path}")
         return hashstr
 
     def __eq__(self, other) -> bool:
@@ -56,6 +99,26 @@ class File:
             return False
 
 
+def hash_files(files: Iterable[File], jobs: int = None):
+    """Calculates the hashes of the files that are not hashed yet in parallel, see calculate_file_hashes
+
+    :param files:
+    :param jobs:
+        Number of workers per pool. Defaults to the number of CPUs
+    """
+    to_hash = [file for file in files if not file.is_hashed()]
+    if not to_hash:
+        return
+    logger.info(f"Calculating hashes of {len(to_hash)} files")
+    sizes = [(file.path_abs, file.stats.size if file.stats else 0) for file in to_hash]
+    with stats.phase("hash"):
+        hashes = calculate_file_hashes(sizes, jobs=jobs)
+    stats.count("files_hashed", len(to_hash))
+    stats.count("bytes_hashed", sum(size for _, size in sizes))
+    for file in to_hash:
+        file.hash = hashes[file.path_abs]
+
+
 def sort_list_of_files(files: List[File]) -> List[File]:
     """
     Sorts a list of File instances based on their `path` attribute,
@@ -74,9 +137,67 @@ def sort_list_of_files(files: List[File]) -> List[File]:
     return sorted(files, key=get_sort_key)
 
 
-def calculate_file_hash(path_abs: str) -> str:
+def calculate_file_hash(path_abs: str, buffer_size: int = HASH_BUFFER_SIZE) -> str:
+    """Calculates the sha256 hash of a file by streaming it through a fixed size buffer,
+    so memory use does not depend on the size of the file
+
+    :param path_abs:
+        Absolute path to the file
+    :param buffer_size:
+        Number of bytes read from the file at a time
+    """
+    if buffer_size < 1:
+        raise ValueError(f"Buffer size must be a positive number of bytes, got {buffer_size}")
     if not os.path.isfile(path_abs):
         raise FileNotFoundError(f"Unable to calculate hash. File {path_abs} does not exist")
-    with open(path_abs, "rb") as f:
-        hashstr = sha256(f.read()).hexdigest()
-    return hashstr
+    file_hash = sha256()
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(path_abs, "rb", buffering=0) as f:
+        n_bytes = f.readinto(buffer)
+        while n_bytes:
+            file_hash.update(view[:n_bytes])
+            n_bytes = f.readinto(buffer)
+    return file_hash.hexdigest()
+
+
+def calculate_file_hashes(
+    files: List[Tuple[str, int]], jobs: int = None, process_min_size: int = PROCESS_HASH_MIN_SIZE
+) -> Dict[str, str]:
+    """Calculates the hashes of many files in parallel.
+
+    Small files are dominated by I/O and open/close overhead and are hashed in a pool of threads.
+    Files of at least process_min_size bytes are hashed in a pool of processes, so large files use all cores.
+
+    :param files:
+        List of (absolute path, size in bytes) tuples
+    :param jobs:
+        Number of workers per pool. Defaults to the number of CPUs
+    :param process_min_size:
+        Files of at least this size are hashed in the process pool
+    :returns:
+        Dictionary of absolute path to hash
+    """
+    if not jobs:
+        jobs = os.cpu_count() or 1
+    if jobs == 1 or len(files) <= 1:
+        return {path_abs: calculate_file_hash(path_abs) for path_abs, _ in files}
+
+    paths_small = [path_abs for path_abs, size in files if size < process_min_size]
+    paths_large = [path_abs for path_abs, size in files if size >= process_min_size]
+    hashes = {}
+    if len(paths_large) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(paths_large))) as executor:
+            hashes.update(zip(paths_large, executor.map(calculate_file_hash, paths_large)))
+    else:
+        paths_small += paths_large
+    if paths_small:
+        with ThreadPoolExecutor(max_workers=min(jobs, len(paths_small))) as executor:
+            hashes.update(zip(paths_small, executor.map(calculate_file_hash, paths_small)))
+    return hashes
+
+
+def get_file_stats(path_abs: str) -> FileStats:
+    """Reads the size, modification time (in nanoseconds) and inode of a file"""
+    stat_result = os.stat(path_abs)
+    return FileStats(stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino)
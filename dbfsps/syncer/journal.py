@@ -0,0 +1,62 @@
+import os
+import json
+import logging
+from typing import Iterable, Iterator, Tuple
+from dbfsps.syncer.file import File, FileStats
+from dbfsps.syncer.backends import StateRecord
+
+JournalEntry = Tuple[str, StateRecord]
+
+
+class Journal:
+    """Append-only log of the operations on DBFS that completed since the state was last stored
+    (<statefile>.journal).
+
+    Every entry is written and flushed as soon as its operation completes, so the progress of an interrupted apply
+    survives the process. On the next start, State replays the entries on top of the stored state. A line that was
+    only partly written when the process stopped is ignored.
+
+    :param path:
+        Absolute path to the journal file
+    """
+
+    def __init__(self, path: str):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self._file = None
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.path)
+
+    def append(self, files_changed: Iterable[File], paths_removed: Iterable[str]):
+        """Records uploaded and removed files. Not thread safe, the caller holds a lock"""
+        if self._file is None:
+            self._file = open(self.path, "a")
+        for file in files_changed:
+            stats = list(file.stats) if file.stats else None
+            self._file.write(json.dumps({"op": "upload", "path": file.path, "hash": file.hash, "stats": stats}) + "\n")
+        for path in paths_removed:
+            self._file.write(json.dumps({"op": "remove", "path": path}) + "\n")
+        self._file.flush()
+
+    def replay(self) -> Iterator[JournalEntry]:
+        """Yields ("upload", (path, hash, stats)) or ("remove", (path, None, None)) for every entry, in order"""
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    self.logger.warning(f"Skipping incomplete entry in {self.path}")
+                    continue
+                stats = FileStats(*entry["stats"]) if entry.get("stats") else None
+                yield entry["op"], (entry["path"], entry.get("hash"), stats)
+
+    def clear(self):
+        """Deletes the journal, once the state that includes its entries is stored"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import uuid
+import logging
+import tempfile
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+from dbfsps import stats
+from dbfsps.sdk.errors import DatabricksApiError
+
+if TYPE_CHECKING:
+    from dbfsps.sdk.dbfs import Dbfs
+
+MANIFEST_NAME = ".dbfsps_manifest.json"
+MANIFEST_VERSION = 1
+
+
+class ManifestConflictError(RuntimeError):
+    """Raised if other syncs kept updating the manifest while it was written"""
+
+
+class RemoteManifest:
+    """Paths and hashes of the files on DBFS, stored next to the package (<remote_path>/.dbfsps_manifest.json).
+
+    Unlike the statefile, the manifest is shared by every machine that syncs the package, so a fresh CI runner or
+    a new clone only uploads what actually differs from DBFS. It is read with a single request at plan time, and
+    written back after the plan is applied: uploaded to a temporary path and then moved in place, so a partly written
+    manifest is never read.
+
+    Every write increases the generation in the manifest. Before writing, the generation is read again: if another
+    sync wrote in the meantime, its changes are merged with the changes of this sync (see merge_manifests) and the
+    write is retried. The manifest is read back after the write, to catch a sync that wrote at the same moment.
+    Moving the new manifest in place fails if another sync moved its manifest there first, and a manifest that
+    existed before can be missing for a moment while another sync replaces it. Both are conflicts as well: the
+    write is retried after retry_delay seconds. DBFS has no conditional writes, so this narrows the window for a
+    lost update but cannot close it completely.
+
+    :param dbfs:
+        An instance of the dbfs client to connect to Databricks
+    :param remote_path:
+        Path, including dbfs: prefix, of the remote package directory
+    :param max_attempts:
+        Number of attempts to write the manifest, when other syncs write it at the same time
+    :param retry_delay:
+        Seconds to wait before another attempt
+    """
+
+    def __init__(self, dbfs: "Dbfs", remote_path: str, max_attempts: int = 5, retry_delay: float = 1.0):
+        self.logger = logging.getLogger(__name__)
+        self.dbfs = dbfs
+        self.path = f"{remote_path.rstrip('/')}/{MANIFEST_NAME}"
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        # The manifest as last read or written, which writes are compared with
+        self.generation = 0
+        self.hashes: Dict[str, str] = {}
+
+    def load(self) -> Dict[str, str]:
+        """Reads the manifest and keeps it as the base for the next write
+
+        :returns:
+            Hashes by path relative to the package directory. Empty if there is no manifest yet
+        """
+        self.generation, self.hashes, _ = self._read()
+        self.logger.info(f"Loaded {len(self.hashes)} files from {self.path} (generation {self.generation})")
+        return dict(self.hashes)
+
+    def store(self, hashes: Dict[str, str]) -> Dict[str, str]:
+        """Writes the files that are on DBFS after applying a plan, unless nothing changed
+
+        :param hashes:
+            Hashes by path relative to the package directory
+        :returns:
+            The hashes that were written, including the changes of other syncs that wrote in the meantime
+        :raises ManifestConflictError:
+            If the manifest was changed by other syncs during every attempt
+        """
+        with stats.phase("manifest_write"):
+            for attempt in range(self.max_attempts):
+                if attempt:
+                    time.sleep(self.retry_delay)
+                generation, latest, _ = self._read()
+                if generation == 0 and self.generation > 0:
+                    self.logger.warning(f"{self.path} is missing, waiting for another sync that is replacing it")
+                    continue
+                if generation != self.generation:
+                    self.logger.warning(f"{self.path} was updated by another sync, merging its changes")
+                    hashes = merge_manifests(self.hashes, hashes, latest)
+                    self.generation, self.hashes = generation, latest
+                if hashes == self.hashes:
+                    return hashes
+
+                writer = uuid.uuid4().hex
+                if not self._write(generation + 1, hashes, writer):
+                    self.logger.warning(f"Another sync moved its manifest to {self.path} first")
+                    continue
+                generation_written, _, writer_written = self._read()
+                if (generation_written, writer_written) == (generation + 1, writer):
+                    self.generation, self.hashes = generation + 1, dict(hashes)
+                    return hashes
+                self.logger.warning(f"{self.path} was written by another sync at the same time")
+        raise ManifestConflictError(f"{self.path} kept changing, gave up after {self.max_attempts} attempts")
+
+    def _read(self) -> Tuple[int, Dict[str, str], Optional[str]]:
+        """The generation, hashes and writer of the manifest on DBFS. Generation 0 if there is none"""
+        with stats.phase("manifest_read"):
+            try:
+                contents = self.dbfs.cat(self.path)
+            except DatabricksApiError as exc:
+                if exc.api_response_json.get("error_code") == "RESOURCE_DOES_NOT_EXIST":
+                    return 0, {}, None
+                raise
+        manifest = json.loads(contents)
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"Unsupported version {manifest.get('version')} of {self.path}")
+        hashes = {path.replace("/", os.sep): hashstr for path, hashstr in manifest["files"].items()}
+        return manifest["generation"], hashes, manifest.get("writer")
+
+    def _write(self, generation: int, hashes: Dict[str, str], writer: str) -> bool:
+        """Uploads the manifest to a temporary path and moves it in place
+
+        :returns:
+            False if another sync moved its manifest in place first. The temporary file is removed
+        """
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "generation": generation,
+            "writer": writer,
+            "files": {path.replace(os.sep, "/"): hashstr for path, hashstr in sorted(hashes.items())},
+        }
+        temp_path = f"{self.path}.{writer}.tmp"
+        moved = False
+        try:
+            fd, local_path = tempfile.mkstemp(suffix=".json")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(manifest, f)
+                self.dbfs.cp(local_path, temp_path, overwrite=True)
+            finally:
+                os.remove(local_path)
+            # Moving does not replace an existing file, so the old manifest is removed right before. A sync that
+            # reads in between finds no manifest, see store
+            if generation > 1:
+                try:
+                    self.dbfs.rm(self.path)
+                except DatabricksApiError as exc:
+                    if exc.api_response_json.get("error_code") != "RESOURCE_DOES_NOT_EXIST":
+                        raise
+            self.dbfs.mv(temp_path, self.path)
+            moved = True
+        except DatabricksApiError as exc:
+            if exc.api_response_json.get("error_code") != "RESOURCE_ALREADY_EXISTS":
+                raise
+        finally:
+            if not moved:
+                self._remove_temp(temp_path)
+        return moved
+
+    def _remove_temp(self, temp_path: str):
+        try:
+            self.dbfs.rm(temp_path)
+        except Exception as exc:
+            self.logger.warning(f"Failed to remove {temp_path}: {exc}")
+
+
+def merge_manifests(base: Dict[str, str], ours: Dict[str, str], theirs: Dict[str, str]) -> Dict[str, str]:
+    """Merges the changes that two syncs made to the same manifest
+
+    Paths that only one of the syncs changed (uploaded or removed) get that change. Paths that both changed
+    differently are left out, since it is unknown which upload landed last: the next sync uploads them again.
+
+    :param base:
+        Hashes by path in the manifest that both syncs started from
+    :param ours:
+        Hashes after the changes of this sync
+    :param theirs:
+        Hashes in the manifest written by the other sync
+    """
+    merged = dict(theirs)
+    for path in set(base).union(ours):
+        if ours.get(path) == base.get(path) or ours.get(path) == theirs.get(path):
+            continue
+        if theirs.get(path) == base.get(path):
+            if path in ours:
+                merged[path] = ours[path]
+            else:
+                merged.pop(path, None)
+        else:
+            merged.pop(path, None)
+    return merged
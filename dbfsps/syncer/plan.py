@@ -1,10 +1,27 @@
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Tuple
+from dbfsps import stats
 from dbfsps.syncer.state import State
-from dbfsps.syncer.file import File, sort_list_of_files, calculate_file_hash
-from dbfsps.sdk.dbfs import Dbfs
+from dbfsps.syncer.file import (
+    File,
+    FileStats,
+    sort_list_of_files,
+    calculate_file_hash,
+    get_file_stats,
+    hash_files,
+)
+from dbfsps.syncer.scanner import ScanRules, scan_files
+from dbfsps.syncer.tree import FileTree, diff_trees
+from dbfsps.syncer.manifest import MANIFEST_NAME, RemoteManifest
+from dbfsps.sdk.errors import DatabricksApiError
 from dbfsps.cli.utils import create_requirements_file
 
+if TYPE_CHECKING:
+    from dbfsps.sdk.dbfs import Dbfs
+
 
 class Plan:
     """
@@ -16,43 +33,124 @@ class Plan:
     :param state:
     :param remote_path:
         Path, including dbfs: prefix to the directory to which the package should be uploaded
+    :param hash_jobs:
+        Number of workers used to calculate file hashes. Defaults to the number of CPUs
+    :param rules:
+        Rules that decide which files in the package are synced. By default only caches such as __pycache__ are skipped
+    :param local_files:
+        Files in the package from scan_local_files, to share one scan of the package between several plans.
+        The package is scanned by the plan if not given
     """
 
-    def __init__(self, state: State, remote_path: str):
+    def __init__(
+        self,
+        state: State,
+        remote_path: str,
+        hash_jobs: int = None,
+        rules: ScanRules = None,
+        local_files: Dict[str, File] = None,
+    ):
         self.logger = logging.getLogger(__name__)
         self.state = state
         self.remote_path = remote_path
-        self._skip_dirs = ["__pycache__"]
-        self.local_files = {}
+        self.hash_jobs = hash_jobs
+        self.rules = rules or ScanRules()
+        self.local_files = FileTree()
+        self.manifest: Optional[RemoteManifest] = None
 
         self.files_deleted = []
         self.files_new = []
         self.files_updated = []
 
         self.logger.info(f"Creating plan for package {self.state.packagepath}")
-        self._get_local_files()
+        self._get_local_files(local_files)
         self._plan()
 
-    def _get_local_files(self):
-        for root, dirs, files in os.walk(self.state.packagepath):
-            if os.path.basename(root) not in self._skip_dirs:
-                for file_name in files:
-                    rel_file_path = os.path.join(root.replace(self.state.packagepath, "").lstrip("/"), file_name)
-                    self.logger.debug(f"Scanning {rel_file_path}")
-
-                    file_obj = File(rel_file_path, self.state.package, self.state.root)
-                    self.local_files[file_obj.path] = file_obj
+    def _get_local_files(self, local_files: Dict[str, File] = None):
+        if local_files is None:
+            local_files = scan_local_files(self.state, self.rules)
+        else:
+            # Only the package files are shared, files outside of the package such as requirements.txt are added below
+            local_files = {path: file for path, file in local_files.items() if path == file.path_remote}
+        self._add_local_files(local_files.values())
         self._add_requirements_file()
 
+    def refresh(self, rel_paths: Iterable[str]):
+        """Re-scans only the given paths and updates the plan. Used to keep a plan up to date in watch mode,
+        without scanning the whole package again.
+
+        :param rel_paths:
+            Paths of changed files or directories, relative to the package directory.
+            An empty string refreshes the whole package. Paths that no longer exist are planned for removal
+        """
+        discovered = []
+        for rel_path in set(rel_paths):
+            if rel_path:
+                prefix = rel_path + os.sep
+                stale = [path for path in self.local_files if path == rel_path or path.startswith(prefix)]
+            else:
+                stale = [path for path, file in self.local_files.items() if file.path_remote == path]
+            for path in stale:
+                del self.local_files[path]
+
+            path_abs = os.path.join(self.state.packagepath, rel_path)
+            if rel_path and self.rules.is_path_excluded(rel_path):
+                continue
+            if os.path.isdir(path_abs):
+                for rel_file_path, _, file_stats in scan_files(self.state.packagepath, self.rules, rel_dir=rel_path):
+                    discovered.append((rel_file_path, file_stats))
+            elif os.path.isfile(path_abs):
+                file_stats = get_file_stats(path_abs)
+                if self.rules.is_included(rel_path, os.path.basename(rel_path), file_stats.size):
+                    discovered.append((rel_path, file_stats))
+
+        self._add_local_files(
+            File(rel_file_path, self.state.package, self.state.root, stats=file_stats)
+            for rel_file_path, file_stats in discovered
+        )
+        self._plan()
+
+    def has_changes(self) -> bool:
+        """True if applying the plan would upload or delete anything"""
+        return bool(self.files_new or self.files_updated or self.files_deleted)
+
+    def _add_local_files(self, files: Iterable[File]):
+        """Adds files to local_files. Hashes of unchanged files are taken from the state, files that are also in
+        the state but did change are hashed in parallel. Other files are only hashed once their hash is needed.
+
+        :param files:
+            Files in the package, which may be shared with other plans. Their hash is calculated only once
+        """
+        files_compared = []
+        for file_obj in files:
+            file_state = self.state.lookup(file_obj.path)
+            if not file_obj.is_hashed():
+                hashstr = self._get_cached_hash(file_state, file_obj.stats)
+                if hashstr is not None:
+                    file_obj.hash = hashstr
+            self.local_files[file_obj.path] = file_obj
+            if file_state is not None:
+                files_compared.append(file_obj)
+        self.prefetch_hashes(files_compared)
+
+    def prefetch_hashes(self, files: Iterable[File]):
+        """Calculates the hashes of files that will be needed soon in parallel, instead of one by one"""
+        hash_files(files, jobs=self.hash_jobs)
+
+    def _get_cached_hash(self, file_state: Optional[File], stats: FileStats) -> Optional[str]:
+        """Returns the hash stored in the state if the file stats did not change since it was calculated"""
+        if file_state is not None and file_state.stats is not None and file_state.stats == stats:
+            self.logger.debug(f"Reusing stored hash of {file_state.path}")
+            return file_state.hash
+        return None
+
     def _add_requirements_file(self):
         req_rel_path = get_requirements_relative_path(self.state.package)
-        req_abs_path = os.path.join(self.state.root, "requirements.txt")
         lock_abs_path = os.path.join(self.state.root, "poetry.lock")
 
-        if not os.path.isfile(req_abs_path):
-            create_requirements_file()
-
-        requirements_hash = calculate_file_hash(lock_abs_path)
+        with stats.phase("requirements"):
+            requirements_hash = calculate_file_hash(lock_abs_path)
+            create_requirements_file(self.state.root, lock_hash=requirements_hash)
         file_req = File(
             req_rel_path,
             self.state.package,
@@ -63,27 +161,123 @@ class Plan:
         self.local_files[file_req.path] = file_req
 
     def _plan(self):
-        set_local = set(self.local_files.keys())
-        set_remote = set(self.state.files.keys())
-        set_both = set_local.intersection(set_remote)
-        list_new = list(set_local - set_remote)
-        list_delete = list(set_remote - set_local)
-        self.logger.debug(f"List new: {list_new}")
-        self.logger.debug(f"List delete: {list_delete}")
-        list_update = []
-        for path in set_both:
-            file_local = self.local_files[path]
-            file_remote = self.state.files[path]
-            if file_local != file_remote:
-                self.logger.debug(f"Hash of {path} differs")
-                if "requirements.txt" in path:
-                    # In this case the lockfile has changes, so the requirements file needs to be regenerated
-                    self.logger.info("Lockfile has changed, re-creating requirements.txt")
-                    create_requirements_file()
-                list_update.append(file_local)
-        self.files_updated = sort_list_of_files(list_update)
-        self.files_new = sort_list_of_files([self.local_files[k] for k in list_new])
-        self.files_deleted = sort_list_of_files([self.state.files[k] for k in list_delete])
+        with stats.phase("plan"):
+            # Only directories whose rolled-up hashes differ are compared file by file
+            remote_files = self._get_remote_files()
+            if remote_files is None:
+                list_new, list_update, list_delete, remote_files = self._diff_state_lookups()
+            else:
+                list_new, list_update, list_delete = diff_trees(self.local_files, remote_files)
+            self.logger.debug(f"List new: {list_new}")
+            self.logger.debug(f"List delete: {list_delete}")
+            self.logger.debug(f"List update: {list_update}")
+            self.files_updated = sort_list_of_files([self.local_files[k] for k in list_update])
+            self.files_new = sort_list_of_files([self.local_files[k] for k in list_new])
+            self.files_deleted = sort_list_of_files([remote_files[k] for k in list_delete])
+
+    def _get_remote_files(self) -> Optional[FileTree]:
+        """The files that are on DBFS according to the state, which the local files are compared with.
+        None if the state is not loaded, the local files are then compared with single lookups in the state"""
+        return self.state.files if self.state.loaded else None
+
+    def _diff_state_lookups(self) -> Tuple[List[str], List[str], List[str], Dict[str, File]]:
+        """Compares the local files with the state file by file, without loading every file in the state
+
+        :returns:
+            Paths of the new, updated and deleted files, and the deleted files in the state by path
+        """
+        list_new, list_update = [], []
+        for path, file_local in self.local_files.items():
+            file_state = self.state.lookup(path)
+            if file_state is None:
+                list_new.append(path)
+            elif file_state != file_local:
+                list_update.append(path)
+        list_delete = [path for path in self.state.paths() if path not in self.local_files]
+        return list_new, list_update, list_delete, {path: self.state.lookup(path) for path in list_delete}
+
+    def use_manifest(self, manifest: RemoteManifest):
+        """Plans against the files in the shared manifest on DBFS instead of the local state, and writes the manifest
+        back after applying the plan. The state is replaced with the manifest, keeping the stats of files whose
+        hash is the same, so unchanged files are still not hashed again.
+
+        :param manifest:
+        """
+        self.manifest = manifest
+        hashes = manifest.load()
+        self._rebase_state(hashes)
+        self.prefetch_hashes(self.local_files[path] for path in hashes if path in self.local_files)
+        self._plan()
+
+    def _rebase_state(self, hashes: Dict[str, str]):
+        """Replaces the files in the state with hashes by path"""
+        files = FileTree()
+        for path, hashstr in hashes.items():
+            file_state = self.state.files.get(path)
+            if file_state is None or not file_state.is_hashed() or file_state.hash != hashstr:
+                file_state = File(path, self.state.package, self.state.root, hashstr=hashstr)
+            files[path] = file_state
+        self.state.files = files
+
+    def reconcile(self, dbfs: "Dbfs", workers: int = 8):
+        """Compares the state with the files that are actually on DBFS, using a single recursive listing of the
+        remote path, and updates the plan so that only files that are missing remotely or differ in size are uploaded.
+
+        Files in the state that are missing on DBFS or have a different size are planned for upload again. Local files
+        that are not in the state, e.g. because the statefile was lost, but are on DBFS with the same size are taken
+        into the state without uploading them. Files on DBFS that are not in the state are only reported.
+
+        :param dbfs:
+            An instance of the dbfs client to connect to Databricks
+        :param workers:
+            Maximum number of remote directories listed at the same time
+        """
+        self.logger.info(f"Listing {self.remote_path} to reconcile the state")
+        with stats.phase("reconcile"):
+            remote_sizes = self._list_remote_sizes(dbfs, workers)
+
+        n_drifted = n_adopted = 0
+        for path, file_local in self.local_files.items():
+            remote_size = remote_sizes.pop(file_local.path_remote.replace(os.sep, "/"), None)
+            in_state = path in self.state.files
+            if remote_size is not None and remote_size == get_file_size(file_local):
+                if not in_state:
+                    self.logger.debug(f"Found {path} on DBFS, adding it to the state")
+                    self.state.files[path] = file_local
+                    n_adopted += 1
+            elif in_state:
+                self.logger.debug(f"{path} is missing on DBFS or differs in size, it will be uploaded again")
+                del self.state.files[path]
+                n_drifted += 1
+
+        for path in [path for path in self.state.files if path not in self.local_files]:
+            file_state = self.state.files[path]
+            if remote_sizes.pop(file_state.path_remote.replace(os.sep, "/"), None) is None:
+                self.logger.debug(f"{path} is already removed from DBFS")
+                del self.state.files[path]
+
+        remote_sizes.pop(MANIFEST_NAME, None)
+        for remote_relpath in sorted(remote_sizes):
+            self.logger.warning(f"{remote_relpath} is on DBFS but is not managed by dbfsps")
+
+        self.logger.info(f"Reconciled state: {n_drifted} files drifted, {n_adopted} files found on DBFS")
+        self._plan()
+
+    def _list_remote_sizes(self, dbfs: "Dbfs", workers: int) -> Dict[str, int]:
+        """Sizes of all files below the remote path, by path relative to it"""
+        prefix = self.remote_path.rstrip("/") + "/"
+        try:
+            remote_files = dbfs.ls(self.remote_path, recursive=True, workers=workers)
+        except DatabricksApiError as exc:
+            if exc.api_response_json.get("error_code") == "RESOURCE_DOES_NOT_EXIST":
+                return {}
+            raise
+        sizes = {}
+        for file_info in remote_files:
+            path = file_info.dbfs_path.absolute_path
+            if path.startswith(prefix):
+                sizes[path[len(prefix) :]] = file_info.file_size
+        return sizes
 
     def print_plan(self):
         """Prints the plan to standard output"""
@@ -114,48 +308,338 @@ class Plan:
         footer = "=" * len(header)
         return header, footer
 
-    def apply_plan(self, dbfs: Dbfs):
-        """Executes the delete/add/update operations from the plan and updates the statefile
+    def apply_plan(self, dbfs: "Dbfs", jobs: int = 1):
+        """Executes the delete/add/update operations from the plan and updates the statefile, and the shared manifest
+        if the plan uses one
+
+        Uploads are sent to DBFS concurrently, followed by the deletions. Deletions only start once all uploads
+        have finished, so an upload and a deletion never race on the same remote path. Every completed operation
+        is recorded in the state right away, see State.update_files, so an interrupted apply resumes where it stopped.
 
         :param dbfs:
             An instance of the dbfs client to connect to Databricks
+        :param jobs:
+            Maximum number of concurrent DBFS operations
         """
         files_to_upload = self.files_updated + self.files_new
-        files_uploaded = []
-        files_deleted = []
 
         if files_to_upload or self.files_deleted:
             self.logger.info("Applying plan...")
 
-        for file in files_to_upload:
-            dbfs_path = os.path.join(self.remote_path, file.path_remote)
-            self.logger.info(f"Copying {file.path_abs} to {dbfs_path}")
-            try:
-                dbfs.cp(file.path_abs, dbfs_path, overwrite=True)
-                files_uploaded.append(file)
-            except Exception as exc:
-                self.logger.error(f"Exception encountered while copying {file.path}: {exc}")
-        for file in self.files_deleted:
-            dbfs_path = os.path.join(self.remote_path, file.path_remote)
+        self.prefetch_hashes(files_to_upload)
+        with stats.phase("apply"):
+            self._apply_operations(dbfs, files_to_upload, self.files_deleted, jobs)
+        self._refresh_state_stats()
+
+        self.state.store_state()
+        if self.manifest is not None:
+            self._store_manifest()
+
+    def _store_manifest(self):
+        """Writes the state to the manifest. If another sync wrote the manifest in the meantime, the state is
+        replaced with the merged manifest"""
+        hashes = {path: file.hash for path, file in self.state.files.items()}
+        hashes_written = self.manifest.store(hashes)
+        if hashes_written != hashes:
+            self._rebase_state(hashes_written)
+            self.state.store_state()
+
+    def _apply_operations(self, dbfs: "Dbfs", files_to_upload: List[File], files_to_delete: List[File], jobs: int):
+        """Uploads and then removes files, and records every successful operation in the state as it completes.
+
+        Directories of which all files are deleted are removed with a single recursive request, which also removes
+        the directory itself, if a listing of the directory on DBFS shows that it holds nothing else. Otherwise, e.g.
+        when something else wrote files next to the package, its files are removed one by one and the directories
+        that end up empty are removed afterwards. These and the remaining single files are removed concurrently.
+        """
+        with stats.phase("upload"):
+            self._create_remote_dirs(dbfs, [file.path_remote for file in files_to_upload], jobs)
+            self._run_operations(partial(self._upload_file, dbfs), files_to_upload, jobs)
+
+        paths_kept = set(self.local_files).union(self.state.paths()).difference(file.path for file in files_to_delete)
+        dirs_deleted, files_single = group_deletions(files_to_delete, paths_kept)
+        with stats.phase("delete"):
+            deletions, dirs_emptied = self._check_dir_deletions(dbfs, dirs_deleted, jobs)
+            deletions += [(None, [file]) for file in files_single]
+            self._run_operations(partial(self._remove_deletion, dbfs), deletions, jobs)
+            self._remove_empty_dirs(dbfs, dirs_emptied)
+
+    def _check_dir_deletions(
+        self, dbfs: "Dbfs", dirs_deleted: Dict[str, List[File]], jobs: int
+    ) -> Tuple[List[Tuple[Optional[str], List[File]]], List[str]]:
+        """Lists the directories that would be removed as a whole, concurrently, to find files on DBFS that are not
+        managed by dbfsps
+
+        :returns:
+            The deletions, of a directory or a single file, and the directories to remove once their files are removed
+        """
+        if not dirs_deleted:
+            return [], []
+        items = list(dirs_deleted.items())
+        with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(items)))) as executor:
+            unmanaged = list(executor.map(lambda item: self._list_unmanaged(dbfs, *item, jobs), items))
+
+        deletions = []
+        dirs_emptied = []
+        for (rel_dir, files), remote_relpaths in zip(items, unmanaged):
+            if remote_relpaths is not None and not remote_relpaths:
+                deletions.append((rel_dir, files))
+                continue
+            if remote_relpaths:
+                self.logger.info(f"{rel_dir} holds files that dbfsps does not manage, removing its files one by one")
+            deletions += [(None, [file]) for file in files]
+            dirs_emptied += get_emptied_dirs(rel_dir, files, remote_relpaths or [])
+        return deletions, dirs_emptied
+
+    def _list_unmanaged(self, dbfs: "Dbfs", rel_dir: str, files: List[File], workers: int) -> Optional[List[str]]:
+        """Paths, relative to the remote path, of the files on DBFS in rel_dir that are not in files.
+        None if the directory could not be listed"""
+        prefix = self.remote_path.rstrip("/") + "/"
+        try:
+            remote_files = dbfs.ls(prefix + rel_dir.replace(os.sep, "/"), recursive=True, workers=workers)
+        except Exception as exc:
+            if (
+                isinstance(exc, DatabricksApiError)
+                and exc.api_response_json.get("error_code") == "RESOURCE_DOES_NOT_EXIST"
+            ):
+                return []
+            self.logger.warning(f"Exception encountered while listing {rel_dir}: {exc}")
+            return None
+        managed = {file.path_remote.replace(os.sep, "/") for file in files}
+        remote_relpaths = [file_info.dbfs_path.absolute_path[len(prefix) :] for file_info in remote_files]
+        return [path for path in remote_relpaths if path not in managed]
+
+    def _remove_empty_dirs(self, dbfs: "Dbfs", rel_dirs: List[str]):
+        """Removes directories without a recursive request, deepest first, so a directory that still holds
+        anything is never removed"""
+        for rel_dir in sorted(rel_dirs, key=lambda path: path.count(os.sep), reverse=True):
+            dbfs_path = os.path.join(self.remote_path, rel_dir)
             self.logger.info(f"Removing {dbfs_path}")
             try:
                 dbfs.rm(dbfs_path)
-                files_deleted.append(file)
             except Exception as exc:
-                self.logger.error(f"Exception encountered while copying {file.path}: {exc}")
+                self.logger.warning(f"Could not remove {dbfs_path}: {exc}")
+
+    def _create_remote_dirs(self, dbfs: "Dbfs", remote_relpaths: List[str], jobs: int):
+        """Creates the remote directories that uploads to remote_relpaths need, before uploading anything.
+        Only the deepest directories are created, their parents are created along with them"""
+        self._run_operations(partial(self._create_dir, dbfs), get_upload_dirs(self.remote_path, remote_relpaths), jobs)
+
+    def _create_dir(self, dbfs: "Dbfs", dbfs_path: str) -> bool:
+        self.logger.debug(f"Creating {dbfs_path}")
+        try:
+            dbfs.mkdirs(dbfs_path)
+        except Exception as exc:
+            self.logger.error(f"Exception encountered while creating {dbfs_path}: {exc}")
+            return False
+        return True
+
+    def _remove_deletion(self, dbfs: "Dbfs", deletion: Tuple[Optional[str], List[File]]) -> bool:
+        rel_dir, files = deletion
+        if rel_dir is None:
+            removed = self._remove_file(dbfs, files[0])
+        else:
+            removed = self._remove_dir(dbfs, rel_dir, len(files))
+        if removed:
+            self.state.update_files([], files)
+        return removed
 
-        for file in files_uploaded:
+    def _refresh_state_stats(self):
+        """Stores the current stats of files whose contents did not change, e.g. after a checkout or touch,
+        so their hashes can be reused in the next run instead of being calculated again"""
+        files_refreshed = []
+        for path, file_local in self.local_files.items():
+            file_state = self.state.lookup(path)
+            if file_state is not None and file_state.stats != file_local.stats and file_state == file_local:
+                files_refreshed.append(file_local)
+        if not self.state.loaded:
+            self.state.update_files(files_refreshed, [])
+            return
+        for file in files_refreshed:
             self.state.files[file.path] = file
-        for file in files_deleted:
-            del self.state.files[file.path]
 
-        self.state.store_state()
+    def _upload_file(self, dbfs: "Dbfs", file: File):
+        dbfs_path = os.path.join(self.remote_path, file.path_remote)
+        source = self._get_source_path(file)
+        self.logger.info(f"Copying {source} to {dbfs_path}")
+        try:
+            dbfs.cp(source, dbfs_path, overwrite=True)
+        except Exception as exc:
+            self.logger.error(f"Exception encountered while copying {file.path}: {exc}")
+            return False
+        self._record_upload(file)
+        stats.count("files_uploaded")
+        stats.count("bytes_uploaded", get_file_size(file, source))
+        return True
+
+    def _get_source_path(self, file: File) -> str:
+        """Absolute path of the local file to upload for a file in the plan"""
+        return file.path_abs
+
+    def _record_upload(self, file: File):
+        """Records an uploaded file in the state"""
+        self.state.update_files([file], [])
+
+    def _remove_file(self, dbfs: "Dbfs", file: File):
+        dbfs_path = os.path.join(self.remote_path, file.path_remote)
+        self.logger.info(f"Removing {dbfs_path}")
+        try:
+            dbfs.rm(dbfs_path)
+        except Exception as exc:
+            self.logger.error(f"Exception encountered while removing {file.path}: {exc}")
+            return False
+        stats.count("files_deleted")
+        return True
+
+    def _remove_dir(self, dbfs: "Dbfs", rel_dir: str, n_files: int) -> bool:
+        dbfs_path = os.path.join(self.remote_path, rel_dir)
+        self.logger.info(f"Removing {dbfs_path} with {n_files} files")
+        try:
+            dbfs.rm(dbfs_path, recursive=True)
+        except Exception as exc:
+            self.logger.error(f"Exception encountered while removing {rel_dir}: {exc}")
+            return False
+        stats.count("files_deleted", n_files)
+        return True
+
+    @staticmethod
+    def _run_operations(operation: Callable[[Any], bool], files: List[Any], jobs: int) -> List[Any]:
+        """Runs operation for every file (or other item) in a bounded pool of worker threads
+
+        :param operation:
+            Callable that takes a file (or other item) and returns True if the operation succeeded
+        :param files:
+        :param jobs:
+            Maximum number of operations running at the same time
+        :returns:
+            The files for which the operation succeeded, in the same order as the input
+        """
+        if not files:
+            return []
+        with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(files)))) as executor:
+            results = list(executor.map(operation, files))
+        return [file for file, succeeded in zip(files, results) if succeeded]
 
 
 def get_requirements_relative_path(rel_package_path: str) -> str:
     """The requirements file should be in the root of the repo.
     This calculates the relative path to the file from the package dir"""
+    return get_root_relative_path(rel_package_path, "requirements.txt")
+
+
+def get_root_relative_path(rel_package_path: str, file_name: str) -> str:
+    """Calculates the relative path from the package dir to a file in the root of the repo"""
     levels = len(rel_package_path.split(os.sep))
     prefix = os.sep.join([".." for _ in range(levels)])
-    rel_path = os.path.join(prefix, "requirements.txt")
+    rel_path = os.path.join(prefix, file_name)
     return rel_path
+
+
+def scan_local_files(state: State, rules: ScanRules) -> Dict[str, File]:
+    """Scans the package directory of state for files to sync. The files are not hashed yet
+
+    :param state:
+    :param rules:
+        Rules that decide which files in the package are synced
+    :returns:
+        Files by path relative to the package directory
+    """
+    logger = logging.getLogger(__name__)
+    local_files = {}
+    with stats.phase("scan"):
+        for rel_file_path, _, file_stats in scan_files(state.packagepath, rules):
+            logger.debug(f"Scanning {rel_file_path}")
+            local_files[rel_file_path] = File(rel_file_path, state.package, state.root, stats=file_stats)
+    stats.count("files_scanned", len(local_files))
+    return local_files
+
+
+def get_upload_dirs(remote_path: str, remote_relpaths: Iterable[str]) -> List[str]:
+    """Calculates the minimal set of remote directories to create for uploads to remote_relpaths:
+    the parent directories of all paths, without the directories that are parents of other directories in the set
+
+    :param remote_path:
+        Path, including dbfs: prefix, of the remote package directory
+    :param remote_relpaths:
+        Paths of the uploaded files relative to remote_path
+    """
+    dirs = {os.path.dirname(os.path.join(remote_path, path)) for path in remote_relpaths}
+    parents = set()
+    for path in dirs:
+        parent = os.path.dirname(path)
+        while parent not in parents and parent != path:
+            parents.add(parent)
+            path, parent = parent, os.path.dirname(parent)
+    return sorted(dirs - parents)
+
+
+def group_deletions(files_deleted: List[File], paths_kept: Iterable[str]) -> Tuple[Dict[str, List[File]], List[File]]:
+    """Groups deleted files by the highest directory in the package that only contains deleted files
+
+    :param files_deleted:
+    :param paths_kept:
+        Paths of all files that remain, relative to the package directory
+    :returns:
+        The deleted files per directory that can be removed as a whole, and the files that must be removed one by one
+    """
+    dirs_kept = set()
+    for path in paths_kept:
+        rel_dir = os.path.dirname(path)
+        while rel_dir and rel_dir not in dirs_kept:
+            dirs_kept.add(rel_dir)
+            rel_dir = os.path.dirname(rel_dir)
+
+    dirs_deleted = {}
+    files_single = []
+    for file in files_deleted:
+        parts = file.path.split(os.sep)[:-1]
+        # Only directories inside the package are removed, never the package directory itself
+        rel_dir = None
+        if file.path == file.path_remote and os.pardir not in parts:
+            for depth in range(1, len(parts) + 1):
+                candidate = os.sep.join(parts[:depth])
+                if candidate not in dirs_kept:
+                    rel_dir = candidate
+                    break
+        if rel_dir is None:
+            files_single.append(file)
+        else:
+            dirs_deleted.setdefault(rel_dir, []).append(file)
+    return dirs_deleted, files_single
+
+
+def get_emptied_dirs(rel_dir: str, files: List[File], remote_relpaths_kept: Iterable[str]) -> List[str]:
+    """Directories from rel_dir down to the deleted files that hold nothing once the files are deleted
+
+    :param rel_dir:
+        Directory relative to the package directory that holds all files
+    :param files:
+        The deleted files
+    :param remote_relpaths_kept:
+        Paths of other files on DBFS, relative to the remote path with "/" as separator
+    """
+    dirs_kept = set()
+    for path in remote_relpaths_kept:
+        parent = os.path.dirname(path.replace("/", os.sep))
+        while parent and parent not in dirs_kept:
+            dirs_kept.add(parent)
+            parent = os.path.dirname(parent)
+    dirs = set()
+    for file in files:
+        parent = os.path.dirname(file.path)
+        while parent and parent not in dirs and (parent == rel_dir or parent.startswith(rel_dir + os.sep)):
+            dirs.add(parent)
+            parent = os.path.dirname(parent)
+    return sorted(dirs - dirs_kept)
+
+
+def get_file_size(file: File, path_abs: str = None) -> int:
+    """Size of the local file, from its stats if known
+
+    :param file:
+    :param path_abs:
+        Path to read the size from if the stats are not known, file.path_abs by default
+    """
+    if file.stats is not None:
+        return file.stats.size
+    return os.path.getsize(path_abs or file.path_abs)
@@ -0,0 +1,116 @@
+import os
+import re
+import logging
+from fnmatch import translate
+from typing import Iterator, List, Optional, Tuple
+from dbfsps.syncer.file import FileStats
+
+DEFAULT_EXCLUDE = ["__pycache__", ".pytest_cache", ".mypy_cache", "*.egg-info", ".ipynb_checkpoints"]
+
+
+class ScanRules:
+    """Include/exclude rules that decide which files in the package are synced.
+
+    Patterns are glob patterns. A pattern without a "/" is matched against the name of a file or directory,
+    a pattern with a "/" is matched against the path relative to the package directory.
+    Directories matching an exclude pattern are skipped entirely, without scanning their contents.
+
+    :param include:
+        If given, only files matching at least one of these patterns are synced
+    :param exclude:
+        Files and directories matching any of these patterns are not synced.
+        These are added to DEFAULT_EXCLUDE
+    :param max_file_size:
+        Files larger than this number of bytes are not synced
+    """
+
+    def __init__(self, include: List[str] = None, exclude: List[str] = None, max_file_size: int = None):
+        self.include = list(include or [])
+        self.exclude = DEFAULT_EXCLUDE + list(exclude or [])
+        self.max_file_size = max_file_size
+        self._include = _compile_patterns(self.include)
+        self._exclude = _compile_patterns(self.exclude)
+
+    @classmethod
+    def from_config(cls, config: dict) -> "ScanRules":
+        """Creates rules from the [tool.dbfsps] section of pyproject.toml
+
+        :param config:
+            Dictionary that may contain the keys "include", "exclude" and "max-file-size"
+        """
+        return cls(
+            include=config.get("include"),
+            exclude=config.get("exclude"),
+            max_file_size=config.get("max-file-size"),
+        )
+
+    def is_excluded(self, relpath: str, name: str) -> bool:
+        """True if the file or directory matches any of the exclude patterns"""
+        return _matches(self._exclude, relpath, name)
+
+    def is_path_excluded(self, relpath: str) -> bool:
+        """True if the path or any of its parent directories matches an exclude pattern"""
+        parts = relpath.split(os.sep)
+        for i in range(len(parts)):
+            if self.is_excluded(os.sep.join(parts[: i + 1]), parts[i]):
+                return True
+        return False
+
+    def is_included(self, relpath: str, name: str, size: int) -> bool:
+        """True if a file passes the include patterns and the size limit"""
+        if self.max_file_size is not None and size > self.max_file_size:
+            return False
+        if self.include and not _matches(self._include, relpath, name):
+            return False
+        return True
+
+
+def _compile_patterns(patterns: List[str]) -> Tuple[Optional[re.Pattern], Optional[re.Pattern]]:
+    """Compiles the patterns into one regex for name patterns and one for relative path patterns"""
+    name_patterns = [translate(p) for p in patterns if "/" not in p]
+    path_patterns = [translate(p.strip("/")) for p in patterns if "/" in p]
+    name_regex = re.compile("|".join(name_patterns)) if name_patterns else None
+    path_regex = re.compile("|".join(path_patterns)) if path_patterns else None
+    return name_regex, path_regex
+
+
+def _matches(compiled: Tuple[Optional[re.Pattern], Optional[re.Pattern]], relpath: str, name: str) -> bool:
+    name_regex, path_regex = compiled
+    if name_regex is not None and name_regex.match(name):
+        return True
+    if path_regex is not None and path_regex.match(relpath.replace(os.sep, "/")):
+        return True
+    return False
+
+
+def scan_files(package_path: str, rules: ScanRules, rel_dir: str = "") -> Iterator[Tuple[str, str, FileStats]]:
+    """Recursively finds the files in the package that pass the rules.
+    Excluded directories are pruned before they are descended into.
+
+    :param package_path:
+        Absolute path to the package directory
+    :param rules:
+    :param rel_dir:
+        Only scan this directory, relative to the package directory. Scans the whole package by default
+    :returns:
+        Iterator of (path relative to the package, absolute path, stats) tuples
+    """
+    logger = logging.getLogger(__name__)
+    stack = [(rel_dir, os.path.join(package_path, rel_dir))]
+    while stack:
+        rel_dir, abs_dir = stack.pop()
+        with os.scandir(abs_dir) as entries:
+            for entry in entries:
+                relpath = os.path.join(rel_dir, entry.name)
+                if rules.is_excluded(relpath, entry.name):
+                    logger.debug(f"Skipping excluded {relpath}")
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append((relpath, entry.path))
+                elif entry.is_file():
+                    stat_result = entry.stat()
+                    if not rules.is_included(relpath, entry.name, stat_result.st_size):
+                        logger.debug(f"Skipping {relpath}, it is not included or too large")
+                        continue
+                    stats = FileStats(stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino)
+                    yield relpath, entry.path, stats
@@ -1,11 +1,18 @@
 import os
+import time
 import logging
-from dbfsps.syncer.file import File
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from dbfsps import stats
+from dbfsps.syncer.file import File, FileStats
+from dbfsps.syncer.backends import create_backend
+from dbfsps.syncer.journal import Journal
+from dbfsps.syncer.tree import FileTree
 
 
 class State:
     """State of the remote files.
-    Contains a list of files and their hashes that should currently be on DBFS
+    Contains the files and their hashes that should currently be on DBFS, as a FileTree with a hash per directory
 
     :param root_dir:
         Absolute path to the root dir of the repository where you can find pyproject.toml
@@ -13,34 +20,164 @@ class State:
         Relative path to the package directory (usually the package name)
     :param statefilename:
         Name of the statefile to use. Is .dbfsps_file_status by default and is located in the root
+    :param backend:
+        How the state is stored, "text" (default) or "sqlite". See dbfsps.syncer.backends
+    :param checkpoint_interval:
+        While a plan is applied, the full state is stored at most this many seconds apart. Operations completed in
+        between are recorded in a journal (<statefile>.journal), unless the backend stores every change right away
+
+    With a backend that stores every change right away (StateBackend.incremental), store_state only writes the files
+    that changed since they were loaded or last written, so several processes can share the stored state without
+    overwriting each other's changes to other files.
+
+    With a backend that can read single files (StateBackend.indexed), the stored files are only loaded when files is
+    first used. Until then, lookup and paths read from the backend directly, so a plan that only needs the files that
+    exist locally does not build every stored file.
     """
 
-    def __init__(self, root_dir: str, relpackagepath: str, statefilename: str = ".dbfsps_file_status"):
+    def __init__(
+        self,
+        root_dir: str,
+        relpackagepath: str,
+        statefilename: str = ".dbfsps_file_status",
+        backend: str = "text",
+        checkpoint_interval: float = 30.0,
+    ):
         self.logger = logging.getLogger(__name__)
-        self.files = {}
+        self._files: Optional[FileTree] = FileTree()
         self.root = root_dir
         self.package = relpackagepath
         self.statefilepath = os.path.join(self.root, statefilename)
         self.packagepath = os.path.join(self.root, self.package)
+        self.backend = create_backend(backend, self.statefilepath)
+        self.journal = Journal(f"{self.statefilepath}.journal")
+        self.checkpoint_interval = checkpoint_interval
+        self._last_checkpoint = time.monotonic()
+        self._lock = threading.RLock()
+        # Hash and stats of every file as last loaded from or written to an incremental backend
+        self._stored: Dict[str, Tuple[str, Optional[FileStats]]] = {}
 
-        if os.path.isfile(self.statefilepath):
-            self.load_state()
+        if self.backend.exists():
+            if self.backend.indexed:
+                self._files = None
+            else:
+                self.load_state()
         else:
             self.logger.debug("No statefile created yet")
+        if self.journal.exists():
+            self.replay_journal()
 
     def load_state(self):
-        """Load files and their hashes from the statefile"""
-        with open(self.statefilepath, "r") as f:
-            self.logger.info(f"Loading statefile at {self.statefilepath}")
-            for line in f.readlines():
-                vals = line.strip().split(",")
-                relpath = vals[0]
-                hashstr = vals[1]
-                file = File(relpath, self.package, self.root, hashstr=hashstr)
-                self.files[file.path] = file
+        """Load files, their hashes and, if available, their size, mtime and inode from the statefile"""
+        self.logger.info(f"Loading statefile at {self.statefilepath}")
+        files = FileTree()
+        self._stored = {}
+        with stats.phase("load_state"):
+            for relpath, hashstr, file_stats in self.backend.load():
+                file = File(relpath, self.package, self.root, hashstr=hashstr, stats=file_stats)
+                files[file.path] = file
+                if self.backend.incremental:
+                    self._stored[file.path] = (hashstr, file_stats)
+        self._files = files
+
+    @property
+    def loaded(self) -> bool:
+        """False while the stored files of an indexed backend have not been loaded yet"""
+        return self._files is not None
+
+    @property
+    def files(self) -> FileTree:
+        with self._lock:
+            if self._files is None:
+                self.load_state()
+        return self._files
+
+    @files.setter
+    def files(self, files: Dict[str, File]):
+        self._files = files if isinstance(files, FileTree) else FileTree(files)
+
+    def lookup(self, path: str) -> Optional[File]:
+        """The stored file at path, None if there is none. Read from the backend if the files are not loaded"""
+        if self._files is not None:
+            return self._files.get(path)
+        record = self.backend.lookup(path)
+        if record is None:
+            return None
+        relpath, hashstr, file_stats = record
+        return File(relpath, self.package, self.root, hashstr=hashstr, stats=file_stats)
+
+    def paths(self) -> List[str]:
+        """Paths of all stored files. Read from the backend if the files are not loaded"""
+        if self._files is not None:
+            return list(self._files)
+        return list(self.backend.paths())
+
+    def replay_journal(self):
+        """Applies the operations of an interrupted run, recorded in the journal, and stores the result"""
+        self.logger.info(f"Resuming from journal {self.journal.path}")
+        for op, (relpath, hashstr, file_stats) in self.journal.replay():
+            if op == "upload":
+                self.files[relpath] = File(relpath, self.package, self.root, hashstr=hashstr, stats=file_stats)
+            else:
+                self.files.pop(relpath, None)
+        self.store_state()
 
     def store_state(self):
-        """Store the current files and their hashes in the statefile"""
-        with open(self.statefilepath, "w") as f:
-            for file in self.files.values():
-                f.write(f"{file.path},{file.hash}\n")
+        """Store the current files, their hashes and their stats (when known) in the statefile.
+        The journal is no longer needed after that"""
+        with self._lock, stats.phase("store_state"):
+            if self._files is None:
+                # Nothing changed in memory, update_files already stored every change
+                pass
+            elif self.backend.incremental:
+                files_changed, paths_removed = self._get_changes()
+                self._update_backend(files_changed, paths_removed)
+            else:
+                self.backend.store(self.files)
+            self.journal.clear()
+            self._last_checkpoint = time.monotonic()
+
+    def update_files(self, files_changed: Iterable[File], files_removed: Iterable[File]):
+        """Records uploaded and removed files, right after the operations on DBFS completed. Can be called from
+        several threads at once.
+
+        The changes are stored right away if the backend supports it, and otherwise written to the journal. The full
+        state is stored every checkpoint_interval seconds.
+        """
+        files_changed = list(files_changed)
+        paths_removed = [file.path for file in files_removed]
+        with self._lock:
+            if self._files is not None:
+                for file in files_changed:
+                    self._files[file.path] = file
+                for path in paths_removed:
+                    del self._files[path]
+            if self.backend.incremental:
+                self._update_backend(files_changed, paths_removed)
+                return
+            self.journal.append(files_changed, paths_removed)
+            if time.monotonic() - self._last_checkpoint >= self.checkpoint_interval:
+                self.logger.debug("Storing a checkpoint of the state")
+                self.store_state()
+
+    def _get_changes(self) -> Tuple[List[File], List[str]]:
+        """Files that were changed and paths that were removed since the files were loaded or last written"""
+        files_changed = [file for path, file in self.files.items() if self._stored.get(path) != (file.hash, file.stats)]
+        paths_removed = [path for path in self._stored if path not in self.files]
+        return files_changed, paths_removed
+
+    def _update_backend(self, files_changed: List[File], paths_removed: List[str]):
+        if not files_changed and not paths_removed:
+            return
+        self.backend.update(files_changed, paths_removed)
+        for file in files_changed:
+            self._stored[file.path] = (file.hash, file.stats)
+        for path in paths_removed:
+            self._stored.pop(path, None)
+
+    def reset(self):
+        """Forget all files and delete the statefile"""
+        self.files = FileTree()
+        self._stored = {}
+        self.backend.remove()
+        self.journal.clear()
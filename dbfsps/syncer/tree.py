@@ -0,0 +1,192 @@
+import os
+from hashlib import sha256
+from typing import Dict, Iterator, List, Mapping, Optional, Set, Tuple
+from dbfsps.syncer.file import File
+
+
+class FileTree(dict):
+    """Files by relative path, that also keeps them as a Merkle tree: every directory has a hash rolled up from the
+    names and hashes of everything below it.
+
+    Two trees with the same hash for a directory have the same files below it, so comparing two trees (see
+    diff_trees) skips every directory whose hash matches, and "nothing changed" is a single comparison of the root
+    hashes. Directory hashes are calculated when first needed and kept until a file below the directory is added,
+    replaced or removed, so after a few changes only the directories above them are hashed again.
+
+    Files whose hash is not known yet (File.is_hashed) are not hashed for this: the directories above them have no
+    hash, and are always compared file by file. Replace a File instead of changing its hash in place.
+
+    :param files:
+        Optional files to start with, by relative path
+    """
+
+    def __init__(self, files: Mapping[str, File] = None):
+        super().__init__()
+        self._dir_files: Dict[str, Set[str]] = {"": set()}
+        self._dir_subdirs: Dict[str, Set[str]] = {"": set()}
+        self._digests: Dict[str, str] = {}
+        if files:
+            self.update(files)
+
+    def __setitem__(self, path: str, file: File):
+        directory = parent_dir(path)
+        self._invalidate(directory)
+        if path not in self:
+            self._add_dir(directory)
+            self._dir_files[directory].add(path)
+        super().__setitem__(path, file)
+
+    def __delitem__(self, path: str):
+        super().__delitem__(path)
+        directory = parent_dir(path)
+        self._invalidate(directory)
+        self._dir_files[directory].discard(path)
+        self._remove_dir_if_empty(directory)
+
+    def pop(self, path: str, *default):
+        if path not in self:
+            if default:
+                return default[0]
+            raise KeyError(path)
+        file = self[path]
+        del self[path]
+        return file
+
+    def popitem(self) -> Tuple[str, File]:
+        path = next(reversed(self.keys()))
+        return path, self.pop(path)
+
+    def setdefault(self, path: str, default: File = None) -> File:
+        if path not in self:
+            self[path] = default
+        return self[path]
+
+    def update(self, *args, **kwargs):
+        for path, file in dict(*args, **kwargs).items():
+            self[path] = file
+
+    def clear(self):
+        super().clear()
+        self._dir_files = {"": set()}
+        self._dir_subdirs = {"": set()}
+        self._digests = {}
+
+    def copy(self) -> "FileTree":
+        return FileTree(self)
+
+    def has_dir(self, directory: str) -> bool:
+        return directory in self._dir_files
+
+    def files_in(self, directory: str) -> Set[str]:
+        """Paths of the files directly in a directory"""
+        return self._dir_files.get(directory, set())
+
+    def subdirs(self, directory: str) -> Set[str]:
+        """Paths of the directories directly in a directory"""
+        return self._dir_subdirs.get(directory, set())
+
+    def walk(self, directory: str) -> Iterator[str]:
+        """Paths of all files below a directory"""
+        pending = [directory]
+        while pending:
+            current = pending.pop()
+            yield from self.files_in(current)
+            pending.extend(self.subdirs(current))
+
+    def digest(self, directory: str = "") -> Optional[str]:
+        """The hash of a directory, the root by default. None if the directory does not exist, or if the hash of
+        a file below it is not known yet"""
+        if directory in self._digests:
+            return self._digests[directory]
+        if directory not in self._dir_files:
+            return None
+        entries = []
+        for path in self._dir_files[directory]:
+            file = super().__getitem__(path)
+            if not file.is_hashed():
+                return None
+            entries.append(f"{basename(path)}\0{file.hash}")
+        for subdir in self._dir_subdirs[directory]:
+            subdir_digest = self.digest(subdir)
+            if subdir_digest is None:
+                return None
+            entries.append(f"{basename(subdir)}{os.sep}\0{subdir_digest}")
+        digest = sha256("\n".join(sorted(entries)).encode()).hexdigest()
+        self._digests[directory] = digest
+        return digest
+
+    def _add_dir(self, directory: str):
+        """Adds a directory and any missing directories above it"""
+        child = None
+        while directory not in self._dir_files:
+            self._dir_files[directory] = set()
+            self._dir_subdirs[directory] = set()
+            if child is not None:
+                self._dir_subdirs[directory].add(child)
+            child, directory = directory, parent_dir(directory)
+        if child is not None:
+            self._dir_subdirs[directory].add(child)
+
+    def _remove_dir_if_empty(self, directory: str):
+        """Removes a directory without files, and any directories above it that become empty"""
+        while directory and not self._dir_files[directory] and not self._dir_subdirs[directory]:
+            del self._dir_files[directory]
+            del self._dir_subdirs[directory]
+            self._digests.pop(directory, None)
+            parent = parent_dir(directory)
+            self._dir_subdirs[parent].discard(directory)
+            directory = parent
+
+    def _invalidate(self, directory: str):
+        """Forgets the hashes of a directory and all directories above it. A directory without a known hash has no
+        ancestors with a known hash, so this stops at the first one"""
+        while directory and directory not in self._dir_files:
+            directory = parent_dir(directory)
+        while directory in self._digests:
+            del self._digests[directory]
+            if not directory:
+                break
+            directory = parent_dir(directory)
+
+
+def parent_dir(path: str) -> str:
+    """The directory of a relative path, "" for the root"""
+    return path.rpartition(os.sep)[0]
+
+
+def basename(path: str) -> str:
+    return path.rpartition(os.sep)[2]
+
+
+def diff_trees(local: FileTree, remote: FileTree) -> Tuple[List[str], List[str], List[str]]:
+    """Compares two trees, descending only into directories whose hashes differ
+
+    :returns:
+        Paths of the files only in local (new), in both with a different hash (updated) and only in remote (deleted)
+    """
+    new, updated, deleted = [], [], []
+    pending = [""]
+    while pending:
+        directory = pending.pop()
+        local_digest = local.digest(directory)
+        if local_digest is not None and local_digest == remote.digest(directory):
+            continue
+        local_files = local.files_in(directory)
+        remote_files = remote.files_in(directory)
+        for path in local_files:
+            if path not in remote_files:
+                new.append(path)
+            elif local[path] != remote[path]:
+                updated.append(path)
+        deleted.extend(path for path in remote_files if path not in local_files)
+
+        local_dirs = local.subdirs(directory)
+        remote_dirs = remote.subdirs(directory)
+        for subdir in local_dirs | remote_dirs:
+            if subdir not in remote_dirs:
+                new.extend(local.walk(subdir))
+            elif subdir not in local_dirs:
+                deleted.extend(remote.walk(subdir))
+            else:
+                pending.append(subdir)
+    return new, updated, deleted
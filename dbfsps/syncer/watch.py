@@ -0,0 +1,224 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+from typing import TYPE_CHECKING, Dict, Optional, Set
+from dbfsps.syncer.plan import Plan
+from dbfsps.syncer.scanner import ScanRules, scan_files
+
+if TYPE_CHECKING:
+    from dbfsps.sdk.dbfs import Dbfs
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyEventSource:
+    """Reports changed paths in the package using Linux inotify. Every directory that is not excluded by the
+    rules gets a watch, directories created later on are added as they appear.
+
+    :param package_path:
+        Absolute path to the package directory
+    :param rules:
+    """
+
+    def __init__(self, package_path: str, rules: ScanRules):
+        self.logger = logging.getLogger(__name__)
+        self.package_path = package_path
+        self.rules = rules
+        self._watches: Dict[int, str] = {}
+
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._add_tree("")
+
+    def _add_watch(self, rel_dir: str):
+        path = os.path.join(self.package_path, rel_dir).encode()
+        wd = self._libc.inotify_add_watch(self._fd, path, _WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOENT:
+                return
+            raise OSError(err, f"inotify_add_watch failed for {path.decode()}")
+        self._watches[wd] = rel_dir
+
+    def _add_tree(self, rel_dir: str):
+        self._add_watch(rel_dir)
+        stack = [rel_dir]
+        while stack:
+            current = stack.pop()
+            try:
+                entries = list(os.scandir(os.path.join(self.package_path, current)))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                relpath = os.path.join(current, entry.name)
+                if entry.is_dir(follow_symlinks=False) and not self.rules.is_excluded(relpath, entry.name):
+                    self._add_watch(relpath)
+                    stack.append(relpath)
+
+    def wait(self, timeout: Optional[float] = None) -> Set[str]:
+        """Blocks until events arrive or the timeout (in seconds) expires
+
+        :returns:
+            Changed paths relative to the package directory. An empty string means the whole package must be rescanned
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        buffer = os.read(self._fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, name_len = _EVENT_HEADER.unpack_from(buffer, offset)
+            offset += _EVENT_HEADER.size
+            name = buffer[offset : offset + name_len].rstrip(b"\0").decode()
+            offset += name_len
+
+            if mask & IN_Q_OVERFLOW:
+                self.logger.warning("Too many file system events, rescanning the package")
+                changed.add("")
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            rel_dir = self._watches.get(wd)
+            if rel_dir is None or not name:
+                continue
+            relpath = os.path.join(rel_dir, name)
+            if self.rules.is_excluded(relpath, name):
+                continue
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_tree(relpath)
+            changed.add(relpath)
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingEventSource:
+    """Reports changed paths in the package by periodically comparing the stats of all files.
+    Used where inotify is not available.
+
+    :param package_path:
+        Absolute path to the package directory
+    :param rules:
+    :param interval:
+        Seconds between two scans of the package
+    """
+
+    def __init__(self, package_path: str, rules: ScanRules, interval: float = 1.0):
+        self.package_path = package_path
+        self.rules = rules
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self) -> dict:
+        return {relpath: stats for relpath, _, stats in scan_files(self.package_path, self.rules)}
+
+    def wait(self, timeout: Optional[float] = None) -> Set[str]:
+        """Scans the package until something changed or the timeout (in seconds) expires
+
+        :returns:
+            Changed paths relative to the package directory
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            sleep_time = self.interval
+            if deadline is not None:
+                sleep_time = min(sleep_time, max(0.0, deadline - time.monotonic()))
+            time.sleep(sleep_time)
+
+            snapshot = self._scan()
+            changed = {
+                path
+                for path in snapshot.keys() | self._snapshot.keys()
+                if snapshot.get(path) != self._snapshot.get(path)
+            }
+            self._snapshot = snapshot
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def close(self):
+        pass
+
+
+class Watcher:
+    """Keeps the remote package in sync by applying the plan for every burst of changes in the package.
+    The state and plan are kept in memory, only the changed paths are scanned and hashed again.
+
+    :param plan:
+        Plan that has already been applied, or printed in case of a dry run
+    :param dbfs:
+        An instance of the dbfs client to connect to Databricks. If None, changes are only printed
+    :param jobs:
+        Maximum number of concurrent DBFS operations
+    :param debounce:
+        Seconds without new events before a burst of changes is synced
+    :param poll_interval:
+        Seconds between scans if inotify is not available
+    """
+
+    def __init__(
+        self, plan: Plan, dbfs: Optional["Dbfs"], jobs: int = 1, debounce: float = 0.3, poll_interval: float = 1.0
+    ):
+        self.logger = logging.getLogger(__name__)
+        self.plan = plan
+        self.dbfs = dbfs
+        self.jobs = jobs
+        self.debounce = debounce
+        self.source = self._create_event_source(poll_interval)
+
+    def _create_event_source(self, poll_interval: float):
+        package_path = self.plan.state.packagepath
+        if sys.platform.startswith("linux"):
+            try:
+                return InotifyEventSource(package_path, self.plan.rules)
+            except (OSError, AttributeError) as exc:
+                self.logger.warning(f"Unable to use inotify, falling back to polling: {exc}")
+        return PollingEventSource(package_path, self.plan.rules, interval=poll_interval)
+
+    def run(self):
+        """Syncs changes until interrupted with Ctrl+C"""
+        print(f"Watching {self.plan.state.packagepath} for changes, press Ctrl+C to stop")
+        try:
+            while True:
+                changed = self.source.wait()
+                more = self.source.wait(self.debounce)
+                while more:
+                    changed |= more
+                    more = self.source.wait(self.debounce)
+                self.sync(changed)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.source.close()
+
+    def sync(self, changed: Set[str]):
+        """Updates the plan for the changed paths and applies it"""
+        self.logger.debug(f"Changed paths: {sorted(changed)}")
+        self.plan.refresh(changed)
+        if not self.plan.has_changes():
+            return
+        self.plan.print_plan()
+        if self.dbfs is not None:
+            self.plan.apply_plan(self.dbfs, jobs=self.jobs)
+            # The applied changes are now part of the state
+            self.plan.refresh([])
@@ -0,0 +1,64 @@
+import os
+import sys
+import json
+import subprocess
+import pytest
+
+HEAVY_MODULES = ["databricks_cli", "requests", "urllib3", "pkg_resources"]
+
+RUN_CLI = """
+import sys, json
+from dbfsps.cli.databricks_sync import databricks_sync_api
+try:
+    databricks_sync_api({args}, standalone_mode=False)
+finally:
+    print(json.dumps([name for name in {heavy} if name in sys.modules]), file=sys.stderr)
+"""
+
+
+@pytest.fixture
+def project(tmpdir):
+    with open(tmpdir / "pyproject.toml", "w") as f:
+        f.write('[tool.poetry]\nname = "pkg"\nversion = "0.1.0"\n')
+    with open(tmpdir / "poetry.lock", "w") as f:
+        f.write('package = []\n\n[metadata]\nlock-version = "1.1"\ncontent-hash = "0"\n')
+    os.makedirs(tmpdir / "pkg")
+    with open(tmpdir / "pkg" / "__init__.py", "w") as f:
+        f.write("")
+    return tmpdir
+
+
+@pytest.mark.parametrize("args", [["--help"], ["pkg", "--profile", "dev", "--dry-run"]])
+def test_cli_does_not_import_client_libraries(project, args):
+    """The Databricks and HTTP client libraries are only imported once a Dbfs client is needed"""
+    code = RUN_CLI.format(args=args, heavy=HEAVY_MODULES)
+    result = subprocess.run([sys.executable, "-c", code], cwd=str(project), capture_output=True, text=True, check=True)
+
+    assert json.loads(result.stderr.strip().splitlines()[-1]) == []
+    if "--dry-run" in args:
+        assert "2 files will be added" in result.stdout
+
+
+def test_cli_shared_manifest_requires_file_mode(project):
+    code = RUN_CLI.format(args=["pkg", "--profile", "dev", "--bundle", "zip", "--shared-manifest"], heavy=[])
+    result = subprocess.run([sys.executable, "-c", code], cwd=str(project), capture_output=True, text=True)
+
+    assert result.returncode != 0
+    assert "--shared-manifest can not be combined with --bundle" in result.stderr
+
+
+def test_cli_regenerates_notebook_when_bundle_mode_changes(project):
+    """The notebook has to import the package from the archive once --bundle zip is used, and from the synced
+    directory again after switching back"""
+
+    def generate_notebook(*args) -> str:
+        code = RUN_CLI.format(args=["pkg", "--profile", "dev", "--dry-run", *args], heavy=[])
+        subprocess.run([sys.executable, "-c", code], cwd=str(project), capture_output=True, check=True)
+        with open(project / "init_pkg.py") as f:
+            return f.read()
+
+    plain = 'sys.path.insert(0, "/dbfs/FileStore/packages/pkg")'
+    bundled = 'sys.path.insert(0, "/dbfs/FileStore/packages/pkg/pkg.zip")'
+    assert plain in generate_notebook()
+    assert bundled in generate_notebook("--bundle", "zip")
+    assert plain in generate_notebook()
@@ -0,0 +1,147 @@
+import os
+import pytest
+from dbfsps.cli.export import RequirementsExportError, export_requirements, python_constraint_to_marker
+
+PYPROJECT = """
+[tool.poetry]
+name = "example"
+
+[tool.poetry.dependencies]
+python = "^3.9"
+Click = "^8.0"
+coverage = {version = "^6.4", extras = ["toml"]}
+backports-zoneinfo = {version = "^0.2", python = "<3.9"}
+
+[tool.poetry.group.dev.dependencies]
+pytest = "^7.0"
+"""
+
+LOCK = """
+[[package]]
+name = "click"
+version = "8.1.3"
+category = "main"
+optional = false
+python-versions = ">=3.7"
+files = [
+    {file = "click-8.1.3.tar.gz", hash = "sha256:aaa"},
+    {file = "click-8.1.3-py3-none-any.whl", hash = "sha256:bbb"},
+]
+
+[package.dependencies]
+colorama = {version = "*", markers = "platform_system == \\"Windows\\""}
+
+[[package]]
+name = "colorama"
+version = "0.4.6"
+category = "main"
+optional = false
+python-versions = "*"
+files = [{file = "colorama-0.4.6.tar.gz", hash = "sha256:ccc"}]
+
+[[package]]
+name = "coverage"
+version = "6.5.0"
+category = "main"
+optional = false
+python-versions = ">=3.7"
+files = [{file = "coverage-6.5.0.tar.gz", hash = "sha256:ddd"}]
+
+[package.dependencies]
+tomli = {version = "*", optional = true, markers = "python_full_version <= \\"3.11.0a6\\" and extra == \\"toml\\""}
+
+[package.extras]
+toml = ["tomli"]
+
+[[package]]
+name = "backports.zoneinfo"
+version = "0.2.1"
+category = "main"
+optional = false
+python-versions = ">=3.6"
+files = [{file = "backports.zoneinfo-0.2.1.tar.gz", hash = "sha256:eee"}]
+
+[[package]]
+name = "tomli"
+version = "2.0.1"
+category = "main"
+optional = false
+python-versions = ">=3.7"
+files = [{file = "tomli-2.0.1.tar.gz", hash = "sha256:fff"}]
+
+[[package]]
+name = "pytest"
+version = "7.2.0"
+category = "dev"
+optional = false
+python-versions = ">=3.7"
+files = [{file = "pytest-7.2.0.tar.gz", hash = "sha256:ggg"}]
+
+[metadata]
+lock-version = "2.0"
+python-versions = "^3.9"
+content-hash = "x"
+"""
+
+
+def write_project(tmpdir, pyproject: str = PYPROJECT, lock: str = LOCK):
+    with open(tmpdir / "pyproject.toml", "w") as f:
+        f.write(pyproject)
+    with open(tmpdir / "poetry.lock", "w") as f:
+        f.write(lock)
+
+
+def test_export_requirements(tmpdir):
+    write_project(tmpdir)
+
+    requirements = export_requirements(str(tmpdir))
+
+    assert requirements == (
+        'backports.zoneinfo==0.2.1 ; python_version < "3.9" \\\n'
+        "    --hash=sha256:eee\n"
+        "click==8.1.3 \\\n"
+        "    --hash=sha256:aaa \\\n"
+        "    --hash=sha256:bbb\n"
+        'colorama==0.4.6 ; platform_system == "Windows" \\\n'
+        "    --hash=sha256:ccc\n"
+        "coverage[toml]==6.5.0 \\\n"
+        "    --hash=sha256:ddd\n"
+        'tomli==2.0.1 ; python_full_version <= "3.11.0a6" \\\n'
+        "    --hash=sha256:fff\n"
+    )
+
+
+def test_export_requirements_outdated_lock(tmpdir):
+    write_project(tmpdir, pyproject=PYPROJECT.replace('Click = "^8.0"', 'Click = "^8.0"\nrequests = "^2.0"'))
+
+    with pytest.raises(RequirementsExportError):
+        export_requirements(str(tmpdir))
+
+
+def test_export_requirements_of_this_project():
+    """The dependencies of dbfsps itself should be exported, without any of the dev dependencies"""
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    requirements = export_requirements(root)
+
+    names = [line.split("==")[0] for line in requirements.splitlines() if not line.startswith(" ")]
+    assert {"click", "requests", "urllib3", "tomli"}.issubset(names)
+    assert "databricks-cli" not in names
+    assert "pytest" not in names
+    assert "black" not in names
+
+
+@pytest.mark.parametrize(
+    "constraint, marker",
+    [
+        ("*", None),
+        ("<3.11", 'python_version < "3.11"'),
+        ("^3.8", 'python_version >= "3.8" and python_version < "4"'),
+        ("~3.8.1", 'python_full_version >= "3.8.1" and python_version < "3.9"'),
+        (">=3.7,<3.10", 'python_version >= "3.7" and python_version < "3.10"'),
+        ("3.6.*", 'python_version == "3.6"'),
+        ("<3.8 || >=3.10", '(python_version < "3.8") or (python_version >= "3.10")'),
+    ],
+)
+def test_python_constraint_to_marker(constraint, marker):
+    assert python_constraint_to_marker(constraint) == marker
@@ -0,0 +1,88 @@
+import time
+import zipfile
+import pytest
+from dbfsps.cli.targets import Target, apply_targets, get_targets
+from dbfsps.syncer.bundle import BundlePlan
+from dbfsps.syncer.plan import Plan, scan_local_files
+from dbfsps.syncer.scanner import ScanRules
+from dbfsps.syncer.state import State
+from tests.syncer.test_plan import PlanTester
+
+
+def test_get_targets(tmpdir):
+    targets_file = tmpdir / "targets.toml"
+    with open(targets_file, "w") as f:
+        f.write(
+            "[[target]]\n" 'profile = "prod"\n' 'remote-path = "dbfs:/packages/prod"\n' 'status-file = ".status_prod"\n'
+        )
+
+    (target,) = get_targets(["dev"], None, None, ".dbfsps_file_status", "pkg")
+    assert (target.profile, target.remote_path, target.status_file) == (
+        "dev",
+        "dbfs:/FileStore/packages/pkg",
+        ".dbfsps_file_status",
+    )
+
+    targets = get_targets(["dev", "staging"], str(targets_file), None, ".dbfsps_file_status", "pkg")
+    assert [(t.profile, t.remote_path, t.status_file) for t in targets] == [
+        ("dev", "dbfs:/FileStore/packages/pkg", ".dbfsps_file_status.dev"),
+        ("staging", "dbfs:/FileStore/packages/pkg", ".dbfsps_file_status.staging"),
+        ("prod", "dbfs:/packages/prod", ".status_prod"),
+    ]
+
+    with pytest.raises(ValueError):
+        get_targets(["dev", "dev"], None, None, ".dbfsps_file_status", "pkg")
+    with pytest.raises(ValueError):
+        get_targets([], None, None, ".dbfsps_file_status", "pkg")
+
+
+def test_apply_targets(mocker, tmpdir):
+    """Verifies that every target is synced with its own state, while each file is hashed only once"""
+    pt = PlanTester(tmpdir, mocker)
+    pt.create_files()
+    remote_path = "dbfs:/FileStore/packages/packagename"
+    targets = [Target(profile, remote_path, f".status.{profile}") for profile in ["dev", "prod"]]
+    local_files = None
+    for target in targets:
+        target.state = State(tmpdir, "package", statefilename=target.status_file)
+        local_files = local_files or scan_local_files(target.state, ScanRules())
+        target.plan = Plan(target.state, remote_path, local_files=local_files)
+        target.dbfs = mocker.Mock()
+    hash_file = mocker.patch("dbfsps.syncer.file.calculate_file_hash", return_value="hash")
+
+    apply_targets(targets, jobs=2)
+
+    assert hash_file.call_count == 4
+    for target in targets:
+        assert target.dbfs.cp.call_count == 5
+        assert len(State(tmpdir, "package", statefilename=target.status_file).files) == 5
+
+
+def test_apply_targets_bundle(mocker, tmpdir):
+    """Verifies that every target builds and uploads its own archive when the plans are applied at the same time"""
+    pt = PlanTester(tmpdir, mocker)
+    pt.create_files()
+    remote_path = "dbfs:/FileStore/packages/packagename"
+    targets = [Target(profile, remote_path, f".status.{profile}") for profile in ["a", "b", "c"]]
+    uploaded = []
+
+    def cp(source, destination, overwrite=False):
+        if destination.endswith(".zip"):
+            # Keeps the uploads of the targets overlapping
+            time.sleep(0.05)
+            with zipfile.ZipFile(source) as archive:
+                uploaded.append(sorted(archive.namelist()))
+
+    local_files = None
+    for target in targets:
+        target.state = State(tmpdir, "package", statefilename=target.status_file)
+        local_files = local_files or scan_local_files(target.state, ScanRules())
+        target.plan = BundlePlan(target.state, remote_path, local_files=local_files)
+        target.dbfs = mocker.Mock()
+        target.dbfs.cp.side_effect = cp
+
+    apply_targets(targets, jobs=2)
+
+    assert uploaded == [["__init__.py", "subdir/one.py", "subdir/two.py", "utils.py"]] * 3
+    for target in targets:
+        assert not BundlePlan(State(tmpdir, "package", statefilename=target.status_file), remote_path).has_changes()
@@ -1,8 +1,52 @@
 from dbfsps.cli import utils
 
 
-def test_create_requirements_file(mocker):
+def test_create_requirements_file(mocker, tmpdir):
+    """The requirements file is exported natively and only regenerated when the lockfile hash changes"""
+    export = mocker.patch("dbfsps.cli.utils.export_requirements", return_value="click==8.1.3\n")
     f_check_call = mocker.patch("dbfsps.cli.utils.subprocess.check_call")
-    utils.create_requirements_file()
-    args = ["poetry", "export", "-f", "requirements.txt", "--output", "requirements.txt"]
+
+    utils.create_requirements_file(str(tmpdir), lock_hash="hash1")
+    utils.create_requirements_file(str(tmpdir), lock_hash="hash1")
+
+    export.assert_called_once_with(str(tmpdir))
+    f_check_call.assert_not_called()
+    with open(tmpdir / "requirements.txt") as f:
+        assert f.read() == "# dbfsps-lock-hash: hash1\nclick==8.1.3\n"
+
+    utils.create_requirements_file(str(tmpdir), lock_hash="hash2")
+
+    assert export.call_count == 2
+    assert utils.get_requirements_lock_hash(str(tmpdir / "requirements.txt")) == "hash2"
+
+
+def test_create_requirements_file_poetry_fallback(mocker, tmpdir):
+    """If the lockfile cannot be exported natively, poetry is used instead"""
+    mocker.patch("dbfsps.cli.utils.export_requirements", side_effect=utils.RequirementsExportError("unsupported"))
+    requirements_path = str(tmpdir / "requirements.txt")
+
+    def check_call(args):
+        with open(requirements_path, "w") as f:
+            f.write("click==8.1.3\n")
+
+    f_check_call = mocker.patch("dbfsps.cli.utils.subprocess.check_call", side_effect=check_call)
+
+    utils.create_requirements_file(str(tmpdir), lock_hash="hash1")
+
+    args = ["poetry", "export", "-f", "requirements.txt", "--output", requirements_path]
     f_check_call.assert_called_once_with(args)
+    with open(requirements_path) as f:
+        assert f.read() == "# dbfsps-lock-hash: hash1\nclick==8.1.3\n"
+
+
+def test_get_project_config(tmpdir):
+    with open(tmpdir / "pyproject.toml", "w") as f:
+        f.write('[tool.poetry]\nname = "x"\n\n[tool.dbfsps]\nexclude = ["data"]\nmax-file-size = 1024\n')
+
+    config = utils.get_project_config(str(tmpdir))
+
+    assert config == {"exclude": ["data"], "max-file-size": 1024}
+
+
+def test_get_project_config_missing(tmpdir):
+    assert utils.get_project_config(str(tmpdir)) == {}
@@ -0,0 +1,8 @@
+import pytest
+from tests.sdk.fake_dbfs import FakeDbfs
+
+
+@pytest.fixture
+def fake_dbfs(tmpdir):
+    with FakeDbfs(str(tmpdir / "dbfs")) as server:
+        yield server
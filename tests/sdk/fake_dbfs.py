@@ -0,0 +1,345 @@
+import os
+import re
+import json
+import time
+import shutil
+import base64
+import threading
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+API_PREFIX = "/api/2.0/dbfs/"
+
+
+class DbfsApiException(Exception):
+    def __init__(self, status: int, error_code: str, message: str):
+        super().__init__(message)
+        self.status = status
+        self.error_code = error_code
+        self.message = message
+
+
+class FakeDbfs:
+    """In-process server for the DBFS 2.0 REST API, backed by a local directory.
+
+    Implements put, create, add-block, close, list, delete, mkdirs, move, read and get-status. Every request is
+    counted per endpoint. Latency, bandwidth limits, a maximum number of concurrent requests and failing responses
+    can be injected to test how clients deal with a slow or throttling workspace.
+
+    Use as a context manager, or call start and stop:
+
+        with FakeDbfs(str(tmpdir)) as server:
+            dbfs = Dbfs(server.url, "token")
+
+    :param root:
+        Local directory that holds the contents of DBFS
+    :param latency:
+        Seconds to wait before handling every request
+    :param bandwidth:
+        Maximum bytes per second for the contents of uploads and reads, per request. Unlimited if None
+    :param max_concurrency:
+        Requests beyond this number in flight at the same time get a 429 response. Unlimited if None
+    :param retry_after:
+        Value of the Retry-After header sent with 429 responses caused by max_concurrency
+    """
+
+    def __init__(
+        self,
+        root: str,
+        latency: float = 0.0,
+        bandwidth: Optional[float] = None,
+        max_concurrency: Optional[int] = None,
+        retry_after: Optional[float] = None,
+    ):
+        self.root = root
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+
+        self.requests = Counter()
+        self.responses = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._failures = deque()
+        self._handles = {}
+        self._next_handle = 1
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeDbfs":
+        os.makedirs(self.root, exist_ok=True)
+        handler = type("Handler", (_Handler,), {"fake": self})
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self) -> "FakeDbfs":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def fail_next(
+        self,
+        status: int,
+        count: int = 1,
+        endpoint: str = None,
+        retry_after: float = None,
+        error_code: str = "REQUEST_LIMIT_EXCEEDED",
+    ):
+        """Makes the next count requests (to endpoint, if given) fail with the given HTTP status, e.g. 429 or 503"""
+        with self._lock:
+            for _ in range(count):
+                self._failures.append((status, endpoint, retry_after, error_code))
+
+    def local_path(self, dbfs_path: str) -> str:
+        """The local path of a path on DBFS, with or without dbfs: prefix"""
+        if dbfs_path.startswith("dbfs:"):
+            dbfs_path = dbfs_path[len("dbfs:") :]
+        if not dbfs_path.startswith("/"):
+            raise DbfsApiException(400, "INVALID_PARAMETER_VALUE", f"Path must be absolute: {dbfs_path}")
+        parts = [part for part in dbfs_path.split("/") if part]
+        if ".." in parts:
+            raise DbfsApiException(400, "INVALID_PARAMETER_VALUE", f"Invalid path: {dbfs_path}")
+        return os.path.join(self.root, *parts)
+
+    def _take_failure(self, endpoint: str):
+        with self._lock:
+            for failure in self._failures:
+                if failure[1] in (None, endpoint):
+                    self._failures.remove(failure)
+                    return failure
+        return None
+
+    def _throttle(self, size: int):
+        if self.bandwidth:
+            time.sleep(size / self.bandwidth)
+
+    def _file_info(self, dbfs_path: str, local_path: str) -> dict:
+        stat = os.stat(local_path)
+        is_dir = os.path.isdir(local_path)
+        # Like the real API, paths in responses have no dbfs: prefix
+        if dbfs_path.startswith("dbfs:"):
+            dbfs_path = dbfs_path[len("dbfs:") :]
+        return {
+            "path": dbfs_path.rstrip("/") or "/",
+            "is_dir": is_dir,
+            "file_size": 0 if is_dir else stat.st_size,
+            "modification_time": int(stat.st_mtime * 1000),
+        }
+
+    def _existing(self, path: str) -> str:
+        local_path = self.local_path(path)
+        if not os.path.exists(local_path):
+            raise DbfsApiException(404, "RESOURCE_DOES_NOT_EXIST", f"No file or directory exists on path {path}.")
+        return local_path
+
+    def _write(self, path: str, contents: bytes, overwrite: bool):
+        local_path = self.local_path(path)
+        if os.path.isdir(local_path) or (os.path.exists(local_path) and not overwrite):
+            raise DbfsApiException(400, "RESOURCE_ALREADY_EXISTS", f"A file or directory already exists at {path}.")
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        self._throttle(len(contents))
+        with open(local_path, "wb") as f:
+            f.write(contents)
+
+    def handle(self, endpoint: str, params: dict, form_file: Optional[bytes]) -> dict:
+        """Handles one API call and returns the JSON response"""
+        if endpoint == "get-status":
+            path = params["path"]
+            return self._file_info(path, self._existing(path))
+
+        if endpoint == "list":
+            path = params["path"]
+            local_path = self._existing(path)
+            if not os.path.isdir(local_path):
+                return {"files": [self._file_info(path, local_path)]}
+            prefix = path.rstrip("/")
+            return {
+                "files": [
+                    self._file_info(f"{prefix}/{name}", os.path.join(local_path, name))
+                    for name in sorted(os.listdir(local_path))
+                ]
+            }
+
+        if endpoint == "put":
+            if form_file is not None:
+                contents = form_file
+            else:
+                contents = base64.b64decode(params.get("contents", ""))
+            self._write(params["path"], contents, _as_bool(params.get("overwrite")))
+            return {}
+
+        if endpoint == "create":
+            path = params["path"]
+            local_path = self.local_path(path)
+            if os.path.exists(local_path) and not _as_bool(params.get("overwrite")):
+                raise DbfsApiException(400, "RESOURCE_ALREADY_EXISTS", f"A file or directory already exists at {path}.")
+            with self._lock:
+                handle = self._next_handle
+                self._next_handle += 1
+                self._handles[handle] = (path, [])
+            return {"handle": handle}
+
+        if endpoint == "add-block":
+            data = base64.b64decode(params["data"])
+            with self._lock:
+                if params["handle"] not in self._handles:
+                    raise DbfsApiException(404, "RESOURCE_DOES_NOT_EXIST", "Invalid handle")
+                self._handles[params["handle"]][1].append(data)
+            self._throttle(len(data))
+            return {}
+
+        if endpoint == "close":
+            with self._lock:
+                if params["handle"] not in self._handles:
+                    raise DbfsApiException(404, "RESOURCE_DOES_NOT_EXIST", "Invalid handle")
+                path, blocks = self._handles.pop(params["handle"])
+            local_path = self.local_path(path)
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            with open(local_path, "wb") as f:
+                f.write(b"".join(blocks))
+            return {}
+
+        if endpoint == "read":
+            local_path = self._existing(params["path"])
+            if os.path.isdir(local_path):
+                raise DbfsApiException(400, "INVALID_PARAMETER_VALUE", f"{params['path']} is a directory")
+            offset = int(params.get("offset", 0))
+            length = int(params.get("length", 1024 * 1024))
+            with open(local_path, "rb") as f:
+                f.seek(offset)
+                data = f.read(length)
+            self._throttle(len(data))
+            return {"bytes_read": len(data), "data": base64.b64encode(data).decode()}
+
+        if endpoint == "delete":
+            local_path = self.local_path(params["path"])
+            if os.path.isdir(local_path):
+                if os.listdir(local_path) and not _as_bool(params.get("recursive")):
+                    raise DbfsApiException(400, "IO_ERROR", f"{params['path']} is a non-empty directory")
+                shutil.rmtree(local_path)
+            elif os.path.exists(local_path):
+                os.remove(local_path)
+            return {}
+
+        if endpoint == "mkdirs":
+            local_path = self.local_path(params["path"])
+            if os.path.isfile(local_path):
+                raise DbfsApiException(400, "RESOURCE_ALREADY_EXISTS", f"A file exists at {params['path']}.")
+            os.makedirs(local_path, exist_ok=True)
+            return {}
+
+        if endpoint == "move":
+            source = self._existing(params["source_path"])
+            destination = self.local_path(params["destination_path"])
+            if os.path.exists(destination):
+                raise DbfsApiException(
+                    400,
+                    "RESOURCE_ALREADY_EXISTS",
+                    f"A file or directory already exists at {params['destination_path']}.",
+                )
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            os.rename(source, destination)
+            return {}
+
+        raise DbfsApiException(404, "ENDPOINT_NOT_FOUND", f"No API found for {endpoint}")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    fake: FakeDbfs = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self._dispatch(url.path, {key: values[0] for key, values in parse_qs(url.query).items()}, None)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        content_type = self.headers.get("Content-Type", "")
+        form_file = None
+        if content_type.startswith("multipart/form-data"):
+            params, form_file = _parse_multipart(content_type, body)
+        else:
+            params = json.loads(body or b"{}")
+        self._dispatch(url.path, params, form_file)
+
+    def _dispatch(self, path: str, params: dict, form_file: Optional[bytes]):
+        fake = self.fake
+        endpoint = path[len(API_PREFIX) :] if path.startswith(API_PREFIX) else path
+        with fake._lock:
+            fake.requests[endpoint] += 1
+            fake.in_flight += 1
+            fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+            over_limit = fake.max_concurrency is not None and fake.in_flight > fake.max_concurrency
+        try:
+            if fake.latency:
+                time.sleep(fake.latency)
+            failure = fake._take_failure(endpoint)
+            if over_limit:
+                failure = (429, endpoint, fake.retry_after, "REQUEST_LIMIT_EXCEEDED")
+            if failure is not None:
+                status, _, retry_after, error_code = failure
+                headers = {"Retry-After": str(retry_after)} if retry_after is not None else {}
+                self._send(status, {"error_code": error_code, "message": "Injected failure"}, headers)
+                return
+            try:
+                self._send(200, fake.handle(endpoint, params, form_file))
+            except DbfsApiException as exc:
+                self._send(exc.status, {"error_code": exc.error_code, "message": exc.message})
+        finally:
+            with fake._lock:
+                fake.in_flight -= 1
+
+    def _send(self, status: int, body: dict, headers: dict = None):
+        with self.fake._lock:
+            self.fake.responses[status] += 1
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def _parse_multipart(content_type: str, body: bytes):
+    boundary = re.search(r'boundary="?([^";]+)"?', content_type).group(1).encode()
+    params = {}
+    contents = None
+    # Every part is the CRLF after the boundary, headers, an empty line, the value and the CRLF before the next boundary
+    for part in body.split(b"--" + boundary)[1:-1]:
+        headers, _, value = part[2:-2].partition(b"\r\n\r\n")
+        disposition = re.search(rb'name="([^"]*)"(?:; filename="([^"]*)")?', headers)
+        if disposition.group(2) is not None:
+            contents = value
+        else:
+            params[disposition.group(1).decode()] = value.decode()
+    return params, contents
+
+
+def _as_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.lower() == "true"
+    return bool(value)
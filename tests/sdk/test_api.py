@@ -0,0 +1,107 @@
+import os
+import pytest
+from requests.exceptions import HTTPError
+from dbfsps.sdk.api import DbfsApi, DbfsPath, FileInfo
+from dbfsps.sdk.dbfs import Dbfs
+
+
+def test_dbfs_path():
+    path = DbfsPath("dbfs:/pkg/sub/")
+    assert path.api_path == "/pkg/sub"
+    assert path.basename == "sub"
+    assert path.join("file.py").absolute_path == "dbfs:/pkg/sub/file.py"
+    assert path == DbfsPath("dbfs:/pkg/sub")
+    assert DbfsPath("dbfs:/").api_path == "/"
+    assert DbfsPath.from_api_path("/pkg").absolute_path == "dbfs:/pkg"
+
+    with pytest.raises(ValueError, match="must start with"):
+        DbfsPath("/pkg")
+    with pytest.raises(ValueError, match="cannot start with dbfs://"):
+        DbfsPath("dbfs://pkg")
+
+
+def test_file_info_from_json():
+    info = FileInfo.from_json({"path": "/pkg/a.py", "is_dir": False, "file_size": 3, "modification_time": 10})
+    assert info == FileInfo(DbfsPath("dbfs:/pkg/a.py"), False, 3, 10)
+    assert FileInfo.from_json({"path": "/pkg/sub", "is_dir": True}).file_size == 0
+
+
+def test_invalid_block_size():
+    with pytest.raises(ValueError):
+        DbfsApi("https://host", "token", block_size=2 * 1024 * 1024)
+
+
+def test_put_file_single_request(fake_dbfs, tmpdir):
+    source = tmpdir / "small.bin"
+    source.write_binary(b"x" * 100)
+    api = DbfsApi(fake_dbfs.url, "token", put_limit=100)
+
+    api.put_file(str(source), DbfsPath("dbfs:/pkg/small.bin"))
+    with pytest.raises(HTTPError):
+        api.put_file(str(source), DbfsPath("dbfs:/pkg/small.bin"))
+    api.put_file(str(source), DbfsPath("dbfs:/pkg/small.bin"), overwrite=True)
+
+    assert fake_dbfs.requests == {"put": 3}
+    with open(fake_dbfs.local_path("dbfs:/pkg/small.bin"), "rb") as f:
+        assert f.read() == b"x" * 100
+
+
+def test_put_and_get_file_in_blocks(fake_dbfs, tmpdir):
+    """Files larger than put_limit are streamed, and files are read, in blocks of block_size"""
+    contents = os.urandom(250)
+    source = tmpdir / "large.bin"
+    source.write_binary(contents)
+    api = DbfsApi(fake_dbfs.url, "token", block_size=100, put_limit=99)
+
+    api.put_file(str(source), DbfsPath("dbfs:/pkg/large.bin"), overwrite=True)
+    assert fake_dbfs.requests == {"create": 1, "add-block": 3, "close": 1}
+
+    destination = str(tmpdir / "copy.bin")
+    api.get_file(DbfsPath("dbfs:/pkg/large.bin"), destination)
+    # The last block is shorter than block_size, so no request is needed to find the end of the file
+    assert fake_dbfs.requests["read"] == 3
+    with open(destination, "rb") as f:
+        assert f.read() == contents
+
+    with pytest.raises(FileExistsError):
+        api.get_file(DbfsPath("dbfs:/pkg/large.bin"), destination)
+
+
+def test_get_status_and_list(fake_dbfs):
+    api = DbfsApi(fake_dbfs.url, "token")
+    api.mkdirs(DbfsPath("dbfs:/pkg/empty"))
+
+    assert api.get_status(DbfsPath("dbfs:/pkg")).is_dir
+    assert api.list_files(DbfsPath("dbfs:/pkg/empty")) == []
+    assert [info.dbfs_path.absolute_path for info in api.list_files(DbfsPath("dbfs:/pkg"))] == ["dbfs:/pkg/empty"]
+
+
+def test_delete_partial(fake_dbfs):
+    """A directory that is deleted in parts is deleted until no PARTIAL_DELETE error is returned anymore"""
+    api = DbfsApi(fake_dbfs.url, "token")
+    api.mkdirs(DbfsPath("dbfs:/pkg/sub"))
+    fake_dbfs.fail_next(503, count=2, endpoint="delete", error_code="PARTIAL_DELETE")
+
+    api.delete(DbfsPath("dbfs:/pkg"), recursive=True)
+
+    assert fake_dbfs.requests["delete"] == 3
+    assert not os.path.exists(fake_dbfs.local_path("dbfs:/pkg"))
+
+
+def test_cp_recursive(fake_dbfs, tmpdir):
+    source = tmpdir / "source"
+    os.makedirs(source / "sub", exist_ok=True)
+    (source / "a.py").write("a")
+    (source / "sub" / "b.py").write("b")
+    dbfs = Dbfs(fake_dbfs.url, "token")
+
+    dbfs.cp(str(source), "dbfs:/pkg", recursive=True, overwrite=True)
+    assert sorted(dbfs.ls("dbfs:/pkg", strings_only=True, recursive=True)) == ["dbfs:/pkg/a.py", "dbfs:/pkg/sub/b.py"]
+
+    destination = tmpdir / "destination"
+    dbfs.cp("dbfs:/pkg", str(destination), recursive=True)
+    assert (destination / "sub" / "b.py").read() == "b"
+    assert (destination / "a.py").read() == "a"
+
+    with pytest.raises(ValueError):
+        dbfs.cp("dbfs:/pkg/a.py", "dbfs:/pkg/c.py")
@@ -0,0 +1,151 @@
+import os
+import threading
+import pytest
+from requests import Response
+from requests.exceptions import HTTPError
+from dbfsps import stats
+from dbfsps.sdk.dbfs import Dbfs
+from dbfsps.sdk.errors import DatabricksApiError
+
+
+def http_error(status_code: int, text: str) -> HTTPError:
+    response = Response()
+    response.status_code = status_code
+    response.reason = text
+    response._content = text.encode()
+    return HTTPError(f"{status_code} error", response=response)
+
+
+def file_info(mocker, path, is_dir=False, size=0):
+    return mocker.Mock(dbfs_path=mocker.Mock(absolute_path=path), is_dir=is_dir, file_size=size)
+
+
+def test_ls_recursive(mocker):
+    """Verifies that a recursive listing descends into every directory and only returns files"""
+    tree = {
+        "dbfs:/pkg": [file_info(mocker, "dbfs:/pkg/a", is_dir=True), file_info(mocker, "dbfs:/pkg/x.py", size=1)],
+        "dbfs:/pkg/a": [file_info(mocker, "dbfs:/pkg/a/b", is_dir=True), file_info(mocker, "dbfs:/pkg/a/y.py")],
+        "dbfs:/pkg/a/b": [file_info(mocker, "dbfs:/pkg/a/b/z.py")],
+    }
+    listed = []
+    lock = threading.Lock()
+
+    def list_files(dbfs_path):
+        with lock:
+            listed.append(dbfs_path.absolute_path)
+        return tree[dbfs_path.absolute_path]
+
+    dbfs = Dbfs("host", "token")
+    mocker.patch.object(dbfs._api, "list_files", side_effect=list_files)
+
+    paths = dbfs.ls("dbfs:/pkg", recursive=True, workers=4)
+
+    assert sorted(path.dbfs_path.absolute_path for path in paths) == [
+        "dbfs:/pkg/a/b/z.py",
+        "dbfs:/pkg/a/y.py",
+        "dbfs:/pkg/x.py",
+    ]
+    assert sorted(listed) == ["dbfs:/pkg", "dbfs:/pkg/a", "dbfs:/pkg/a/b"]
+
+
+def test_mkdirs_cached(mocker):
+    """Verifies that directories are only created once, until they are removed"""
+    dbfs = Dbfs("host", "token")
+    mkdirs = mocker.patch.object(dbfs._api, "mkdirs")
+    mocker.patch.object(dbfs._api, "delete")
+
+    dbfs.mkdirs("dbfs:/pkg/a/b")
+    dbfs.mkdirs("dbfs:/pkg/a/b/")
+    dbfs.mkdirs("dbfs:/pkg/a")
+    assert mkdirs.call_count == 1
+
+    dbfs.rm("dbfs:/pkg/a", recursive=True)
+    dbfs.mkdirs("dbfs:/pkg/a/b")
+    dbfs.mkdirs("dbfs:/pkg")
+    assert mkdirs.call_count == 2
+
+
+def test_dbfs_retries_throttled_requests(mocker):
+    """Verifies that throttled requests are retried and lower the concurrency limit"""
+    mocker.patch("dbfsps.sdk.retry.time.sleep")
+    dbfs = Dbfs("host", "token", max_concurrency=4)
+    mocker.patch.object(dbfs._api, "mkdirs", side_effect=[http_error(429, "<html>Too many requests</html>"), None])
+
+    dbfs.mkdirs("dbfs:/pkg")
+
+    assert dbfs._api.mkdirs.call_count == 2
+    assert dbfs.limiter.limit == 2
+
+
+def test_dbfs_error_without_json(mocker):
+    dbfs = Dbfs("host", "token")
+    mocker.patch.object(dbfs._api, "delete", side_effect=http_error(404, "<html>Not found</html>"))
+
+    with pytest.raises(DatabricksApiError, match="Failed to remove dbfs:/pkg"):
+        dbfs.rm("dbfs:/pkg")
+
+
+def test_connection_stats():
+    """Verifies that the connection pool is sized to the concurrency and that its counters are reported"""
+    dbfs = Dbfs("host", "token", max_concurrency=12)
+    pool = dbfs._api.adapter.poolmanager.connection_from_url("https://host")
+    assert pool.pool.maxsize == 12
+
+    pool.num_connections = 2
+    pool.num_requests = 30
+    stats = dbfs.connection_stats()
+    assert (stats.connections, stats.requests, stats.reused) == (2, 30, 28)
+
+
+def test_dbfs_against_server(fake_dbfs, tmpdir):
+    """Verifies the Dbfs client against the fake DBFS REST API"""
+    source = tmpdir / "source.txt"
+    source.write("contents")
+    dbfs = Dbfs(fake_dbfs.url, "token")
+
+    dbfs.mkdirs("dbfs:/pkg/empty")
+    dbfs.cp(str(source), "dbfs:/pkg/sub/file.txt", overwrite=True)
+    paths = dbfs.ls("dbfs:/pkg", recursive=True)
+    assert [(path.dbfs_path.absolute_path, path.file_size) for path in paths] == [("dbfs:/pkg/sub/file.txt", 8)]
+    assert dbfs.cat("dbfs:/pkg/sub/file.txt") == "contents"
+
+    dbfs.mv("dbfs:/pkg/sub/file.txt", "dbfs:/pkg/moved.txt")
+    assert [path.dbfs_path.absolute_path for path in dbfs.ls("dbfs:/pkg")] == [
+        "dbfs:/pkg/empty",
+        "dbfs:/pkg/moved.txt",
+        "dbfs:/pkg/sub",
+    ]
+    dbfs.rm("dbfs:/pkg", recursive=True)
+    with pytest.raises(DatabricksApiError, match="RESOURCE_DOES_NOT_EXIST"):
+        dbfs.ls("dbfs:/pkg")
+    assert fake_dbfs.requests["put"] == 1
+    assert fake_dbfs.requests["delete"] == 1
+
+
+def test_dbfs_retries_against_server(fake_dbfs):
+    """Verifies that injected 503 and 429 responses are retried, honoring Retry-After"""
+    dbfs = Dbfs(fake_dbfs.url, "token")
+    fake_dbfs.fail_next(503, endpoint="mkdirs", retry_after=0)
+    fake_dbfs.fail_next(429, endpoint="mkdirs", retry_after=0)
+
+    dbfs.mkdirs("dbfs:/pkg")
+
+    assert fake_dbfs.requests["mkdirs"] == 3
+    assert fake_dbfs.responses == {503: 1, 429: 1, 200: 1}
+    assert os.path.isdir(fake_dbfs.local_path("dbfs:/pkg"))
+
+
+def test_dbfs_records_api_calls(fake_dbfs):
+    collector = stats.StatsCollector()
+    stats.set_collector(collector)
+    try:
+        dbfs = Dbfs(fake_dbfs.url, "token")
+        fake_dbfs.fail_next(429, endpoint="mkdirs", retry_after=0)
+        dbfs.mkdirs("dbfs:/pkg")
+    finally:
+        stats.set_collector(None)
+
+    report = collector.report()
+    assert report["api_calls"]["dbfs/mkdirs"]["count"] == 2
+    assert report["api_calls"]["dbfs/mkdirs"]["statuses"] == {"429": 1, "200": 1}
+    assert report["counters"] == {"throttled": 1, "retries": 1}
@@ -0,0 +1,22 @@
+import os
+from dbfsps.sdk.dbfs import Dbfs
+from dbfsps.syncer.plan import Plan
+from dbfsps.syncer.state import State
+from tests.sdk.fake_dbfs import FakeDbfs
+from tests.syncer.test_plan import PlanTester
+
+
+def test_plan_against_throttling_server(mocker, tmpdir):
+    """Verifies that a plan is applied completely while the workspace throttles concurrent requests"""
+    pt = PlanTester(tmpdir, mocker)
+    pt.create_files()
+    remote_path = "dbfs:/FileStore/packages/package"
+
+    with FakeDbfs(str(tmpdir / "dbfs"), latency=0.02, max_concurrency=2, retry_after=0.01) as server:
+        dbfs = Dbfs(server.url, "token", max_concurrency=8)
+        state = State(tmpdir, "package")
+        Plan(state, remote_path).apply_plan(dbfs, jobs=8)
+
+    assert len(state.files) == 5
+    for path in ["requirements.txt", "__init__.py", "utils.py", "subdir/one.py", "subdir/two.py"]:
+        assert os.path.isfile(server.local_path(f"{remote_path}/{path}"))
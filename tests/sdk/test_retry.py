@@ -0,0 +1,87 @@
+import threading
+import pytest
+from requests import Response
+from requests.exceptions import ConnectionError, HTTPError
+from dbfsps.sdk.retry import AdaptiveLimiter, RetryPolicy, get_retry_after
+
+
+def http_error(status_code: int, headers: dict = None) -> HTTPError:
+    response = Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return HTTPError(f"{status_code} error", response=response)
+
+
+def test_retry_policy_retries_until_success(mocker):
+    sleep = mocker.patch("dbfsps.sdk.retry.time.sleep")
+    func = mocker.Mock(side_effect=[http_error(503), ConnectionError("reset"), "done"])
+
+    assert RetryPolicy(base_delay=0.1).call(func, "arg") == "done"
+    assert func.call_count == 3
+    func.assert_called_with("arg")
+    assert sleep.call_count == 2
+    assert 0 <= sleep.call_args_list[1].args[0] <= 0.2
+
+
+def test_retry_policy_gives_up(mocker):
+    mocker.patch("dbfsps.sdk.retry.time.sleep")
+    func = mocker.Mock(side_effect=http_error(429))
+    with pytest.raises(HTTPError):
+        RetryPolicy(max_attempts=3).call(func)
+    assert func.call_count == 3
+
+    func = mocker.Mock(side_effect=http_error(404))
+    with pytest.raises(HTTPError):
+        RetryPolicy().call(func)
+    assert func.call_count == 1
+
+
+def test_retry_policy_honors_retry_after(mocker):
+    sleep = mocker.patch("dbfsps.sdk.retry.time.sleep")
+    func = mocker.Mock(side_effect=[http_error(429, {"Retry-After": "7"}), "done"])
+
+    RetryPolicy(max_delay=60).call(func)
+    sleep.assert_called_once_with(7.0)
+
+    assert get_retry_after(http_error(429, {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0.0
+    assert get_retry_after(http_error(429)) is None
+
+
+def test_adaptive_limiter_aimd():
+    limiter = AdaptiveLimiter(8, min_limit=1)
+    token = limiter.acquire()
+    limiter.release()
+    limiter.on_throttle(token)
+    assert limiter.limit == 4
+    # A second throttled request from before the decrease does not decrease the limit again
+    limiter.on_throttle(token)
+    assert limiter.limit == 4
+
+    # About one more request in flight per round of successful requests
+    for _ in range(4):
+        limiter.on_success()
+    assert limiter.limit == 4
+    limiter.on_success()
+    assert limiter.limit == 5
+    for _ in range(100):
+        limiter.on_success()
+    assert limiter.limit == 8
+
+
+def test_adaptive_limiter_bounds_in_flight():
+    limiter = AdaptiveLimiter(2)
+    limiter.acquire()
+    limiter.acquire()
+    acquired = threading.Event()
+
+    def acquire():
+        limiter.acquire()
+        acquired.set()
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    assert not acquired.wait(0.1)
+    limiter.release()
+    assert acquired.wait(1)
+    thread.join()
+    assert limiter.in_flight == 2
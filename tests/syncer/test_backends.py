@@ -0,0 +1,121 @@
+import os
+import pytest
+from dbfsps.syncer.backends import SqliteStateBackend, TextStateBackend, create_backend
+from dbfsps.syncer.file import File, FileStats
+from dbfsps.syncer.state import State
+
+
+def test_create_backend_unknown():
+    with pytest.raises(ValueError):
+        create_backend("csv", "/some/path")
+
+
+def test_text_backend_store_is_atomic(mocker, tmpdir):
+    """A failing write should leave the previous statefile intact"""
+    statefilepath = str(tmpdir / ".dbfsps_file_status")
+    backend = TextStateBackend(statefilepath)
+    backend.store({"a.py": File("a.py", "package", str(tmpdir), hashstr="1")})
+
+    broken_file = mocker.Mock(path="b.py", stats=None)
+    type(broken_file).hash = mocker.PropertyMock(side_effect=RuntimeError("interrupted"))
+    with pytest.raises(RuntimeError):
+        backend.store({"b.py": broken_file})
+
+    assert list(backend.load()) == [("a.py", "1", None)]
+
+
+def test_sqlite_backend_migrates_text_state(tmpdir):
+    statefilepath = str(tmpdir / ".dbfsps_file_status")
+    with open(statefilepath, "w") as f:
+        f.writelines(["file1.py,123,10,1000,42\n", "path/file2.py,124\n"])
+
+    s = State(str(tmpdir), "package", backend="sqlite")
+
+    assert s.files["file1.py"].hash == "123"
+    assert s.files["file1.py"].stats == FileStats(10, 1000, 42)
+    assert s.files["path/file2.py"].stats is None
+    assert not os.path.exists(statefilepath)
+    assert os.path.isfile(statefilepath + ".bak")
+    assert os.path.isfile(statefilepath + ".sqlite")
+
+
+def test_sqlite_backend_incremental_updates(tmpdir):
+    statefilepath = str(tmpdir / ".dbfsps_file_status")
+    s = State(str(tmpdir), "package", backend="sqlite")
+    files = [File(f"file{i}.py", "package", str(tmpdir), hashstr=str(i), stats=FileStats(i, i, i)) for i in range(3)]
+
+    s.update_files(files, [])
+    s.update_files([File("file0.py", "package", str(tmpdir), hashstr="new")], [files[1]])
+
+    # A second process sees the changes without the first one storing the full state
+    other = SqliteStateBackend(statefilepath)
+    assert sorted(other.load()) == [("file0.py", "new", None), ("file2.py", "2", FileStats(2, 2, 2))]
+
+
+def test_sqlite_backend_shared_by_two_states(tmpdir):
+    """Storing the state of one process should not overwrite or remove rows that another process changed"""
+    first = State(str(tmpdir), "package", backend="sqlite")
+    first.update_files([File(name, "package", str(tmpdir), hashstr="1") for name in ["a.py", "b.py", "c.py"]], [])
+    second = State(str(tmpdir), "package", backend="sqlite")
+
+    first.update_files([File("a.py", "package", str(tmpdir), hashstr="2")], [first.files["c.py"]])
+    second.files["b.py"] = File("b.py", "package", str(tmpdir), hashstr="1", stats=FileStats(1, 1, 1))
+    second.files["d.py"] = File("d.py", "package", str(tmpdir), hashstr="1")
+    second.store_state()
+    first.store_state()
+
+    stored = sorted(SqliteStateBackend(str(tmpdir / ".dbfsps_file_status")).load())
+    assert stored == [
+        ("a.py", "2", None),
+        ("b.py", "1", FileStats(1, 1, 1)),
+        ("d.py", "1", None),
+    ]
+
+
+def test_sqlite_backend_store_and_reset(tmpdir):
+    s = State(str(tmpdir), "package", backend="sqlite")
+    s.files = {name: File(name, "package", str(tmpdir), hashstr="x") for name in ["a.py", "b.py"]}
+    s.store_state()
+    del s.files["a.py"]
+    s.store_state()
+
+    assert sorted(State(str(tmpdir), "package", backend="sqlite").files) == ["b.py"]
+
+    s.reset()
+
+    assert not State(str(tmpdir), "package", backend="sqlite").backend.exists()
+
+
+def test_sqlite_backend_lookup(tmpdir):
+    statefilepath = str(tmpdir / ".dbfsps_file_status")
+    backend = SqliteStateBackend(statefilepath)
+    backend.update([File("a.py", "package", str(tmpdir), hashstr="1", stats=FileStats(1, 2, 3))], [])
+    backend.update([File("sub/b.py", "package", str(tmpdir), hashstr="2")], [])
+
+    assert backend.lookup("a.py") == ("a.py", "1", FileStats(1, 2, 3))
+    assert backend.lookup("sub/b.py") == ("sub/b.py", "2", None)
+    assert backend.lookup("c.py") is None
+    assert sorted(backend.paths()) == ["a.py", "sub/b.py"]
+
+    s = State(str(tmpdir), "package", backend="sqlite")
+    assert not s.loaded
+    assert s.lookup("a.py").hash == "1"
+    assert sorted(s.files) == ["a.py", "sub/b.py"]
+    assert s.loaded
+
+
+def test_sqlite_backend_migration_race(mocker, tmpdir):
+    """A process that saw the text statefile before another process migrated it should not migrate it again"""
+    statefilepath = str(tmpdir / ".dbfsps_file_status")
+    with open(statefilepath, "w") as f:
+        f.writelines(["file1.py,123\n", "file2.py,124\n"])
+    first = SqliteStateBackend(statefilepath)
+    second = SqliteStateBackend(statefilepath)
+
+    assert first.lookup("file1.py") == ("file1.py", "123", None)
+    first.update([File("file1.py", "package", str(tmpdir), hashstr="new")], [])
+    # The second process checked for the statefile before the first one renamed it
+    mocker.patch("dbfsps.syncer.backends.os.path.isfile", return_value=True)
+
+    assert sorted(second.load()) == [("file1.py", "new", None), ("file2.py", "124", None)]
+    assert os.path.isfile(statefilepath + ".bak")
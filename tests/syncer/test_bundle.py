@@ -0,0 +1,224 @@
+import os
+import sys
+import shutil
+import zipfile
+from dbfsps import stats
+from dbfsps.setupnotebook import SetupNotebook
+from dbfsps.syncer.state import State
+from dbfsps.syncer.bundle import LAYERS_DIR, BundlePlan, LayeredBundlePlan, build_zip_bundle, calculate_bundle_hash
+from dbfsps.syncer.file import File
+from tests.syncer.test_plan import PlanTester
+
+
+def archive_contents(archive_path: str) -> dict:
+    with zipfile.ZipFile(archive_path) as archive:
+        return {name: archive.read(name) for name in archive.namelist()}
+
+
+def test_bundle_plan(mocker, tmpdir):
+    """Verifies that the package is uploaded as one archive, and only again after a file changed"""
+    remote_path = "dbfs:/FileStore/packages/packagename"
+    pt = PlanTester(tmpdir, mocker)
+    pt.create_files()
+    uploaded = {}
+
+    def cp(source, destination, overwrite=False):
+        if destination.endswith(".zip"):
+            uploaded[destination] = archive_contents(source)
+
+    mock_dbfs = mocker.Mock()
+    mock_dbfs.cp.side_effect = cp
+
+    p = BundlePlan(State(tmpdir, "package"), remote_path)
+    p.apply_plan(mock_dbfs)
+
+    assert mock_dbfs.cp.call_count == 2
+    assert uploaded[os.path.join(remote_path, "package.zip")] == {
+        "__init__.py": b"line1\n",
+        "utils.py": b"line1\n",
+        "subdir/one.py": b"line1\n",
+        "subdir/two.py": b"line1\n",
+    }
+    assert not os.path.exists(tmpdir / ".dbfsps_package.zip")
+
+    p = BundlePlan(State(tmpdir, "package"), remote_path)
+    assert not p.has_changes()
+
+    pt.change_file(tmpdir / "package" / "utils.py", "different contents\n")
+    p = BundlePlan(State(tmpdir, "package"), remote_path)
+    assert [file.path_remote for file in p.files_updated] == ["package.zip"]
+
+
+def test_bundle_plan_reuses_hashes(mocker, tmpdir):
+    """Verifies that the files in the archive are kept in the state, so an unchanged package is not hashed again"""
+    remote_path = "dbfs:/FileStore/packages/packagename"
+    pt = PlanTester(tmpdir, mocker)
+    pt.create_files()
+    BundlePlan(State(tmpdir, "package"), remote_path).apply_plan(mocker.Mock())
+
+    s = State(tmpdir, "package")
+    assert sorted(s.files) == sorted(
+        [
+            os.path.join("..", "requirements.txt"),
+            "__init__.py",
+            "utils.py",
+            os.path.join("subdir", "one.py"),
+            os.path.join("subdir", "two.py"),
+        ]
+    )
+    collector = stats.StatsCollector()
+    stats.set_collector(collector)
+    try:
+        p = BundlePlan(s, remote_path)
+        p.apply_plan(mocker.Mock())
+    finally:
+        stats.set_collector(None)
+    assert not p.has_changes()
+    assert collector.counters.get("files_hashed", 0) == 0
+
+
+def test_bundle_plan_migrates_archive_state(mocker, tmpdir):
+    """Verifies that a state with only the archive entry is replaced by the files in the archive"""
+    remote_path = "dbfs:/FileStore/packages/packagename"
+    pt = PlanTester(tmpdir, mocker)
+    pt.create_files()
+    p = BundlePlan(State(tmpdir, "package"), remote_path)
+    archive_hash = p.local_files[p.archive_path].hash
+    with open(tmpdir / ".dbfsps_file_status", "w") as f:
+        f.write(f"{p.archive_path},{archive_hash}\n")
+
+    s = State(tmpdir, "package")
+    p = BundlePlan(s, remote_path)
+    assert [file.path for file in p.files_new] == ["../requirements.txt"]
+    p.apply_plan(mocker.Mock())
+
+    assert p.archive_path not in s.files
+    assert "utils.py" in s.files and s.files["utils.py"].stats is not None
+
+
+def test_build_zip_bundle_is_reproducible(tmpdir):
+    for name in ["b.py", "a.py"]:
+        with open(tmpdir / name, "w") as f:
+            f.write(name)
+    files = [File(name, "", str(tmpdir), hashstr=name) for name in ["b.py", "a.py"]]
+
+    build_zip_bundle(files, str(tmpdir / "first.zip"))
+    build_zip_bundle(list(reversed(files)), str(tmpdir / "second.zip"))
+
+    with open(tmpdir / "first.zip", "rb") as first, open(tmpdir / "second.zip", "rb") as second:
+        assert first.read() == second.read()
+    assert calculate_bundle_hash(files) == calculate_bundle_hash(reversed(files))
+
+
+class LocalDbfs:
+    """Stand-in for the Dbfs client that stores uploads in a local directory"""
+
+    def __init__(self, remote_root: str):
+        self.remote_root = remote_root
+
+    def _local(self, dbfs_path: str) -> str:
+        return os.path.join(self.remote_root, dbfs_path.replace("dbfs:/", ""))
+
+    def cp(self, source, destination, overwrite=False):
+        os.makedirs(os.path.dirname(self._local(destination)), exist_ok=True)
+        shutil.copy(source, self._local(destination))
+
+    def rm(self, dbfs_path, recursive=False):
+        if recursive:
+            shutil.rmtree(self._local(dbfs_path))
+        else:
+            os.remove(self._local(dbfs_path))
+
+    def mkdirs(self, dbfs_path):
+        os.makedirs(self._local(dbfs_path), exist_ok=True)
+
+    def ls(self, dbfs_path, strings_only=False):
+        if not os.path.isdir(self._local(dbfs_path)):
+            return []
+        return [f"{dbfs_path}/{name}" for name in sorted(os.listdir(self._local(dbfs_path)))]
+
+
+def resolve_layers(remote_package_path: str, mocker, tmpdir) -> dict:
+    """Runs the generated setup notebook and returns the contents of the resolved package"""
+    mocker.patch("tempfile.gettempdir", return_value=str(tmpdir / "cluster"))
+    source = SetupNotebook(remote_package_path, "unused.py", layers_dir=LAYERS_DIR).source
+    exec(compile(source, "init_notebook", "exec"), {})
+    import_path = str(tmpdir / "cluster" / "dbfsps" / os.path.basename(remote_package_path))
+    sys.path.remove(import_path)
+    contents = {}
+    for root, _, files in os.walk(import_path):
+        for name in files:
+            with open(os.path.join(root, name)) as f:
+                contents[os.path.relpath(os.path.join(root, name), import_path)] = f.read()
+    return contents
+
+
+def test_layered_bundle_plan(mocker, tmpdir):
+    """Verifies that deltas are uploaded on top of a base, compacted, and resolved in order by the notebook"""
+    remote_path = "dbfs:/FileStore/packages/packagename"
+    remote_package_path = str(tmpdir / "remote" / "FileStore" / "packages" / "packagename")
+    pt = PlanTester(tmpdir, mocker)
+    pt.create_files()
+    dbfs = LocalDbfs(str(tmpdir / "remote"))
+
+    def sync():
+        p = LayeredBundlePlan(State(tmpdir, "package"), remote_path, max_deltas=2, max_delta_ratio=10)
+        p.apply_plan(dbfs)
+        return sorted(os.listdir(os.path.join(remote_package_path, LAYERS_DIR)))
+
+    assert sync() == ["000001-base.zip"]
+
+    pt.change_file(tmpdir / "package" / "utils.py", "different contents\n")
+    os.remove(tmpdir / "package" / "subdir" / "one.py")
+    assert sync() == ["000001-base.zip", "000002-delta.zip"]
+    assert resolve_layers(remote_package_path, mocker, tmpdir) == {
+        "__init__.py": "line1\n",
+        "utils.py": "different contents\n",
+        os.path.join("subdir", "two.py"): "line1\n",
+    }
+
+    pt.change_file(tmpdir / "package" / "subdir" / "one.py", "back again\n")
+    assert sync() == ["000001-base.zip", "000002-delta.zip", "000003-delta.zip"]
+
+    pt.change_file(tmpdir / "package" / "new.py", "new\n")
+    assert sync() == ["000004-base.zip"]
+    assert resolve_layers(remote_package_path, mocker, tmpdir) == {
+        "__init__.py": "line1\n",
+        "new.py": "new\n",
+        "utils.py": "different contents\n",
+        os.path.join("subdir", "one.py"): "back again\n",
+        os.path.join("subdir", "two.py"): "line1\n",
+    }
+
+    p = LayeredBundlePlan(State(tmpdir, "package"), remote_path)
+    assert not p.has_changes()
+
+
+def test_layered_bundle_plan_reset_index(mocker, tmpdir):
+    """Verifies that a new base continues after the layers on DBFS and replaces them, when the index was lost"""
+    remote_path = "dbfs:/FileStore/packages/packagename"
+    remote_package_path = str(tmpdir / "remote" / "FileStore" / "packages" / "packagename")
+    pt = PlanTester(tmpdir, mocker)
+    pt.create_files()
+    dbfs = LocalDbfs(str(tmpdir / "remote"))
+
+    def sync():
+        p = LayeredBundlePlan(State(tmpdir, "package"), remote_path, max_deltas=5, max_delta_ratio=10)
+        p.apply_plan(dbfs)
+        return sorted(os.listdir(os.path.join(remote_package_path, LAYERS_DIR)))
+
+    sync()
+    pt.change_file(tmpdir / "package" / "utils.py", "different contents\n")
+    assert sync() == ["000001-base.zip", "000002-delta.zip"]
+
+    # Like --delete-status-file, or a fresh clone
+    os.remove(tmpdir / ".dbfsps_file_status")
+    os.remove(tmpdir / ".dbfsps_file_status.layers")
+    pt.change_file(tmpdir / "package" / "utils.py", "latest\n")
+    assert sync() == ["000003-base.zip"]
+    assert resolve_layers(remote_package_path, mocker, tmpdir)["utils.py"] == "latest\n"
+
+    # Only the index is lost, the state is still up to date
+    os.remove(tmpdir / ".dbfsps_file_status.layers")
+    assert sync() == ["000004-base.zip"]
+    assert sync() == ["000004-base.zip"]
@@ -1,6 +1,7 @@
 import os
 import pytest
-from dbfsps.syncer.file import File, sort_list_of_files, calculate_file_hash
+from hashlib import sha256
+from dbfsps.syncer.file import File, sort_list_of_files, calculate_file_hash, calculate_file_hashes
 
 
 def test_sort_list_of_files():
@@ -31,19 +32,29 @@ def test_sort_list_of_files():
     assert expected_paths == [file.path for file in sorted_files]
 
 
-def test_calculate_file_hash(mocker, tmpdir):
-    """Ensure that sha256 is called with the file contents and that the hexdigest string is returned"""
-    sha_object = mocker.Mock()
-    sha_object.hexdigest.return_value = "hash_result"
-    sha_func = mocker.patch("dbfsps.syncer.file.sha256", return_value=sha_object)
-    filepath = os.path.join(str(tmpdir), "testfile.txt")
-    with open(filepath, "w") as f:
-        f.write("123\n")
+@pytest.mark.parametrize("buffer_size", [1, 7, 4096, 1024 * 1024])
+def test_calculate_file_hash(tmpdir, buffer_size):
+    """Ensure that the streamed hash equals the sha256 of the full file contents for any buffer size"""
+    contents = os.urandom(10000)
+    filepath = os.path.join(str(tmpdir), "testfile.bin")
+    with open(filepath, "wb") as f:
+        f.write(contents)
 
-    returned_hash = calculate_file_hash(filepath)
+    returned_hash = calculate_file_hash(filepath, buffer_size=buffer_size)
 
-    assert returned_hash == "hash_result"
-    sha_func.assert_called_once_with(b"123\n")
+    assert returned_hash == sha256(contents).hexdigest()
+
+
+def test_calculate_file_hash_empty(tmpdir):
+    filepath = os.path.join(str(tmpdir), "empty.txt")
+    open(filepath, "w").close()
+
+    assert calculate_file_hash(filepath) == sha256(b"").hexdigest()
+
+
+def test_calculate_file_hash_invalid_buffer_size(tmpdir):
+    with pytest.raises(ValueError):
+        calculate_file_hash(str(tmpdir), buffer_size=0)
 
 
 def test_calculate_file_hash_fnf():
@@ -99,3 +110,41 @@ def test_file_equate():
     assert not should_be_false2
     assert should_be_true
     assert should_be_true2
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_calculate_file_hashes(tmpdir, jobs):
+    """Ensure that files hashed in the thread and process pools get the same hashes as when hashed one by one"""
+    files = []
+    for i, size in enumerate([0, 10, 2000, 5000, 6000]):
+        filepath = os.path.join(str(tmpdir), f"file{i}.bin")
+        with open(filepath, "wb") as f:
+            f.write(os.urandom(size))
+        files.append((filepath, size))
+
+    hashes = calculate_file_hashes(files, jobs=jobs, process_min_size=4096)
+
+    assert hashes == {filepath: calculate_file_hash(filepath) for filepath, _ in files}
+
+
+def test_file_lazy_hash(mocker):
+    """Ensure that the hash is only calculated when it is accessed, and only once"""
+    calc = mocker.patch("dbfsps.syncer.file.calculate_file_hash", return_value="file_hash")
+    f = File("file.py", "packagename", "/root/dir")
+
+    calc.assert_not_called()
+    assert not f.is_hashed()
+    assert f.hash == "file_hash"
+    assert f.hash == "file_hash"
+    calc.assert_called_once_with(os.path.join("/root/dir", "packagename", "file.py"))
+    assert f.is_hashed()
+
+
+def test_file_is_compact():
+    f1 = File("a.py", "package" + "name", "/root/dir", hashstr="1")
+    f2 = File("b.py", "packagename", "/root/" + "dir", hashstr="2")
+
+    assert not hasattr(f1, "__dict__")
+    assert f1.package is f2.package
+    assert f1.root is f2.root
+    assert f1.path_remote is f1.path
@@ -0,0 +1,63 @@
+import os
+from dbfsps.syncer.file import File, FileStats
+from dbfsps.syncer.journal import Journal
+from dbfsps.syncer.state import State
+
+
+def test_journal_replay(tmpdir):
+    path = str(tmpdir / ".dbfsps_file_status.journal")
+    journal = Journal(path)
+    journal.append([File("a.py", "package", str(tmpdir), hashstr="1", stats=FileStats(1, 2, 3))], [])
+    journal.append([File("b.py", "package", str(tmpdir), hashstr="2")], ["a.py"])
+    with open(path, "a") as f:
+        f.write('{"op": "upload", "path": "c.p')
+
+    assert list(Journal(path).replay()) == [
+        ("upload", ("a.py", "1", FileStats(1, 2, 3))),
+        ("upload", ("b.py", "2", None)),
+        ("remove", ("a.py", None, None)),
+    ]
+
+    journal.clear()
+    assert not journal.exists()
+
+
+def test_state_replays_journal(tmpdir):
+    """Operations recorded after the last checkpoint are applied on top of the statefile"""
+    with open(tmpdir / ".dbfsps_file_status", "w") as f:
+        f.writelines(["a.py,1\n", "b.py,2\n"])
+    s = State(str(tmpdir), "package")
+    s.update_files([File("c.py", "package", str(tmpdir), hashstr="3")], [s.files["a.py"]])
+
+    resumed = State(str(tmpdir), "package")
+
+    assert {path: file.hash for path, file in resumed.files.items()} == {"b.py": "2", "c.py": "3"}
+    assert not os.path.exists(tmpdir / ".dbfsps_file_status.journal")
+    with open(tmpdir / ".dbfsps_file_status") as f:
+        assert sorted(f.readlines()) == ["b.py,2\n", "c.py,3\n"]
+
+
+def test_state_checkpoints(tmpdir, mocker):
+    """The full state is stored once checkpoint_interval has passed, after which the journal starts over"""
+    monotonic = mocker.patch("dbfsps.syncer.state.time.monotonic", return_value=0.0)
+    s = State(str(tmpdir), "package", checkpoint_interval=10)
+
+    s.update_files([File("a.py", "package", str(tmpdir), hashstr="1")], [])
+    assert not os.path.exists(tmpdir / ".dbfsps_file_status")
+
+    monotonic.return_value = 10.0
+    s.update_files([File("b.py", "package", str(tmpdir), hashstr="2")], [])
+    assert not os.path.exists(tmpdir / ".dbfsps_file_status.journal")
+    with open(tmpdir / ".dbfsps_file_status") as f:
+        assert sorted(f.readlines()) == ["a.py,1\n", "b.py,2\n"]
+
+    s.update_files([File("c.py", "package", str(tmpdir), hashstr="3")], [])
+    assert sorted(State(str(tmpdir), "package").files) == ["a.py", "b.py", "c.py"]
+
+
+def test_sqlite_state_does_not_journal(tmpdir):
+    s = State(str(tmpdir), "package", backend="sqlite")
+    s.update_files([File("a.py", "package", str(tmpdir), hashstr="1")], [])
+
+    assert not os.path.exists(tmpdir / ".dbfsps_file_status.journal")
+    assert sorted(State(str(tmpdir), "package", backend="sqlite").files) == ["a.py"]
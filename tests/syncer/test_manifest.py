@@ -0,0 +1,189 @@
+import os
+import json
+import shutil
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from dbfsps.sdk.dbfs import Dbfs
+from dbfsps.syncer.state import State
+from dbfsps.syncer.plan import Plan
+from dbfsps.syncer.manifest import MANIFEST_NAME, RemoteManifest, merge_manifests
+from tests.sdk.fake_dbfs import FakeDbfs
+
+REMOTE_PATH = "dbfs:/FileStore/packages/package"
+
+
+@pytest.fixture
+def server(tmpdir):
+    with FakeDbfs(str(tmpdir / "dbfs")) as server:
+        yield server
+
+
+@pytest.fixture
+def dbfs_client(server):
+    return Dbfs(server.url, "token")
+
+
+def create_repo(root, files: dict):
+    for rel_path, contents in {"poetry.lock": "lock\n", **files}.items():
+        path = os.path.join(root, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(contents)
+
+
+def sync(root, dbfs_client: Dbfs) -> Plan:
+    plan = Plan(State(str(root), "package"), REMOTE_PATH)
+    plan.use_manifest(RemoteManifest(dbfs_client, REMOTE_PATH))
+    plan.apply_plan(dbfs_client, jobs=4)
+    return plan
+
+
+def list_temp_files(server) -> list:
+    return [name for name in os.listdir(server.local_path(REMOTE_PATH)) if name.endswith(".tmp")]
+
+
+@pytest.fixture(autouse=True)
+def requirements_file(mocker):
+    def create_requirements_file(root, **kwargs):
+        shutil.copy(os.path.join(root, "poetry.lock"), os.path.join(root, "requirements.txt"))
+
+    mocker.patch("dbfsps.syncer.plan.create_requirements_file", side_effect=create_requirements_file)
+
+
+def test_merge_manifests():
+    base = {"a": "1", "b": "1", "c": "1", "d": "1"}
+    ours = {"a": "2", "b": "1", "d": "2", "e": "1"}
+    theirs = {"a": "1", "b": "3", "c": "1", "d": "3", "f": "1"}
+    # a and e only changed by us, c only removed by us, b and f only changed by them, d changed by both
+    assert merge_manifests(base, ours, theirs) == {"a": "2", "b": "3", "e": "1", "f": "1"}
+
+
+def test_manifest_store_and_load(server, dbfs_client):
+    manifest = RemoteManifest(dbfs_client, REMOTE_PATH)
+    assert manifest.load() == {}
+    assert manifest.generation == 0
+
+    manifest.store({"__init__.py": "1", os.path.join("sub", "one.py"): "2"})
+    manifest.store({"__init__.py": "1", os.path.join("sub", "one.py"): "3"})
+    with open(server.local_path(f"{REMOTE_PATH}/{MANIFEST_NAME}")) as f:
+        stored = json.load(f)
+    assert stored["generation"] == 2
+    assert stored["files"] == {"__init__.py": "1", "sub/one.py": "3"}
+    assert not list_temp_files(server)
+
+    other = RemoteManifest(dbfs_client, REMOTE_PATH)
+    assert other.load() == {"__init__.py": "1", os.path.join("sub", "one.py"): "3"}
+    assert other.generation == 2
+
+    server.requests.clear()
+    other.store(other.hashes)
+    assert server.requests == {"read": 1}
+
+
+def test_manifest_merges_concurrent_writes(dbfs_client):
+    RemoteManifest(dbfs_client, REMOTE_PATH).store({"a": "1", "b": "1"})
+    first = RemoteManifest(dbfs_client, REMOTE_PATH)
+    second = RemoteManifest(dbfs_client, REMOTE_PATH)
+    first.load()
+    second.load()
+
+    first.store({"a": "2", "b": "1"})
+    written = second.store({"a": "1", "b": "1", "c": "1"})
+
+    assert written == {"a": "2", "b": "1", "c": "1"}
+    assert second.generation == 3
+    assert RemoteManifest(dbfs_client, REMOTE_PATH).load() == written
+
+
+def test_manifest_first_writes_race(mocker, server, dbfs_client):
+    """Two syncs that both write the first manifest: the move of the second fails and it merges and retries"""
+    first = RemoteManifest(dbfs_client, REMOTE_PATH, retry_delay=0)
+    second = RemoteManifest(mocker.Mock(wraps=dbfs_client), REMOTE_PATH, retry_delay=0)
+    first.load()
+    second.load()
+
+    def cp(*args, **kwargs):
+        # The first sync writes its manifest while the second one uploads to its temporary path
+        if first.generation == 0:
+            first.store({"a": "1", "b": "1"})
+        return dbfs_client.cp(*args, **kwargs)
+
+    second.dbfs.cp.side_effect = cp
+    written = second.store({"c": "1"})
+
+    assert written == {"a": "1", "b": "1", "c": "1"}
+    assert second.generation == 2
+    assert RemoteManifest(dbfs_client, REMOTE_PATH).load() == written
+    assert not list_temp_files(server)
+
+
+def test_manifest_read_while_replaced(mocker, server, dbfs_client):
+    """A sync that reads while another sync replaces the manifest waits for it, instead of merging with nothing"""
+    RemoteManifest(dbfs_client, REMOTE_PATH).store({"a": "1", "b": "1"})
+    first = RemoteManifest(mocker.Mock(wraps=dbfs_client), REMOTE_PATH, retry_delay=0)
+    second = RemoteManifest(mocker.Mock(wraps=dbfs_client), REMOTE_PATH, retry_delay=0.1)
+    first.load()
+    second.load()
+    read_in_gap = threading.Event()
+    futures = []
+
+    def cat(path):
+        try:
+            return dbfs_client.cat(path)
+        finally:
+            read_in_gap.set()
+
+    def mv(source, destination):
+        # The old manifest is removed, the second sync reads before the new one is moved in place
+        futures.append(executor.submit(second.store, {"a": "1", "b": "1", "c": "1"}))
+        assert read_in_gap.wait(5)
+        dbfs_client.mv(source, destination)
+
+    second.dbfs.cat.side_effect = cat
+    first.dbfs.mv.side_effect = mv
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        first.store({"a": "2", "b": "1"})
+
+    assert futures[0].result() == {"a": "2", "b": "1", "c": "1"}
+    assert second.hashes == {"a": "2", "b": "1", "c": "1"}
+    assert second.generation == 3
+    assert RemoteManifest(dbfs_client, REMOTE_PATH).load() == {"a": "2", "b": "1", "c": "1"}
+    assert not list_temp_files(server)
+
+
+def test_plan_with_manifest_on_fresh_machine(tmpdir, server, dbfs_client):
+    """Verifies that a machine without a statefile only uploads what differs from the manifest on DBFS"""
+    files = {"package/__init__.py": "init\n", "package/sub/one.py": "one\n", "package/sub/two.py": "two\n"}
+    create_repo(tmpdir / "first", files)
+    plan = sync(tmpdir / "first", dbfs_client)
+    assert len(plan.files_new) == 4
+    assert os.path.isfile(server.local_path(f"{REMOTE_PATH}/sub/two.py"))
+
+    create_repo(tmpdir / "second", {**files, "package/sub/two.py": "changed\n"})
+    server.requests.clear()
+    plan = sync(tmpdir / "second", dbfs_client)
+
+    assert [file.path for file in plan.files_updated] == [os.path.join("sub", "two.py")]
+    assert not plan.files_new and not plan.files_deleted
+    assert server.requests["put"] == 2
+    with open(server.local_path(f"{REMOTE_PATH}/sub/two.py")) as f:
+        assert f.read() == "changed\n"
+
+    # The first machine finds the change of the second in the manifest, and uploads its own version again
+    plan = Plan(State(str(tmpdir / "first"), "package"), REMOTE_PATH)
+    assert not plan.has_changes()
+    plan.use_manifest(RemoteManifest(dbfs_client, REMOTE_PATH))
+    assert [file.path for file in plan.files_updated] == [os.path.join("sub", "two.py")]
+
+
+def test_plan_reconcile_ignores_manifest(mocker, tmpdir, dbfs_client):
+    create_repo(tmpdir, {"package/__init__.py": "init\n"})
+    sync(tmpdir, dbfs_client)
+    warning = mocker.patch("dbfsps.syncer.plan.logging.Logger.warning")
+
+    plan = Plan(State(str(tmpdir), "package"), REMOTE_PATH)
+    plan.reconcile(dbfs_client)
+
+    assert not plan.has_changes()
+    warning.assert_not_called()
@@ -3,7 +3,8 @@ import shutil
 import pytest
 from pathlib import Path
 from dbfsps.syncer.state import State
-from dbfsps.syncer.plan import Plan, get_requirements_relative_path
+from dbfsps.syncer.file import calculate_file_hash
+from dbfsps.syncer.plan import Plan, get_requirements_relative_path, get_upload_dirs
 
 
 def create_statefile(path: str):
@@ -50,7 +51,7 @@ class PlanTester:
             with open(file, "w") as f:
                 f.write("line1\n")
 
-    def create_req_file(self):
+    def create_req_file(self, *args, **kwargs):
         with open(self.root / "poetry.lock", "r") as f:
             text = f.read()
         with open(self.root / "requirements.txt", "w") as f:
@@ -115,14 +116,11 @@ def test_plan_remove_files(mocker, tmpdir):
 
     # Simulate a new session
     mock_dbfs = mocker.Mock()
+    mock_dbfs.ls.return_value = remote_listing(mocker, remote_path, {"subdir/one.py": 4, "subdir/two.py": 4})
     plan_apply(tmpdir, remote_path, mock_dbfs)
 
-    expected_calls = [
-        mocker.call(os.path.join(remote_path, "subdir/one.py")),
-        mocker.call(os.path.join(remote_path, "subdir/two.py")),
-    ]
-
-    mock_dbfs.rm.assert_has_calls(expected_calls, any_order=True)
+    mock_dbfs.ls.assert_called_once_with(os.path.join(remote_path, "subdir"), recursive=True, workers=1)
+    mock_dbfs.rm.assert_called_once_with(os.path.join(remote_path, "subdir"), recursive=True)
 
     with open(tmpdir / ".dbfsps_file_status", "r") as f:
         assert len(f.readlines()) == 3
@@ -189,3 +187,300 @@ def test_print_plan(mocker, tmpdir, capfd):
     assert "File subdir/one.py will be removed" in out
     assert "File subdir/two.py will be removed" in out
     assert "2 files will be deleted; 1 files will be added; 1 files will be updated."
+
+
+def test_plan_apply_concurrent(mocker, tmpdir):
+    """Verifies that applying a plan with multiple jobs records successes and failures per file in the state"""
+    remote_path = "dbfs:/FileStore/packages/packagename"
+    pt = PlanTester(tmpdir, mocker)
+    pt.create_files()
+
+    def cp(source, destination, overwrite=False):
+        if destination.endswith("utils.py"):
+            raise RuntimeError("upload failed")
+
+    mock_dbfs = mocker.Mock()
+    mock_dbfs.cp.side_effect = cp
+
+    s = State(tmpdir, "package")
+    p = Plan(s, remote_path)
+    p.apply_plan(mock_dbfs, jobs=4)
+
+    assert mock_dbfs.cp.call_count == 5
+    assert sorted(s.files.keys()) == ["../requirements.txt", "__init__.py", "subdir/one.py", "subdir/two.py"]
+
+
+def test_plan_resumes_interrupted_apply(mocker, tmpdir):
+    """Verifies that uploads completed before the process was interrupted are not repeated by the next run"""
+    remote_path = "dbfs:/FileStore/packages/packagename"
+    pt = PlanTester(tmpdir, mocker)
+    pt.create_files()
+    uploaded = []
+
+    def cp(source, destination, overwrite=False):
+        if len(uploaded) == 3:
+            raise KeyboardInterrupt
+        uploaded.append(destination[len(remote_path) + 1 :])
+
+    mock_dbfs = mocker.Mock()
+    mock_dbfs.cp.side_effect = cp
+
+    with pytest.raises(KeyboardInterrupt):
+        plan_apply(tmpdir, remote_path, mock_dbfs)
+    assert not os.path.exists(tmpdir / ".dbfsps_file_status")
+    assert os.path.isfile(tmpdir / ".dbfsps_file_status.journal")
+
+    s = State(tmpdir, "package")
+    p = Plan(s, remote_path)
+
+    assert len(s.files) == 3
+    assert not os.path.exists(tmpdir / ".dbfsps_file_status.journal")
+    assert sorted(uploaded + [file.path_remote for file in p.files_new]) == [
+        "__init__.py",
+        "requirements.txt",
+        "subdir/one.py",
+        "subdir/two.py",
+        "utils.py",
+    ]
+
+
+def test_plan_reuses_hash_of_unchanged_files(mocker, tmpdir):
+    """Verifies that files whose size, mtime and inode match the statefile are not hashed again"""
+    remote_path = "dbfs:/FileStore/packages/packagename"
+    pt = PlanTester(tmpdir, mocker)
+    pt.create_files()
+
+    plan_apply(tmpdir, remote_path, mocker.Mock())
+
+    pt.change_file(tmpdir / "package" / "utils.py", "different contents\n")
+    calc = mocker.patch("dbfsps.syncer.file.calculate_file_hash", side_effect=calculate_file_hash)
+
+    s = State(tmpdir, "package")
+    p = Plan(s, remote_path)
+
+    calc.assert_called_once_with(str(tmpdir / "package" / "utils.py"))
+    assert [file.path for file in p.files_updated] == ["utils.py"]
+    assert not p.files_new
+
+
+def test_plan_refresh(mocker, tmpdir):
+    """Verifies that refreshing a plan for a few paths only plans the changes to those paths"""
+    remote_path = "dbfs:/FileStore/packages/packagename"
+    pt = PlanTester(tmpdir, mocker)
+    pt.create_files()
+
+    s = State(tmpdir, "package")
+    p = Plan(s, remote_path)
+    p.apply_plan(mocker.Mock())
+    p.refresh([])
+    assert not p.has_changes()
+
+    pt.change_file(tmpdir / "package" / "utils.py", "different contents\n")
+    pt.change_file(tmpdir / "package" / "new.py", "new\n")
+    shutil.rmtree(tmpdir / "package" / "subdir")
+    p.refresh(["utils.py", "new.py", "subdir", "__pycache__"])
+
+    assert [file.path for file in p.files_updated] == ["utils.py"]
+    assert [file.path for file in p.files_new] == ["new.py"]
+    assert [file.path for file in p.files_deleted] == ["subdir/one.py", "subdir/two.py"]
+
+
+def test_plan_does_not_hash_new_files(mocker, tmpdir):
+    """Verifies that new files are not hashed when planning, since their hash is not compared with anything"""
+    remote_path = "dbfs:/FileStore/packages/packagename"
+    pt = PlanTester(tmpdir, mocker)
+    pt.create_files()
+    calc = mocker.patch("dbfsps.syncer.file.calculate_file_hash", side_effect=calculate_file_hash)
+
+    p = Plan(State(tmpdir, "package"), remote_path)
+
+    assert len(p.files_new) == 5
+    calc.assert_not_called()
+
+    p.apply_plan(mocker.Mock())
+
+    assert calc.call_count == 4
+
+
+def remote_listing(mocker, remote_path, sizes):
+    return [
+        mocker.Mock(dbfs_path=mocker.Mock(absolute_path=f"{remote_path}/{path}"), is_dir=False, file_size=size)
+        for path, size in sizes.items()
+    ]
+
+
+def test_plan_reconcile(mocker, tmpdir):
+    """Verifies that reconciling only plans uploads for files that are missing on DBFS or differ in size"""
+    remote_path = "dbfs:/FileStore/packages/packagename"
+    pt = PlanTester(tmpdir, mocker)
+    pt.create_files()
+    plan_apply(tmpdir, remote_path, mocker.Mock())
+
+    mock_dbfs = mocker.Mock()
+    mock_dbfs.ls.return_value = remote_listing(
+        mocker,
+        remote_path,
+        {"requirements.txt": 6, "__init__.py": 6, "utils.py": 100, "subdir/one.py": 6, "stray.py": 1},
+    )
+    p = Plan(State(tmpdir, "package"), remote_path)
+    assert not p.has_changes()
+    p.reconcile(mock_dbfs)
+
+    mock_dbfs.ls.assert_called_once_with(remote_path, recursive=True, workers=8)
+    assert [file.path for file in p.files_new] == ["utils.py", "subdir/two.py"]
+    assert not p.files_updated
+    assert not p.files_deleted
+
+
+def test_plan_reconcile_lost_statefile(mocker, tmpdir):
+    """Verifies that files already on DBFS with the right size are added to the state instead of uploaded"""
+    remote_path = "dbfs:/FileStore/packages/packagename"
+    pt = PlanTester(tmpdir, mocker)
+    pt.create_files()
+
+    mock_dbfs = mocker.Mock()
+    mock_dbfs.ls.return_value = remote_listing(
+        mocker, remote_path, {"requirements.txt": 6, "__init__.py": 6, "utils.py": 6}
+    )
+    s = State(tmpdir, "package")
+    p = Plan(s, remote_path)
+    p.reconcile(mock_dbfs)
+    p.apply_plan(mock_dbfs)
+
+    assert sorted(call.args[0] for call in mock_dbfs.cp.call_args_list) == [
+        str(tmpdir / "package" / "subdir" / "one.py"),
+        str(tmpdir / "package" / "subdir" / "two.py"),
+    ]
+    assert len(s.files) == 5
+
+
+def test_plan_remove_files_partial_dir(mocker, tmpdir):
+    """Verifies that files are removed one by one if their directory still contains other files"""
+    remote_path = "dbfs:/FileStore/packages/packagename"
+    pt = PlanTester(tmpdir, mocker)
+    pt.create_files()
+    os.makedirs(tmpdir / "package" / "subdir" / "nested" / "deeper")
+    pt.change_file(tmpdir / "package" / "subdir" / "nested" / "deeper" / "three.py", "three\n")
+    pt.change_file(tmpdir / "package" / "subdir" / "nested" / "four.py", "four\n")
+    plan_apply(tmpdir, remote_path, mocker.Mock())
+
+    os.remove(tmpdir / "package" / "subdir" / "one.py")
+    shutil.rmtree(tmpdir / "package" / "subdir" / "nested")
+    mock_dbfs = mocker.Mock()
+    mock_dbfs.ls.return_value = remote_listing(
+        mocker, remote_path, {"subdir/nested/deeper/three.py": 6, "subdir/nested/four.py": 5}
+    )
+    s = State(tmpdir, "package")
+    Plan(s, remote_path).apply_plan(mock_dbfs, jobs=4)
+
+    expected_calls = [
+        mocker.call(os.path.join(remote_path, "subdir/one.py")),
+        mocker.call(os.path.join(remote_path, "subdir/nested"), recursive=True),
+    ]
+    mock_dbfs.rm.assert_has_calls(expected_calls, any_order=True)
+    assert mock_dbfs.rm.call_count == 2
+    assert sorted(s.files.keys()) == ["../requirements.txt", "__init__.py", "subdir/two.py", "utils.py"]
+
+
+def test_plan_remove_files_keeps_unmanaged_files(mocker, tmpdir):
+    """Verifies that a directory that holds files dbfsps does not manage is not removed as a whole: its files are
+    removed one by one, and only the directories that end up empty are removed"""
+    remote_path = "dbfs:/FileStore/packages/packagename"
+    pt = PlanTester(tmpdir, mocker)
+    pt.create_files()
+    os.makedirs(tmpdir / "package" / "subdir" / "nested")
+    pt.change_file(tmpdir / "package" / "subdir" / "nested" / "three.py", "three\n")
+    plan_apply(tmpdir, remote_path, mocker.Mock())
+
+    shutil.rmtree(tmpdir / "package" / "subdir")
+    mock_dbfs = mocker.Mock()
+    mock_dbfs.ls.return_value = remote_listing(
+        mocker,
+        remote_path,
+        {"subdir/one.py": 4, "subdir/two.py": 4, "subdir/nested/three.py": 6, "subdir/notes.txt": 5},
+    )
+    s = State(tmpdir, "package")
+    Plan(s, remote_path).apply_plan(mock_dbfs, jobs=4)
+
+    expected_calls = [
+        mocker.call(os.path.join(remote_path, "subdir/one.py")),
+        mocker.call(os.path.join(remote_path, "subdir/two.py")),
+        mocker.call(os.path.join(remote_path, "subdir/nested/three.py")),
+        mocker.call(os.path.join(remote_path, "subdir/nested")),
+    ]
+    mock_dbfs.rm.assert_has_calls(expected_calls, any_order=True)
+    assert mock_dbfs.rm.call_count == 4
+    assert mock_dbfs.rm.call_args == mocker.call(os.path.join(remote_path, "subdir/nested"))
+    assert sorted(s.files.keys()) == ["../requirements.txt", "__init__.py", "utils.py"]
+
+
+def test_plan_remove_files_listing_fails(mocker, tmpdir):
+    """Verifies that files are removed one by one if their directory cannot be listed"""
+    remote_path = "dbfs:/FileStore/packages/packagename"
+    pt = PlanTester(tmpdir, mocker)
+    pt.create_files()
+    plan_apply(tmpdir, remote_path, mocker.Mock())
+
+    shutil.rmtree(tmpdir / "package" / "subdir")
+    mock_dbfs = mocker.Mock()
+    mock_dbfs.ls.side_effect = RuntimeError("listing failed")
+    plan_apply(tmpdir, remote_path, mock_dbfs)
+
+    expected_calls = [
+        mocker.call(os.path.join(remote_path, "subdir/one.py")),
+        mocker.call(os.path.join(remote_path, "subdir/two.py")),
+        mocker.call(os.path.join(remote_path, "subdir")),
+    ]
+    mock_dbfs.rm.assert_has_calls(expected_calls, any_order=True)
+    assert mock_dbfs.rm.call_count == 3
+
+
+def test_get_upload_dirs():
+    remote_path = "dbfs:/FileStore/packages/packagename"
+    paths = ["requirements.txt", "utils.py", "sub/one.py", "sub/deeper/two.py", "other/three.py"]
+    assert get_upload_dirs(remote_path, paths) == [f"{remote_path}/other", f"{remote_path}/sub/deeper"]
+    assert get_upload_dirs(remote_path, ["utils.py"]) == [remote_path]
+    assert get_upload_dirs(remote_path, []) == []
+
+
+def test_plan_creates_remote_dirs(mocker, tmpdir):
+    """Verifies that the directories needed for the uploads are created once, before uploading"""
+    remote_path = "dbfs:/FileStore/packages/packagename"
+    pt = PlanTester(tmpdir, mocker)
+    pt.create_files()
+
+    mock_dbfs = mocker.Mock()
+    mock_dbfs.cp.side_effect = lambda *args, **kwargs: mock_dbfs.mkdirs.assert_called_once()
+    plan_apply(tmpdir, remote_path, mock_dbfs)
+
+    mock_dbfs.mkdirs.assert_called_once_with(os.path.join(remote_path, "subdir"))
+
+
+def test_plan_sqlite_state_uses_lookups(mocker, tmpdir):
+    """Verifies that a plan on an SQLite state compares the local files with single lookups, without loading every
+    file in the state, and stores the changes"""
+    remote_path = "dbfs:/FileStore/packages/packagename"
+    pt = PlanTester(tmpdir, mocker)
+    pt.create_files()
+    Plan(State(tmpdir, "package", backend="sqlite"), remote_path).apply_plan(mocker.Mock())
+
+    pt.change_file(tmpdir / "package" / "utils.py", "changed\n")
+    pt.change_file(tmpdir / "package" / "new.py", "new\n")
+    os.remove(tmpdir / "package" / "subdir" / "two.py")
+    load = mocker.patch("dbfsps.syncer.backends.SqliteStateBackend.load")
+    hash_file = mocker.patch("dbfsps.syncer.file.calculate_file_hash", side_effect=calculate_file_hash)
+    s = State(tmpdir, "package", backend="sqlite")
+    p = Plan(s, remote_path)
+
+    assert [file.path for file in p.files_new] == ["new.py"]
+    assert [file.path for file in p.files_updated] == ["utils.py"]
+    assert [file.path for file in p.files_deleted] == ["subdir/two.py"]
+    # Only the changed file is hashed, the hashes of the other files are read from the state
+    assert [os.path.basename(call.args[0]) for call in hash_file.call_args_list] == ["utils.py"]
+
+    p.apply_plan(mocker.Mock())
+
+    load.assert_not_called()
+    assert not s.loaded
+    assert sorted(s.paths()) == ["../requirements.txt", "__init__.py", "new.py", "subdir/one.py", "utils.py"]
+    assert s.lookup("utils.py").hash == calculate_file_hash(str(tmpdir / "package" / "utils.py"))
@@ -0,0 +1,68 @@
+import os
+from dbfsps.syncer.scanner import ScanRules, scan_files
+
+
+def create_tree(root, paths):
+    for path in paths:
+        path_abs = os.path.join(root, path)
+        os.makedirs(os.path.dirname(path_abs), exist_ok=True)
+        with open(path_abs, "w") as f:
+            f.write("line1\n")
+
+
+def test_scan_files_default_rules(tmpdir):
+    create_tree(
+        tmpdir,
+        [
+            "__init__.py",
+            "sub/module.py",
+            "sub/__pycache__/module.cpython-39.pyc",
+            "sub/__pycache__/nested/file.pyc",
+            ".pytest_cache/v/cache",
+            "package.egg-info/PKG-INFO",
+        ],
+    )
+
+    found = sorted(relpath for relpath, _, _ in scan_files(str(tmpdir), ScanRules()))
+
+    assert found == ["__init__.py", os.path.join("sub", "module.py")]
+
+
+def test_scan_files_prunes_excluded_dirs(mocker, tmpdir):
+    """Excluded directories should not be opened at all"""
+    create_tree(tmpdir, ["a.py", "data/big/file.csv", "sub/b.py"])
+    scandir = mocker.spy(os, "scandir")
+
+    found = sorted(relpath for relpath, _, _ in scan_files(str(tmpdir), ScanRules(exclude=["data"])))
+
+    assert found == ["a.py", os.path.join("sub", "b.py")]
+    scanned = [call.args[0] for call in scandir.call_args_list]
+    assert os.path.join(str(tmpdir), "data") not in scanned
+
+
+def test_scan_files_include_and_path_patterns(tmpdir):
+    create_tree(tmpdir, ["a.py", "notes.txt", "sub/b.py", "sub/fixtures/c.py"])
+    rules = ScanRules(include=["*.py"], exclude=["sub/fixtures"])
+
+    found = sorted(relpath for relpath, _, _ in scan_files(str(tmpdir), rules))
+
+    assert found == ["a.py", os.path.join("sub", "b.py")]
+
+
+def test_scan_files_max_file_size(tmpdir):
+    create_tree(tmpdir, ["small.py"])
+    with open(os.path.join(tmpdir, "large.bin"), "wb") as f:
+        f.write(b"0" * 100)
+
+    found = [(relpath, stats.size) for relpath, _, stats in scan_files(str(tmpdir), ScanRules(max_file_size=50))]
+
+    assert found == [("small.py", 6)]
+
+
+def test_scan_rules_from_config():
+    rules = ScanRules.from_config({"include": ["*.py"], "exclude": ["data"], "max-file-size": 1024})
+
+    assert rules.include == ["*.py"]
+    assert "data" in rules.exclude
+    assert "__pycache__" in rules.exclude
+    assert rules.max_file_size == 1024
@@ -1,4 +1,5 @@
 import os
+from dbfsps.syncer.file import FileStats
 from dbfsps.syncer.state import State
 
 
@@ -52,3 +53,21 @@ def test_state_store(tmpdir):
                 assert line.split(",")[1].strip() == "anewhash"
             if "path/file3.p" in line:
                 assert line.split(",")[1].strip() == "alsoanewhash"
+
+
+def test_state_file_stats(tmpdir):
+    """Ensure that file stats are loaded when present and written back to the statefile"""
+    path_package = os.path.join("rel", "path", "to", "package")
+    statefilepath = os.path.join(tmpdir, ".dbfsps_file_status")
+    with open(statefilepath, "w") as f:
+        f.writelines(["file1.py,123,10,1000,42\n", "file2.py,124\n"])
+
+    s = State(tmpdir, path_package)
+
+    assert s.files["file1.py"].stats == FileStats(10, 1000, 42)
+    assert s.files["file2.py"].stats is None
+
+    s.store_state()
+
+    with open(statefilepath, "r") as f:
+        assert sorted(f.readlines()) == ["file1.py,123,10,1000,42\n", "file2.py,124\n"]
@@ -0,0 +1,69 @@
+import os
+from dbfsps.syncer.file import File
+from dbfsps.syncer.tree import FileTree, diff_trees
+
+
+def tree(hashes: dict) -> FileTree:
+    return FileTree({path: File(path, "package", "/root", hashstr=hashstr) for path, hashstr in hashes.items()})
+
+
+def p(*parts) -> str:
+    return os.path.join(*parts)
+
+
+def test_digest_is_rolled_up():
+    """Directories with the same files have the same hash, and a change below a directory changes its hash"""
+    hashes = {"a.py": "1", p("sub", "b.py"): "2", p("sub", "deep", "c.py"): "3", p("other", "d.py"): "4"}
+    local = tree(hashes)
+    remote = tree(dict(reversed(list(hashes.items()))))
+    assert local.digest() == remote.digest()
+    other_digest = local.digest("other")
+
+    local[p("sub", "deep", "c.py")] = File(p("sub", "deep", "c.py"), "package", "/root", hashstr="changed")
+
+    assert local.digest() != remote.digest()
+    assert local.digest("sub") != remote.digest("sub")
+    assert local.digest("other") == other_digest
+
+
+def test_digest_unknown_without_hash():
+    local = tree({"a.py": "1"})
+    local[p("sub", "new.py")] = File(p("sub", "new.py"), "package", "/root")
+
+    assert local.digest("sub") is None
+    assert local.digest() is None
+    assert local.digest("missing") is None
+
+
+def test_directories_follow_files():
+    local = tree({p("sub", "deep", "a.py"): "1", p("sub", "b.py"): "2"})
+    assert local.subdirs("") == {"sub"}
+    assert sorted(local.walk("sub")) == [p("sub", "b.py"), p("sub", "deep", "a.py")]
+
+    del local[p("sub", "deep", "a.py")]
+    assert not local.has_dir(p("sub", "deep"))
+    assert local.pop(p("sub", "b.py")).hash == "2"
+    assert local.subdirs("") == set()
+    assert local.digest() == tree({}).digest()
+
+
+def test_diff_trees():
+    remote = tree({"a.py": "1", p("same", "b.py"): "2", p("gone", "c.py"): "3", p("sub", "d.py"): "4"})
+    local = tree({"a.py": "1", p("same", "b.py"): "2", p("new", "e.py"): "5", p("sub", "d.py"): "changed"})
+
+    new, updated, deleted = diff_trees(local, remote)
+
+    assert new == [p("new", "e.py")]
+    assert updated == [p("sub", "d.py")]
+    assert deleted == [p("gone", "c.py")]
+    assert diff_trees(remote, FileTree(remote)) == ([], [], [])
+
+
+def test_diff_trees_skips_unchanged_directories(mocker):
+    """Files in directories with the same hash are not compared one by one"""
+    remote = tree({p("same", "b.py"): "2", p("sub", "d.py"): "4"})
+    local = tree({p("same", "b.py"): "2", p("sub", "d.py"): "changed"})
+    compare = mocker.spy(File, "__ne__")
+
+    assert diff_trees(local, remote) == ([], [p("sub", "d.py")], [])
+    assert compare.call_count == 1
@@ -0,0 +1,67 @@
+import os
+import sys
+import pytest
+from dbfsps.syncer.scanner import ScanRules
+from dbfsps.syncer.watch import InotifyEventSource, PollingEventSource, Watcher
+
+
+def write(path, contents="line1\n"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(contents)
+
+
+def collect(source, timeout=0.5):
+    changed = source.wait(timeout)
+    more = source.wait(0.1)
+    while more:
+        changed |= more
+        more = source.wait(0.1)
+    return changed
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is only available on Linux")
+def test_inotify_event_source(tmpdir):
+    package = str(tmpdir)
+    write(os.path.join(package, "a.py"))
+    write(os.path.join(package, "__pycache__", "a.pyc"))
+    source = InotifyEventSource(package, ScanRules())
+
+    write(os.path.join(package, "a.py"), "changed\n")
+    write(os.path.join(package, "__pycache__", "a.pyc"), "changed\n")
+    os.makedirs(os.path.join(package, "sub"))
+    changed = collect(source)
+    write(os.path.join(package, "sub", "b.py"))
+    changed |= collect(source)
+    source.close()
+
+    assert changed == {"a.py", "sub", os.path.join("sub", "b.py")}
+
+
+def test_polling_event_source(tmpdir):
+    package = str(tmpdir)
+    write(os.path.join(package, "a.py"))
+    write(os.path.join(package, "b.py"))
+    source = PollingEventSource(package, ScanRules(), interval=0.01)
+
+    write(os.path.join(package, "a.py"), "changed\n")
+    os.remove(os.path.join(package, "b.py"))
+    write(os.path.join(package, "sub", "c.py"))
+
+    assert source.wait(1) == {"a.py", "b.py", os.path.join("sub", "c.py")}
+    assert source.wait(0.05) == set()
+
+
+def test_watcher_sync(mocker, tmpdir):
+    """Only the touched files should be uploaded or removed"""
+    mock_plan = mocker.Mock()
+    mock_plan.state.packagepath = str(tmpdir)
+    mock_plan.rules = ScanRules()
+    mock_dbfs = mocker.Mock()
+
+    w = Watcher(mock_plan, mock_dbfs, jobs=2)
+    w.sync({"a.py"})
+
+    mock_plan.refresh.assert_any_call({"a.py"})
+    mock_plan.apply_plan.assert_called_once_with(mock_dbfs, jobs=2)
+    w.source.close()
@@ -0,0 +1,102 @@
+import json
+import pytest
+from dbfsps import stats
+from dbfsps.cli.databricks_sync import write_stats_report
+
+
+class RecordingHook(stats.StatsHook):
+    def __init__(self):
+        self.phases = []
+        self.api_calls = []
+        self.reports = []
+
+    def on_phase(self, name, seconds):
+        self.phases.append(name)
+
+    def on_api_call(self, endpoint, seconds, status):
+        self.api_calls.append((endpoint, status))
+
+    def on_report(self, report):
+        self.reports.append(report)
+
+
+recording_hook = RecordingHook()
+
+
+@pytest.fixture
+def collector():
+    collector = stats.StatsCollector()
+    stats.set_collector(collector)
+    yield collector
+    stats.set_collector(None)
+
+
+def test_module_functions_without_collector():
+    with stats.phase("scan"):
+        stats.count("files_scanned")
+        stats.record_api_call("dbfs/put", 0.1, 200)
+    assert stats.get_collector() is None
+
+
+def test_collector_report(collector):
+    with stats.phase("apply"):
+        with stats.phase("upload"):
+            pass
+    with stats.phase("upload"):
+        pass
+    stats.count("bytes_uploaded", 100)
+    stats.count("bytes_uploaded", 50)
+    stats.count("files_uploaded")
+    for seconds in [0.4, 0.1, 0.3, 0.2]:
+        stats.record_api_call("dbfs/put", seconds, 200)
+    stats.record_api_call("dbfs/put", 0.5, 429)
+
+    report = collector.report()
+    assert set(report["phases"]) == {"apply", "upload"}
+    assert report["counters"] == {"bytes_uploaded": 150, "files_uploaded": 1}
+    assert report["api_calls"] == {
+        "dbfs/put": {
+            "count": 5,
+            "statuses": {"200": 4, "429": 1},
+            "latency": {"p50": 0.3, "p90": 0.5, "p99": 0.5, "max": 0.5},
+        }
+    }
+    json.dumps(report)
+
+
+def test_latency_percentiles():
+    assert stats.latency_percentiles([]) == {}
+    assert stats.latency_percentiles([1.0]) == {"p50": 1.0, "p90": 1.0, "p99": 1.0, "max": 1.0}
+    latencies = [i / 100 for i in range(1, 101)]
+    assert stats.latency_percentiles(latencies) == {"p50": 0.5, "p90": 0.9, "p99": 0.99, "max": 1.0}
+
+
+def test_hooks():
+    hook = RecordingHook()
+    collector = stats.StatsCollector(hooks=[hook])
+    with collector.phase("plan"):
+        collector.record_api_call("dbfs/list", 0.1, None)
+    report = collector.report()
+    assert hook.phases == ["plan"]
+    assert hook.api_calls == [("dbfs/list", None)]
+    assert hook.reports == [report]
+    assert report["api_calls"]["dbfs/list"]["statuses"] == {"None": 1}
+
+
+def test_load_hook():
+    assert stats.load_hook("tests.test_stats:recording_hook") is recording_hook
+    assert isinstance(stats.load_hook("tests.test_stats:RecordingHook"), RecordingHook)
+    with pytest.raises(ValueError):
+        stats.load_hook("tests.test_stats")
+
+
+def test_write_stats_report(tmpdir, capsys, collector):
+    stats.count("files_hashed", 3)
+    path = str(tmpdir / "stats.json")
+    write_stats_report(collector, True, path)
+
+    assert stats.get_collector() is None
+    with open(path) as f:
+        report = json.load(f)
+    assert report["counters"] == {"files_hashed": 3}
+    assert json.loads(capsys.readouterr().out) == report